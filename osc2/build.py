@@ -9,7 +9,8 @@ from lxml import etree
 
 from osc2.remote import RORemoteFile, RWRemoteFile
 from osc2.util.io import copy_file
-from osc2.util.xml import fromstring, OscElement
+from osc2.util.xml import (fromstring, OscElement, ReadOnlyElement,
+                           parse_readonly, ElementStream)
 from osc2.util.cpio import CpioArchive
 from osc2.core import Osc
 
@@ -46,23 +47,40 @@ class BinaryList(OscElement):
         return request.get(path, **kwargs)
 
     @staticmethod
-    def _create_xml(project, repository, arch, package, **kwargs):
+    def _create_xml(project, repository, arch, package, readonly=False,
+                    stream=False, **kwargs):
         """Creates and returns a new BinaryList object.
 
         Keyword arguments:
+        readonly -- if True, a ReadOnlyBinaryList object is returned
+                    (default: False)
+        stream -- if True, an ElementStream which yields the Binary
+                  objects is returned (default: False)
         kwargs -- optional parameters for the http request (like query
                   parameters)
 
         """
+        if readonly and stream:
+            raise ValueError('readonly and stream are mutually exclusive')
         if 'schema' not in kwargs:
             kwargs['schema'] = BinaryList.SCHEMA
         f = BinaryList._perform_request(project, repository, arch, package,
                                         **kwargs)
-        bl = fromstring(f.read(), binarylist=BinaryList, binary=Binary)
-        bl.set('project', project)
-        bl.set('package', package)
-        bl.set('repository', repository)
-        bl.set('arch', arch)
+        if stream:
+            # the data is needed by the binary's file method
+            annotate = {'project': project, 'package': package,
+                        'repository': repository, 'arch': arch}
+            return ElementStream(f, 'binary', annotate=annotate,
+                                 binarylist=BinaryList, binary=Binary)
+        if readonly:
+            bl = parse_readonly(f.read(), binarylist=ReadOnlyBinaryList,
+                                binary=ReadOnlyBinary)
+        else:
+            bl = fromstring(f.read(), binarylist=BinaryList, binary=Binary)
+        bl.attrib['project'] = project
+        bl.attrib['package'] = package
+        bl.attrib['repository'] = repository
+        bl.attrib['arch'] = arch
         return bl
 
     @staticmethod
@@ -79,13 +97,19 @@ class BinaryList(OscElement):
         return CpioArchive(fobj=f)
 
     @staticmethod
-    def create(project, repository, arch, package='_repository', **kwargs):
+    def create(project, repository, arch, package='_repository',
+               readonly=False, stream=False, **kwargs):
         """Creates a new BinaryList object.
 
         project, repository and arch parameters are required.
 
         Keyword arguments:
         package -- specify an optional package (default: '_repository')
+        readonly -- if True, a ReadOnlyBinaryList object is returned
+                    (ignored for the cpio view) (default: False)
+        stream -- if True, an ElementStream which yields the Binary
+                  objects is returned (ignored for the cpio view)
+                  (default: False)
         kwargs -- optional parameters for the http request (like query
                   parameters)
 
@@ -95,11 +119,12 @@ class BinaryList(OscElement):
             return BinaryList._create_cpio(project, repository, arch, package,
                                            **kwargs)
         return BinaryList._create_xml(project, repository, arch, package,
-                                      **kwargs)
+                                      readonly, stream, **kwargs)
 
 
-class Binary(OscElement):
-    """Represents a binary tag + some additional data"""
+class BinaryMixin(object):
+    """Provides the file method for a binary tag."""
+    __slots__ = ()
 
     def file(self, **kwargs):
         """Returns a RORemoteFile object.
@@ -121,6 +146,37 @@ class Binary(OscElement):
         return RORemoteFile(path, **kwargs)
 
 
+class Binary(BinaryMixin, OscElement):
+    """Represents a binary tag + some additional data"""
+    pass
+
+
+class ReadOnlyStatus(ReadOnlyElement):
+    """Represents a read-only status tag"""
+    __slots__ = ()
+    objectify_class = Status
+
+    def __getattr__(self, name):
+        try:
+            return super(ReadOnlyStatus, self).__getattr__(name)
+        except AttributeError:
+            if name == 'details':
+                return ''
+            raise
+
+
+class ReadOnlyBinaryList(ReadOnlyElement):
+    """Represents a read-only binarylist + some additional data"""
+    __slots__ = ()
+    objectify_class = BinaryList
+
+
+class ReadOnlyBinary(BinaryMixin, ReadOnlyElement):
+    """Represents a read-only binary tag + some additional data"""
+    __slots__ = ()
+    objectify_class = Binary
+
+
 class BuildResult(object):
     """Provides methods to access the remote build result"""
     RESULT_SCHEMA = ''
@@ -156,6 +212,10 @@ class BuildResult(object):
         package -- limit results to package (default: '')
         repository -- limit results repository
         arch -- limit results to arch
+        readonly -- if True, the result is parsed into ReadOnlyElement
+                    objects (default: False)
+        stream -- if True, an ElementStream which yields the result
+                  elements is returned (default: False)
         kwargs -- optional arguments for the http request
         Note: package, repository and arch may override the
         current package, repository and arch instance attributes.
@@ -164,12 +224,20 @@ class BuildResult(object):
         package = kwargs.pop('package', self.package)
         repository = kwargs.pop('repository', self.repository)
         arch = kwargs.pop('arch', self.arch)
+        readonly = kwargs.pop('readonly', False)
+        stream = kwargs.pop('stream', False)
+        if readonly and stream:
+            raise ValueError('readonly and stream are mutually exclusive')
         request = Osc.get_osc().get_reqobj()
         path = "/build/%s/_result" % self.project
         if 'schema' not in kwargs:
             kwargs['schema'] = BuildResult.RESULT_SCHEMA
         f = request.get(path, package=package, repository=repository,
                         arch=arch, **kwargs)
+        if stream:
+            return ElementStream(f, 'result', status=Status)
+        if readonly:
+            return parse_readonly(f.read(), status=ReadOnlyStatus)
         results = fromstring(f.read(), status=Status)
         return results
 
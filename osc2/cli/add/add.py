@@ -3,6 +3,7 @@
 from collections import Sequence
 
 from osc2.cli.cli import illegal_options
+from osc2.wc.util import wc_batch
 
 
 def add(path, info):
@@ -34,8 +35,9 @@ def add_files(pkg, info, *filenames):
     """
     if not filenames:
         raise ValueError("At least one filename is required")
-    for filename in filenames:
-        pkg.add(filename)
+    with wc_batch(pkg.path):
+        for filename in filenames:
+            pkg.add(filename)
 
 
 def add_package(prj, package, info):
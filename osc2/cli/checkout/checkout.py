@@ -69,6 +69,11 @@ class WCCheckoutController(WCUpdateController):
                 wc, todo, checkout_pkg = self._inspect_path(path)
                 if checkout_pkg:
                     self._checkout_package(wc.apiurl, wc.path, todo[0], info)
+                elif (path.filename is not None
+                        and wc.status(path.filename) == 'S'):
+                    # fetch a skipped file (for instance, a file of a
+                    # sparse checkout)
+                    wc.materialize(path.filename)
                 else:
                     wc.revert(*todo)
         if info.get('package') is not None:
@@ -77,6 +82,11 @@ class WCCheckoutController(WCUpdateController):
         elif info.get('project') is not None:
             self._checkout_project(info)
 
+    def _update_project(self, prj, info, *packages):
+        """Checks out the packages (with the sparse patterns)."""
+        query = self._build_query(info)
+        prj.update(*packages, jobs=info.jobs, sparse=info.sparse, **query)
+
     @at_most(1, 'package', msg="At most one remote argument allowed.")
     def _checkout_package(self, apiurl, project, package, info):
         tl = RendererUpdateTransactionListener(self._renderer)
@@ -11,13 +11,17 @@ class Checkout(CommandDescription, OscCommand):
     Examples:
     osc2 checkout api://project                 # checkout project
     osc2 checkout api://project/package         # checkout package
+    osc2 checkout -s '*.tar.*' api://project/package
+                                                # checkout package, the
+                                                  tarballs are fetched lazily
     osc2 checkout /path/to/project              # revert all local
                                                   modifications in the project
                                                   working copy
     osc2 checkout /path/to/project/package      # revert all local
                                                   modifications in the package
                                                   working copy
-    osc2 checkout /path/to/project/package/file # revert the file file
+    osc2 checkout /path/to/project/package/file # revert the file file (a
+                                                  skipped file is fetched)
 
     """
     cmd = 'checkout'
@@ -26,4 +30,10 @@ class Checkout(CommandDescription, OscCommand):
                         action='store_true')
     opt_revision = Option('r', 'revision', 'list revision',
                           default='latest')
+    opt_jobs = Option('j', 'jobs', 'check out JOBS packages concurrently',
+                      type=int, default=1)
+    opt_sparse = Option('s', 'sparse',
+                        'skip the files which match PATTERN (they are '
+                        'fetched on demand)', metavar='PATTERN',
+                        action='append', default=[])
     func = call(WCCheckoutController().checkout)
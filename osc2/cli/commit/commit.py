@@ -74,7 +74,8 @@ class WCCommitController(object):
         if message is None:
             message = self._message(pkg, filenames)
         if prj is not None:
-            prj.commit(package_filenames=todo, comment=message)
+            prj.commit(package_filenames=todo, comment=message,
+                       jobs=info.jobs)
         else:
             pkg.commit(*filenames, comment=message)
 
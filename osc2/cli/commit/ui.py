@@ -18,4 +18,6 @@ class Commit(CommandDescription, OscCommand):
     cmd = 'commit'
     args = '(wc_path)?'
     opt_message = Option('m', 'message', 'specify a message')
+    opt_jobs = Option('j', 'jobs', 'commit JOBS packages concurrently',
+                      type=int, default=1)
     func = call(WCCommitController().commit)
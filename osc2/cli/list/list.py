@@ -32,7 +32,7 @@ def list_package(renderer, project, package, info):
         query['deleted'] = '1'
     if info.meta:
         query['meta'] = '1'
-    directory = pkg.list(**query)
+    directory = pkg.list(readonly=True, **query)
     renderer.render(FILE_LIST_TEMPLATE, directory=directory, info=info)
 
 
@@ -1,17 +1,20 @@
 """Provides various functions for the "request" command."""
 
+import os
 import logging
 
 from osc2.httprequest import HTTPError
 from osc2.util.xpath import XPathBuilder
 from osc2.remote import Request
 from osc2.search import find_request
+from osc2.requestindex import RequestIndex
 from osc2.cli.util.env import run_pager, edit_message
 from osc2.cli.util.shell import AbstractShell, ShellSyntaxError
 
 
 LIST_TEMPLATE = 'request/request_list.jinja2'
 SHOW_TEMPLATE = 'request/request_show.jinja2'
+REQUEST_INDEX = '~/.osc2_request_index.db'
 
 
 def logger():
@@ -19,6 +22,18 @@ def logger():
     return logging.getLogger(__name__)
 
 
+def request_index(apiurl):
+    """Returns a RequestIndex object for the apiurl.
+
+    The location of the index can be changed via the
+    env variable $OSC_REQUEST_INDEX.
+
+    """
+    global REQUEST_INDEX
+    filename = os.environ.get('OSC_REQUEST_INDEX', REQUEST_INDEX)
+    return RequestIndex(os.path.expanduser(filename), apiurl)
+
+
 class AbstractRequestController(object):
     """Abstract base class for working with requests.
 
@@ -114,6 +129,8 @@ class RequestController(AbstractRequestController):
         request = Request.find(reqid)
         cls._change_request_state(renderer, request, method, message, info,
                                   supersede_id)
+        # keep the local index up to date
+        request_index(info.apiurl).add(request)
 
     @classmethod
     def create(cls, renderer, submit, changedevel, role, grouprole, delete,
@@ -178,28 +195,45 @@ class RequestController(AbstractRequestController):
 
     @classmethod
     def _find_requests(cls, project, package, info):
-        """Returns a collection of requests."""
+        """Returns a collection of requests.
+
+        The requests are retrieved from the local request index.
+        The index is only synced with the server if the query was
+        never issued before or if a refresh was requested.
+
+        """
         xpb = XPathBuilder(is_relative=True)
         xp = xpb.dummy()
         # state has at least one element
         for state in info.state:
             xp = xp | xpb.state.attr('name') == state
         xp = xp.parenthesize()
+        # the requests whose state changed are only restricted by
+        # the user, project and package (see RequestIndex.sync)
+        changes = xpb.dummy()
         if info.user is not None:
-            xp = xp & ((xpb.state.attr('who') == info.user)
-                       | (xpb.history.attr('who') == info.user)).parenthesize()
+            changes = changes & ((xpb.state.attr('who') == info.user)
+                                 | (xpb.history.attr('who') == info.user)
+                                 ).parenthesize()
         if project is not None:
             tmp = ((xpb.action.target.attr('project') == project)
                    | (xpb.action.source.attr('project') == project))
-            xp = xp & tmp.parenthesize()
+            changes = changes & tmp.parenthesize()
         if package is not None:
             tmp = ((xpb.action.target.attr('package') == package)
                    | (xpb.action.source.attr('package') == package))
-            xp = xp & tmp.parenthesize()
+            changes = changes & tmp.parenthesize()
+        changes_scope = ''
+        if changes:
+            changes_scope = changes.tostring()
+        xp = xp & changes
         logger().debug(xp.tostring())
-        res = find_request(xp=xp, apiurl=info.apiurl)
-        collection = [r for r in res]
-        return collection
+        index = request_index(info.apiurl)
+        scope = xp.tostring()
+        if info.refresh or not index.is_synced(scope):
+            index.sync(scope, changes=changes_scope)
+        return index.find(info.state, info.user, project, package,
+                          scope=scope)
 
 
 class AbstractRequestShell(AbstractShell):
@@ -21,6 +21,11 @@ class RequestList(CommandDescription, Request):
     osc request list api://
     osc request list api://project
     osc request list api://project/package
+    osc request list api://project --refresh
+
+    Requests are listed from a local request index. The index is
+    only synced with the server if the query is issued for the
+    first time or if --refresh is specified.
 
     """
     cmd = 'list'
@@ -34,6 +39,8 @@ class RequestList(CommandDescription, Request):
     opt_interactive = Option('i', 'interactive',
                              'start an interactive request shell',
                              action='store_true')
+    opt_refresh = Option('', 'refresh', 'sync the local request index',
+                         action='store_true')
     func = call(RequestController.list)
     func_defaults = {'shell_cls': RequestShell}
 
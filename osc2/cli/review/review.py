@@ -116,7 +116,7 @@ class BaseReviewController(AbstractRequestController):
         if tgt_package is not None:
             xp = xp & (xpb.action.target.attr('package') == tgt_package)
         logger().debug(xp.tostring())
-        res = find_request(xp=xp, apiurl=info.apiurl)
+        res = find_request(xp=xp, stream=True, apiurl=info.apiurl)
         collection = [r for r in res]
         return collection
 
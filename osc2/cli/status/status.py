@@ -51,7 +51,7 @@ def _project_status(renderer, prj, info):
                             package=package, package_state=package_state,
                             info=info, path_prefix='')
         else:
-            _package_status(renderer, prj, prj.package(package), info)
+            _package_status(renderer, prj, pkg, info)
 
 
 def _package_states(pkg, *filenames, **kwargs):
@@ -70,4 +70,4 @@ def _package_states(pkg, *filenames, **kwargs):
         # collect unversioned files and directories
         filenames.extend([i for i in os.listdir(kwargs.get('path', os.curdir))
                           if not i.startswith('.') and i not in filenames])
-    return dict([[filename, pkg.status(filename)] for filename in filenames])
+    return pkg.statuses(*filenames)
@@ -20,4 +20,6 @@ class Update(CommandDescription, OscCommand):
                         action='store_true')
     opt_revision = Option('r', 'revision', 'list revision',
                           default='latest')
+    opt_jobs = Option('j', 'jobs', 'update JOBS packages concurrently',
+                      type=int, default=1)
     func = call(WCUpdateController().update)
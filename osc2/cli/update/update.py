@@ -86,7 +86,7 @@ class WCUpdateController(object):
     def _update_project(self, prj, info, *packages):
         """Updates a project wc."""
         query = self._build_query(info)
-        prj.update(*packages, **query)
+        prj.update(*packages, jobs=info.jobs, **query)
 
     def _update_package(self, pkg, info):
         """Updates a package wc."""
@@ -0,0 +1,23 @@
+"""Defines the watch command."""
+
+from osc2.cli.cli import OscCommand, call
+from osc2.cli.description import CommandDescription
+from osc2.cli.watch.watch import watch
+
+
+class Watch(CommandDescription, OscCommand):
+    """Watch a project or package working copy (linux only).
+
+    The changes are recorded in the working copy's storedir so
+    that a status computation only has to examine the files which
+    changed since the last one. The command runs until it is
+    interrupted.
+
+    Examples:
+    osc watch                          # in a project or package wc
+    osc watch /path/to/wc              # watch the wc
+
+    """
+    cmd = 'watch'
+    args = '(wc_path)?'
+    func = call(watch)
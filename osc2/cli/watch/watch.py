@@ -0,0 +1,16 @@
+"""Provides a function to watch a wc."""
+
+from osc2.wc.watch import WCWatcher
+
+
+def watch(renderer, path):
+    """Watches the wc until the command is interrupted."""
+    wc_path = path.package_path
+    if path.package is None:
+        wc_path = path.project_path
+    watcher = WCWatcher(wc_path)
+    renderer.render_text("watching \"%s\" (press ctrl-c to stop)" % wc_path)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,274 @@
+"""This module provides a local index of requests.
+
+The index is backed by a sqlite database and is populated via
+find_request. Subsequent syncs only retrieve requests which were
+created or whose state changed since the last sync. Queries can be
+answered locally (no http request is needed).
+
+Example usage:
+ index = RequestIndex('/path/to/index.db', 'https://api.opensuse.org')
+ changes = 'action/target/@project = "prj"'
+ xp = '(state/@name = "new") and (%s)' % changes
+ if not index.is_synced(xp):
+     index.sync(xp, changes=changes)
+ requests = index.find(states=['new'], project='prj', scope=xp)
+"""
+
+import sqlite3
+
+from osc2.remote import Request
+from osc2.search import find_request
+
+__all__ = ['RequestIndex']
+
+
+class RequestIndex(object):
+    """Represents a local index of requests.
+
+    A sync is always done for a so called scope. The scope is
+    the xpath which is used to search the requests on the server.
+    For each scope the highest request id and the latest state
+    change timestamp are recorded. A subsequent sync of the same
+    scope only retrieves new requests and requests whose state
+    changed in the meantime.
+
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS request (
+            apiurl TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            state TEXT,
+            state_when TEXT,
+            xml TEXT NOT NULL,
+            PRIMARY KEY (apiurl, id)
+        );
+        CREATE TABLE IF NOT EXISTS request_user (
+            apiurl TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            who TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS request_user_who
+            ON request_user (apiurl, who);
+        CREATE INDEX IF NOT EXISTS request_user_id
+            ON request_user (apiurl, id);
+        CREATE TABLE IF NOT EXISTS request_action (
+            apiurl TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            project TEXT,
+            package TEXT
+        );
+        CREATE INDEX IF NOT EXISTS request_action_project
+            ON request_action (apiurl, project);
+        CREATE INDEX IF NOT EXISTS request_action_package
+            ON request_action (apiurl, package);
+        CREATE INDEX IF NOT EXISTS request_action_id
+            ON request_action (apiurl, id);
+        CREATE TABLE IF NOT EXISTS sync (
+            apiurl TEXT NOT NULL,
+            scope TEXT NOT NULL,
+            max_id INTEGER NOT NULL,
+            last_when TEXT NOT NULL,
+            PRIMARY KEY (apiurl, scope)
+        );
+        CREATE TABLE IF NOT EXISTS request_scope (
+            apiurl TEXT NOT NULL,
+            scope TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            PRIMARY KEY (apiurl, scope, id)
+        );
+    """
+
+    def __init__(self, filename, apiurl):
+        """Constructs a new RequestIndex object.
+
+        filename is the path to the sqlite database (it is created
+        if it does not exist). apiurl is the apiurl of the requests
+        which are stored in and retrieved from the index.
+
+        """
+        super(RequestIndex, self).__init__()
+        self.apiurl = apiurl
+        self._conn = sqlite3.connect(filename)
+        cur = self._conn.execute('SELECT 1 FROM sqlite_master WHERE '
+                                 'type = "table" AND name = "request_scope"')
+        migrate = cur.fetchone() is None
+        self._conn.executescript(RequestIndex.SCHEMA)
+        if migrate:
+            # the requests of the already synced scopes are unknown
+            with self._conn:
+                self._conn.execute('DELETE FROM sync')
+
+    def is_synced(self, scope):
+        """Return True if scope was synced at least once."""
+        return self._sync_data(scope) is not None
+
+    def _sync_data(self, scope):
+        """Return a (max_id, last_when) tuple or None."""
+        cur = self._conn.execute(
+            'SELECT max_id, last_when FROM sync WHERE apiurl = ? '
+            'AND scope = ?', (self.apiurl, scope))
+        return cur.fetchone()
+
+    def sync(self, scope, changes=None, **kwargs):
+        """Sync the index with the server.
+
+        scope is a xpath str which restricts the requests that are
+        synced. Only requests which were created or whose state
+        changed since the last sync of scope are retrieved (if scope
+        was never synced before all requests which match scope are
+        retrieved). The retrieved requests are associated with scope
+        (see find).
+        Return the number of retrieved requests.
+
+        Keyword arguments:
+        changes -- a xpath str which restricts the requests whose
+                   state changed since the last sync; it should not
+                   filter by state, because a request whose state
+                   changed does not necessarily match the scope
+                   anymore (for instance, if it was accepted); an
+                   empty str means no restriction (default: None,
+                   that is scope is used)
+        **kwargs -- optional parameters for the http request
+
+        """
+        data = self._sync_data(scope)
+        xp = scope
+        max_id = 0
+        last_when = ''
+        if changes is None:
+            changes = scope
+        if data is not None:
+            max_id, last_when = data
+            changed = "state/@when >= \"%s\"" % last_when
+            if changes:
+                changed = "(%s) and %s" % (changes, changed)
+            xp = "((%s) and @id > %d) or (%s)" % (scope, max_id, changed)
+        if 'apiurl' not in kwargs:
+            kwargs['apiurl'] = self.apiurl
+        count = 0
+        with self._conn:
+            for request in find_request(xp, stream=True, **kwargs):
+                reqid, when = self._store(request)
+                self._conn.execute(
+                    'INSERT OR IGNORE INTO request_scope (apiurl, scope, id) '
+                    'VALUES (?, ?, ?)', (self.apiurl, scope, reqid))
+                max_id = max(max_id, reqid)
+                last_when = max(last_when, when or '')
+                count += 1
+            self._conn.execute(
+                'INSERT OR REPLACE INTO sync (apiurl, scope, max_id, '
+                'last_when) VALUES (?, ?, ?, ?)',
+                (self.apiurl, scope, max_id, last_when))
+        return count
+
+    def add(self, request):
+        """Add or replace request.
+
+        request is a Request object. This can be used to keep the
+        index up to date after a local state change.
+
+        """
+        with self._conn:
+            self._store(request)
+
+    def _store(self, request):
+        """Store request (the caller has to commit the transaction).
+
+        A (reqid, when) tuple is returned where when is the timestamp
+        of the latest state change (or None).
+
+        """
+        reqid = int(request.get('id'))
+        key = (self.apiurl, reqid)
+        self._conn.execute('DELETE FROM request_user WHERE apiurl = ? '
+                           'AND id = ?', key)
+        self._conn.execute('DELETE FROM request_action WHERE apiurl = ? '
+                           'AND id = ?', key)
+        name = when = None
+        users = set()
+        # request.find is a classmethod which retrieves a remote request
+        for state in request.findall('state'):
+            name = state.get('name')
+            when = state.get('when')
+            users.add(state.get('who'))
+        for history in request.findall('history'):
+            users.add(history.get('who'))
+        users.discard(None)
+        self._conn.execute(
+            'INSERT OR REPLACE INTO request (apiurl, id, state, state_when, '
+            'xml) VALUES (?, ?, ?, ?, ?)',
+            key + (name, when, request.tostring()))
+        self._conn.executemany(
+            'INSERT INTO request_user (apiurl, id, who) VALUES (?, ?, ?)',
+            [key + (who, ) for who in users])
+        actions = []
+        for elm in request.findall('action/source | action/target'):
+            actions.append(key + (elm.get('project'), elm.get('package')))
+        self._conn.executemany(
+            'INSERT INTO request_action (apiurl, id, project, package) '
+            'VALUES (?, ?, ?, ?)', actions)
+        return reqid, when
+
+    def find(self, states=(), user=None, project=None, package=None,
+             scope=None):
+        """Return a list of Request objects which match the criteria.
+
+        The list is sorted by the request id. No http request is
+        issued.
+
+        Keyword arguments:
+        states -- only return requests which have one of the
+                  states (default: (), that is all states)
+        user -- only return requests whose state or history was
+                changed by user (default: None)
+        project -- only return requests whose source or target
+                   project is project (default: None)
+        package -- only return requests whose source or target
+                   package is package (default: None)
+        scope -- only return requests which were retrieved by a
+                 sync of scope (a request which was stored by another
+                 scope might be outdated, because the syncs of scope
+                 do not consider it) (default: None)
+
+        """
+        sql = 'SELECT xml FROM request r WHERE r.apiurl = ?'
+        params = [self.apiurl]
+        if scope is not None:
+            sql += (' AND EXISTS (SELECT 1 FROM request_scope s WHERE '
+                    's.apiurl = r.apiurl AND s.id = r.id AND s.scope = ?)')
+            params.append(scope)
+        if states:
+            sql += ' AND r.state IN (%s)' % ', '.join('?' * len(states))
+            params.extend(states)
+        if user is not None:
+            sql += (' AND EXISTS (SELECT 1 FROM request_user u WHERE '
+                    'u.apiurl = r.apiurl AND u.id = r.id AND u.who = ?)')
+            params.append(user)
+        for attr, value in (('project', project), ('package', package)):
+            if value is None:
+                continue
+            sql += (' AND EXISTS (SELECT 1 FROM request_action a WHERE '
+                    'a.apiurl = r.apiurl AND a.id = r.id AND a.%s = ?)'
+                    % attr)
+            params.append(value)
+        sql += ' ORDER BY r.id'
+        cur = self._conn.execute(sql, params)
+        return [Request(xml_data=str(row[0])) for row in cur]
+
+    def request(self, reqid):
+        """Return the Request object with id reqid.
+
+        None is returned if the request is not part of the index.
+
+        """
+        cur = self._conn.execute('SELECT xml FROM request WHERE apiurl = ? '
+                                 'AND id = ?', (self.apiurl, int(reqid)))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        return Request(xml_data=str(row[0]))
+
+    def close(self):
+        """Close the underlying database."""
+        self._conn.close()
@@ -7,7 +7,7 @@ Currently only the search for requests is supported.
 from lxml import etree
 
 from osc2.remote import Request, RemoteProject, RemotePackage
-from osc2.util.xml import fromstring, OscElement
+from osc2.util.xml import fromstring, OscElement, ElementStream
 from osc2.core import Osc
 
 
@@ -107,7 +107,21 @@ class ROPackage(OscElement):
         return RemotePackage(xml_data=etree.tostring(self))
 
 
-def _find(path, xp, tag_class={}, **kwargs):
+class CollectionStream(ElementStream):
+    """Streams the search results.
+
+    In contrast to a collection, the results are not kept in memory.
+    Each result is yielded as a "real" object (see the real_obj
+    methods).
+
+    """
+
+    def __iter__(self):
+        for elm in super(CollectionStream, self).__iter__():
+            yield elm.real_obj()
+
+
+def _find(path, xp, tag_class={}, stream_tag=None, **kwargs):
     """Returns a Collection with objects which match the xpath.
 
     path is the remote path which is used for the http request.
@@ -118,6 +132,9 @@ def _find(path, xp, tag_class={}, **kwargs):
     tag_class -- a dict which maps tag names to classes
                  (see util.xml.fromstring for the details)
                  (default: {})
+    stream_tag -- if specified, a CollectionStream object, which
+                  streams the elements with tag stream_tag, is
+                  returned (default: None)
     **kwargs -- optional parameters for the http request
 
     """
@@ -126,16 +143,19 @@ def _find(path, xp, tag_class={}, **kwargs):
     if hasattr(xp, 'tostring'):
         xpath = xp.tostring()
     f = request.get(path, match=xpath, **kwargs)
+    if stream_tag is not None:
+        return CollectionStream(f, stream_tag, **tag_class)
     return fromstring(f.read(), **tag_class)
 
 
-def find_request(xp, **kwargs):
+def find_request(xp, stream=False, **kwargs):
     """Returns a RequestCollection with objects which match the xpath.
 
     xp is the xpath which is used for the search (either an
     Expression object or a string).
 
     Keyword arguments:
+    stream -- if True, a CollectionStream is returned (default: False)
     **kwargs -- optional parameters for the http request
 
     """
@@ -143,16 +163,18 @@ def find_request(xp, **kwargs):
     if 'schema' not in kwargs:
         kwargs['schema'] = RequestCollection.SCHEMA
     tag_class = {'collection': RequestCollection, 'request': RORequest}
-    return _find(path, xp, tag_class, **kwargs)
+    stream_tag = 'request' if stream else None
+    return _find(path, xp, tag_class, stream_tag, **kwargs)
 
 
-def find_project(xp, **kwargs):
+def find_project(xp, stream=False, **kwargs):
     """Returns a ProjectCollection with objects which match the xpath.
 
     xp is the xpath which is used for the search (either an
     Expression object or a string).
 
     Keyword arguments:
+    stream -- if True, a CollectionStream is returned (default: False)
     **kwargs -- optional parameters for the http request
 
     """
@@ -160,16 +182,18 @@ def find_project(xp, **kwargs):
     if 'schema' not in kwargs:
         kwargs['schema'] = ProjectCollection.SCHEMA
     tag_class = {'collection': ProjectCollection, 'project': ROProject}
-    return _find(path, xp, tag_class, **kwargs)
+    stream_tag = 'project' if stream else None
+    return _find(path, xp, tag_class, stream_tag, **kwargs)
 
 
-def find_package(xp, **kwargs):
+def find_package(xp, stream=False, **kwargs):
     """Returns a PackageCollection with objects which match the xpath.
 
     xp is the xpath which is used for the search (either an
     Expression object or a string).
 
     Keyword arguments:
+    stream -- if True, a CollectionStream is returned (default: False)
     **kwargs -- optional parameters for the http request
 
     """
@@ -177,4 +201,5 @@ def find_package(xp, **kwargs):
     if 'schema' not in kwargs:
         kwargs['schema'] = PackageCollection.SCHEMA
     tag_class = {'collection': PackageCollection, 'package': ROPackage}
-    return _find(path, xp, tag_class, **kwargs)
+    stream_tag = 'package' if stream else None
+    return _find(path, xp, tag_class, stream_tag, **kwargs)
@@ -1,7 +1,8 @@
 """Provides classes to access the source
 route"""
 
-from osc2.util.xml import fromstring, OscElement
+from osc2.util.xml import (fromstring, OscElement, ReadOnlyElement,
+                           parse_readonly, ElementStream)
 from osc2.remote import RORemoteFile
 from osc2.core import Osc
 
@@ -11,8 +12,9 @@ class Directory(OscElement):
         return self.iterfind('entry')
 
 
-class File(OscElement):
-    """Represents a file entry"""
+class FileMixin(object):
+    """Provides the file method for a file entry."""
+    __slots__ = ()
 
     def file(self, **kwargs):
         """Returns a RORemoteFile object.
@@ -35,8 +37,14 @@ class File(OscElement):
         return RORemoteFile(path, mtime=mtime, **kwargs)
 
 
-class Linkinfo(OscElement):
-    """Represents a linkinfo entry."""
+class File(FileMixin, OscElement):
+    """Represents a file entry"""
+    pass
+
+
+class LinkinfoMixin(object):
+    """Provides the methods for a linkinfo entry."""
+    __slots__ = ()
 
     def is_expanded(self):
         """Return True package is expanded."""
@@ -53,9 +61,36 @@ class Linkinfo(OscElement):
         return self.get('error') is not None
 
 
+class Linkinfo(LinkinfoMixin, OscElement):
+    """Represents a linkinfo entry."""
+    pass
+
+
+class ReadOnlyDirectory(ReadOnlyElement):
+    """Represents a read-only directory listing."""
+    __slots__ = ()
+    objectify_class = Directory
+
+    def __iter__(self):
+        return self.iterfind('entry')
+
+
+class ReadOnlyFile(FileMixin, ReadOnlyElement):
+    """Represents a read-only file entry."""
+    __slots__ = ()
+    objectify_class = File
+
+
+class ReadOnlyLinkinfo(LinkinfoMixin, ReadOnlyElement):
+    """Represents a read-only linkinfo entry."""
+    __slots__ = ()
+    objectify_class = Linkinfo
+
+
 class Project(object):
     """Class used to access /source/project data"""
     LIST_SCHEMA = ''
+    SOURCEINFO_SCHEMA = ''
 
     def __init__(self, name):
         """Creates a new Project object.
@@ -78,14 +113,38 @@ class Project(object):
         if 'schema' not in kwargs:
             kwargs['schema'] = Project.LIST_SCHEMA
         f = request.get(path, **kwargs)
-        entries = fromstring(f.read())
         r = []
         # using an xml representation for the <entry /> makes no
         # sense
-        for e in entries.iterfind('entry'):
+        for e in ElementStream(f, 'entry'):
             r.append(Package(self.name, e.get('name')))
         return r
 
+    def sourceinfo(self, **kwargs):
+        """Return the source info of all packages of this project.
+
+        A dict is returned which maps a package name to a dict
+        which contains the attributes of its <sourceinfo /> element
+        (for instance, srcmd5, lsrcmd5 (only for links) and
+        verifymd5). All data is retrieved with a single http request.
+
+        Keyword arguments:
+        **kwargs -- optional parameters for the http request
+
+        """
+        request = Osc.get_osc().get_reqobj()
+        path = '/source/' + self.name
+        if 'schema' not in kwargs:
+            kwargs['schema'] = Project.SOURCEINFO_SCHEMA
+        f = request.get(path, view='info', **kwargs)
+        info = {}
+        for e in ElementStream(f, 'sourceinfo'):
+            data = dict(e.attrib)
+            if e.find('error') is not None:
+                data['error'] = e.find('error').text or ''
+            info[e.get('package')] = data
+        return info
+
 
 class Package(object):
     """Class used to access /source/project/package data"""
@@ -107,9 +166,11 @@ class Package(object):
         """Return attribute with name name."""
         return getattr(self, name)
 
-    def list(self, **kwargs):
+    def list(self, readonly=False, **kwargs):
         """List all files for this package.
         Keyword arguments:
+        readonly -- if True, a ReadOnlyDirectory is returned instead of
+                    a Directory (default: False)
         **kwargs -- optional parameters for the http request
 
         """
@@ -118,10 +179,15 @@ class Package(object):
         if 'schema' not in kwargs:
             kwargs['schema'] = Package.LIST_SCHEMA
         f = request.get(path, **kwargs)
-        directory = fromstring(f.read(), directory=Directory, entry=File,
-                               linkinfo=Linkinfo)
+        if readonly:
+            directory = parse_readonly(f.read(), directory=ReadOnlyDirectory,
+                                       entry=ReadOnlyFile,
+                                       linkinfo=ReadOnlyLinkinfo)
+        else:
+            directory = fromstring(f.read(), directory=Directory, entry=File,
+                                   linkinfo=Linkinfo)
         # this is needed by the file class
-        directory.set('project', self.project)
+        directory.attrib['project'] = self.project
         return directory
 
     def log(self, **kwargs):
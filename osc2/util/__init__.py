@@ -1 +1 @@
-__all__ = ['xml', 'io', 'xpath', 'cpio']
+__all__ = ['xml', 'io', 'xpath', 'cpio', 'parallel', 'merge']
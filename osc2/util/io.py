@@ -6,13 +6,18 @@ Additionally it provides some convenience methods.
 """
 
 import os
+import errno
+import fcntl
+import ctypes
+import ctypes.util
 import shutil
-from tempfile import NamedTemporaryFile, mkdtemp as orig_mkdtemp
+from tempfile import (NamedTemporaryFile, mkdtemp as orig_mkdtemp,
+                      mkstemp as orig_mkstemp)
 
 from osc2.util.delegation import StringifiedDelegator, Delegator
 
 
-__all__ = ['copy_file', 'iter_read']
+__all__ = ['copy_file', 'clone_file', 'iter_read']
 
 
 def _copy_file(fsource_obj, fdest_obj, bufsize, size,
@@ -125,6 +130,168 @@ def copy_file(source, dest, mode=0644, mtime=None, bufsize=8096,
         os.chmod(dest, mode)
 
 
+# ioctl request number of FICLONE (see linux/fs.h)
+FICLONE = 0x40049409
+
+# errnos which indicate that a cloning/kernel copy strategy is not
+# supported for the given pair of files
+_UNSUPPORTED_ERRNOS = (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.ENOTTY,
+                       errno.EOPNOTSUPP, errno.EBADF, errno.EPERM)
+
+_libc = None
+
+
+def _libc_func(name, restype, argtypes):
+    """Return the libc function name or None if it is not available."""
+    global _libc
+    if _libc is None:
+        try:
+            _libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                use_errno=True)
+        except OSError:
+            _libc = False
+    func = getattr(_libc, name, None) if _libc else None
+    if func is not None:
+        func.restype = restype
+        func.argtypes = argtypes
+    return func
+
+
+def _reflink(fd_source, fd_dest, size):
+    """Share the data blocks of fd_source with fd_dest (FICLONE).
+
+    Return True if the file was cloned, otherwise False.
+
+    """
+    try:
+        fcntl.ioctl(fd_dest, FICLONE, fd_source)
+    except (IOError, OSError) as e:
+        if e.errno in _UNSUPPORTED_ERRNOS:
+            return False
+        raise
+    return True
+
+
+def _kernel_copy(fd_source, fd_dest, size):
+    """Copy fd_source to fd_dest in kernel space.
+
+    copy_file_range is tried first and sendfile afterwards (both
+    are called via ctypes because python2's os module provides
+    neither of them). Return True if the data was copied, otherwise
+    False (in this case, nothing was written to fd_dest).
+
+    """
+    ssize_t = ctypes.c_ssize_t
+    candidates = (
+        ('copy_file_range',
+         (ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p,
+          ctypes.c_size_t, ctypes.c_uint),
+         lambda func, count: func(fd_source, None, fd_dest, None, count, 0)),
+        ('sendfile',
+         (ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t),
+         lambda func, count: func(fd_dest, fd_source, None, count)))
+    for name, argtypes, call in candidates:
+        func = _libc_func(name, ssize_t, argtypes)
+        if func is None:
+            continue
+        copied = 0
+        while copied < size:
+            ret = call(func, size - copied)
+            if ret < 0:
+                err = ctypes.get_errno()
+                if copied or err not in _UNSUPPORTED_ERRNOS:
+                    raise OSError(err, os.strerror(err))
+                break
+            elif ret == 0:
+                # source was truncated in the meantime
+                break
+            copied += ret
+        if copied or not size:
+            return True
+    return False
+
+
+def clone_file(source, dest, mode=0644, mtime=None, hardlink=False):
+    """Materialize the file source as file dest.
+
+    In contrast to copy_file, the data is not necessarily copied
+    through userspace. The following strategies are tried (in this
+    order): a hardlink (only if hardlink is True), a reflink (FICLONE),
+    a kernel copy (copy_file_range or sendfile) and, finally, a
+    buffered copy (copy_file).
+    If an existing dest is replaced, this is done atomically.
+    A ValueError is raised if source does not exist.
+    The name of the used strategy is returned ('hardlink', 'reflink',
+    'kernel' or 'copy').
+
+    Keyword arguments:
+    mode -- the mode of file dest (default: 0644); if hardlink is True,
+            the write permissions are removed from mode (source and
+            dest share the same inode: dest has to be replaced instead
+            of modified in place)
+    mtime -- the mtime of file dest
+    hardlink -- hardlink dest to source (default: False); note that
+                the permissions do not protect source from root or
+                from programs which change the permissions before
+                writing dest in place
+
+    """
+    if not os.path.isfile(source):
+        raise ValueError("source \"%s\" is no file" % source)
+    if os.path.exists(dest) and not os.path.isfile(dest):
+        raise ValueError("dest \"%s\" exists but is no file" % dest)
+    dirname = os.path.dirname(dest)
+    filename = os.path.basename(dest)
+    if hardlink:
+        mode &= ~0222
+        fd, tmp_filename = orig_mkstemp(dir=dirname, prefix=filename)
+        os.close(fd)
+        os.unlink(tmp_filename)
+        try:
+            os.link(source, tmp_filename)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+        else:
+            try:
+                os.chmod(tmp_filename, mode)
+                if mtime is not None:
+                    os.utime(tmp_filename, (-1, mtime))
+                os.rename(tmp_filename, dest)
+            finally:
+                if os.path.lexists(tmp_filename):
+                    os.unlink(tmp_filename)
+            return 'hardlink'
+    fd_source = os.open(source, os.O_RDONLY)
+    fd_dest = -1
+    tmp_filename = ''
+    try:
+        size = os.fstat(fd_source).st_size
+        fd_dest, tmp_filename = orig_mkstemp(dir=dirname, prefix=filename)
+        for strategy, func in (('reflink', _reflink),
+                               ('kernel', _kernel_copy)):
+            if func(fd_source, fd_dest, size):
+                break
+        else:
+            strategy = None
+        if strategy is not None:
+            os.close(fd_dest)
+            fd_dest = -1
+            if mtime is not None:
+                os.utime(tmp_filename, (-1, mtime))
+            os.chmod(tmp_filename, mode)
+            os.rename(tmp_filename, dest)
+            return strategy
+    finally:
+        os.close(fd_source)
+        if fd_dest != -1:
+            os.close(fd_dest)
+        if tmp_filename and os.path.isfile(tmp_filename):
+            os.unlink(tmp_filename)
+    copy_file(source, dest, mode=mode, mtime=mtime)
+    return 'copy'
+
+
 def iter_read(fsource, bufsize=8096, size=-1, read_method='read'):
     """Iterate over fsource and yield at most bufsize bytes.
 
@@ -0,0 +1,117 @@
+"""Provides a three-way line merge.
+
+The merge is similar to the one which is performed by "diff3 -m -E":
+non-overlapping changes are merged and overlapping changes are
+bracketed with conflict markers.
+
+"""
+
+from difflib import SequenceMatcher
+
+__all__ = ['merge3']
+
+
+def _intersect(ra, rb):
+    """Return the intersection of the ranges ra and rb (or None)."""
+    start = max(ra[0], rb[0])
+    end = min(ra[1], rb[1])
+    if start < end:
+        return (start, end)
+    return None
+
+
+def _matching_blocks(old, new):
+    """Return the matching blocks of the line lists old and new."""
+    matcher = SequenceMatcher(None, old, new, autojunk=False)
+    return matcher.get_matching_blocks()
+
+
+def _sync_regions(old, mine, yours):
+    """Return the regions in which old, mine and yours are identical.
+
+    Each region is represented by a tuple (old_start, old_end, my_start,
+    my_end, your_start, your_end). The last region is an empty region
+    at the end of all three line lists.
+
+    """
+    my_blocks = _matching_blocks(old, mine)
+    your_blocks = _matching_blocks(old, yours)
+    regions = []
+    i = j = 0
+    while i < len(my_blocks) and j < len(your_blocks):
+        my_old, my_start, my_len = my_blocks[i]
+        your_old, your_start, your_len = your_blocks[j]
+        common = _intersect((my_old, my_old + my_len),
+                            (your_old, your_old + your_len))
+        if common is not None:
+            old_start, old_end = common
+            my_sub = my_start + old_start - my_old
+            your_sub = your_start + old_start - your_old
+            regions.append((old_start, old_end,
+                            my_sub, my_sub + old_end - old_start,
+                            your_sub, your_sub + old_end - old_start))
+        if my_old + my_len < your_old + your_len:
+            i += 1
+        else:
+            j += 1
+    regions.append((len(old), len(old), len(mine), len(mine),
+                    len(yours), len(yours)))
+    return regions
+
+
+def _chunks(old, mine, yours):
+    """Yield the chunks of the merge.
+
+    A chunk is either a tuple ('lines', lines) or a tuple
+    ('conflict', my_lines, your_lines).
+
+    """
+    old_pos = my_pos = your_pos = 0
+    for (old_start, old_end, my_start, my_end,
+         your_start, your_end) in _sync_regions(old, mine, yours):
+        old_lines = old[old_pos:old_start]
+        my_lines = mine[my_pos:my_start]
+        your_lines = yours[your_pos:your_start]
+        if my_lines or your_lines:
+            if my_lines == your_lines or your_lines == old_lines:
+                yield ('lines', my_lines)
+            elif my_lines == old_lines:
+                yield ('lines', your_lines)
+            else:
+                yield ('conflict', my_lines, your_lines)
+        if old_end > old_start:
+            yield ('lines', old[old_start:old_end])
+        old_pos, my_pos, your_pos = old_end, my_end, your_end
+
+
+def _terminated(lines):
+    """Return lines whose last line ends with a newline."""
+    if lines and not lines[-1].endswith('\n'):
+        lines = lines[:-1] + [lines[-1] + '\n']
+    return lines
+
+
+def merge3(mine, old, yours, my_label='mine', your_label='yours'):
+    """Perform a three-way merge of the line lists mine, old and yours.
+
+    old is the common ancestor of mine and yours. A tuple
+    (lines, conflicts) is returned, where lines is the list of
+    merged lines and conflicts is the number of conflicts. Each
+    conflict is bracketed with diff3 compatible conflict markers
+    (my_label and your_label are used as the labels of the markers).
+
+    """
+    lines = []
+    conflicts = 0
+    for chunk in _chunks(old, mine, yours):
+        if chunk[0] == 'lines':
+            lines.extend(chunk[1])
+            continue
+        conflicts += 1
+        lines = _terminated(lines)
+        lines.append('<<<<<<< %s\n' % my_label)
+        lines.extend(_terminated(chunk[1]))
+        lines.append('=======\n')
+        lines.extend(_terminated(chunk[2]))
+        lines.append('>>>>>>> %s\n' % your_label)
+    return lines, conflicts
@@ -0,0 +1,82 @@
+"""Provides utility functions to run tasks concurrently.
+
+The tasks are executed by a pool of threads. Hence, only io bound
+tasks or tasks which release the GIL (for instance hashlib's hash
+functions) benefit from it.
+
+"""
+
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+__all__ = ['default_jobs', 'parallel_map', 'parallel_imap']
+
+
+def default_jobs():
+    """Return the default number of worker threads.
+
+    This is the number of cpus (or 1 if it cannot be determined).
+
+    """
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def parallel_map(func, iterable, jobs=None):
+    """Return a list which contains the result of func for each item.
+
+    The order of the results corresponds to the order of the items
+    in iterable. If func raises an exception, the exception is
+    propagated to the caller (the remaining items might still be
+    processed).
+
+    Keyword arguments:
+    jobs -- the maximum number of worker threads; if None, the
+            number of cpus is used (default: None)
+
+    """
+    items = list(iterable)
+    if jobs is None:
+        jobs = default_jobs()
+    jobs = min(jobs, len(items))
+    if jobs <= 1:
+        return [func(item) for item in items]
+    pool = ThreadPool(jobs)
+    try:
+        return pool.map(func, items, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def parallel_imap(func, iterable, jobs=None):
+    """Yield the result of func for each item.
+
+    In contrast to parallel_map, a result is yielded as soon as it
+    and all results of the preceding items are available (that is,
+    the results are still yielded in the order of the items).
+    If func raises an exception, the exception is propagated to the
+    caller.
+
+    Keyword arguments:
+    jobs -- the maximum number of worker threads; if None, the
+            number of cpus is used (default: None)
+
+    """
+    items = list(iterable)
+    if jobs is None:
+        jobs = default_jobs()
+    jobs = min(jobs, len(items))
+    if jobs <= 1:
+        for item in items:
+            yield func(item)
+        return
+    pool = ThreadPool(jobs)
+    try:
+        for result in pool.imap(func, items, chunksize=1):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
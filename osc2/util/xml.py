@@ -1,10 +1,54 @@
 """xml utility functions"""
 
-from collections import Sequence
+import threading
+from cStringIO import StringIO
+from collections import Sequence, deque
 
 from lxml import etree, objectify
 
-__all__ = ['ElementClassLookup', 'get_parser']
+__all__ = ['ElementClassLookup', 'get_parser', 'compile_xpath',
+           'ReadOnlyElement', 'parse_readonly', 'ElementStream']
+
+# maximum number of compiled xpath expressions which are cached per thread
+XPATH_CACHE_SIZE = 512
+
+_xpath_cache = threading.local()
+
+_parser_cache = threading.local()
+
+# number of bytes which are read at once by an ElementStream
+STREAM_CHUNK_SIZE = 16384
+
+
+def compile_xpath(xp):
+    """Return a compiled etree.XPath object for the xpath str xp.
+
+    The compiled objects are kept in a bounded (least recently used)
+    cache. The cache is thread-local, because an etree.XPath object
+    should not be evaluated concurrently.
+    In order to benefit from the cache, xp should not be constructed
+    via string interpolation. Instead, xpath variables should be used
+    (for instance, "//entry[@name = $name]").
+
+    """
+    global XPATH_CACHE_SIZE
+    cache = getattr(_xpath_cache, 'cache', None)
+    if cache is None:
+        cache = _xpath_cache.cache = {}
+        # the xpaths in least recently used order (OrderedDict is not
+        # available in python 2.6)
+        _xpath_cache.order = deque()
+    order = _xpath_cache.order
+    compiled = cache.get(xp)
+    if compiled is None:
+        compiled = etree.XPath(xp)
+        while len(cache) >= XPATH_CACHE_SIZE:
+            del cache[order.popleft()]
+        cache[xp] = compiled
+    else:
+        order.remove(xp)
+    order.append(xp)
+    return compiled
 
 
 class XPathFindMixin:
@@ -17,8 +61,8 @@ class XPathFindMixin:
 
     """
 
-    def find(self, xp):
-        elms = self.findall(xp)
+    def find(self, xp, **variables):
+        elms = self.findall(xp, **variables)
         if isinstance(elms, Sequence):
             if elms:
                 return elms[0]
@@ -26,8 +70,14 @@ class XPathFindMixin:
         # happens if, for example, xp == '2 + 3' (see testcases)
         return elms
 
-    def findall(self, xp):
-        return self.xpath(xp)
+    def findall(self, xp, **variables):
+        """Evaluate the xpath xp.
+
+        **variables are xpath variables which are referenced
+        in xp (for instance, findall('entry[@name = $name]', name='x')).
+
+        """
+        return compile_xpath(xp)(self, **variables)
 
 
 class OscElement(XPathFindMixin, objectify.ObjectifiedElement):
@@ -79,10 +129,23 @@ def get_parser(tree_class=None, empty_data_class=None,
     lookup_class -- class which is used for the element lookup
                     (default: ElementClassLookup)
 
+    The configured parsers are cached (thread-locally, because a parser
+    must not be used concurrently). That is, subsequent calls with the
+    same arguments return the same parser object. Hence, the returned
+    parser must not be reconfigured by the caller.
+
     """
-    parser = objectify.makeparser()
-    lookup = lookup_class(tree_class, empty_data_class, **tag_class)
-    parser.set_element_class_lookup(lookup)
+    key = (tree_class, empty_data_class, lookup_class,
+           tuple(sorted(tag_class.iteritems())))
+    cache = getattr(_parser_cache, 'cache', None)
+    if cache is None:
+        cache = _parser_cache.cache = {}
+    parser = cache.get(key)
+    if parser is None:
+        parser = objectify.makeparser()
+        lookup = lookup_class(tree_class, empty_data_class, **tag_class)
+        parser.set_element_class_lookup(lookup)
+        cache[key] = parser
     return parser
 
 
@@ -100,3 +163,340 @@ def fromstring(data, parser=None, **kwargs):
     if parser is None:
         parser = get_parser(**kwargs)
     return objectify.fromstring(data, parser=parser)
+
+
+class ReadOnlyElement(object):
+    """Represents a compact, read-only xml element.
+
+    In contrast to an objectify element, a ReadOnlyElement is a plain
+    python object (with __slots__) which is not backed by a libxml2
+    tree. The public interface is a subset of the objectify interface
+    (attribute access, get, iterchildren, find etc.) so that read-only
+    consumers do not have to care about the representation.
+    If the data has to be modified, objectify() returns the
+    corresponding objectify element. Note: modifications of the
+    objectify element are not reflected by the ReadOnlyElement.
+
+    """
+    __slots__ = ('tag', 'text', 'attrib', '_children', '_parent', '_meta')
+    # objectify class which is used for this tag if the element is
+    # converted (None means the parser's default class is used)
+    objectify_class = None
+
+    def __init__(self, tag, attrib, parent=None):
+        """Constructs a new ReadOnlyElement object.
+
+        tag is the tag name and attrib is a dict of attributes.
+
+        Keyword arguments:
+        parent -- the parent ReadOnlyElement (default: None)
+
+        """
+        super(ReadOnlyElement, self).__init__()
+        self.tag = tag
+        self.text = None
+        self.attrib = attrib
+        self._children = []
+        self._parent = parent
+        # only used by the root element (see parse_readonly)
+        self._meta = None
+        if parent is not None:
+            parent._children.append(self)
+
+    def get(self, key, default=None):
+        """Return the value of attribute key or default."""
+        return self.attrib.get(key, default)
+
+    def keys(self):
+        """Return a list of attribute names."""
+        return self.attrib.keys()
+
+    def items(self):
+        """Return a list of (name, value) attribute pairs."""
+        return self.attrib.items()
+
+    def getparent(self):
+        """Return the parent element (or None)."""
+        return self._parent
+
+    def getchildren(self):
+        """Return a list of all child elements."""
+        return self._children[:]
+
+    def iterchildren(self, tag=None):
+        """Iterate over all child elements.
+
+        Keyword arguments:
+        tag -- only yield child elements with tag tag (default: None)
+
+        """
+        for child in self._children:
+            if tag is None or child.tag == tag:
+                yield child
+
+    def iterfind(self, path):
+        """Iterate over all elements which match path.
+
+        path is a simple "tag" or "tag/subtag" path (xpath expressions
+        are not supported).
+
+        """
+        elms = [self]
+        for tag in path.split('/'):
+            elms = [c for elm in elms for c in elm.iterchildren(tag)]
+        return iter(elms)
+
+    def findall(self, path):
+        """Return a list of all elements which match path.
+
+        See iterfind for the supported paths.
+
+        """
+        return list(self.iterfind(path))
+
+    def find(self, path):
+        """Return the first element which matches path or None.
+
+        See iterfind for the supported paths.
+
+        """
+        for elm in self.iterfind(path):
+            return elm
+        return None
+
+    def _siblings(self):
+        """Return a list of all siblings with the same tag (incl. self)."""
+        if self._parent is None:
+            return [self]
+        return list(self._parent.iterchildren(self.tag))
+
+    def __getattr__(self, name):
+        # like objectify: return the first child with tag name
+        for child in self._children:
+            if child.tag == name:
+                return child
+        raise AttributeError("no such child: %s" % name)
+
+    def __getitem__(self, key):
+        # like objectify: index into the siblings with the same tag
+        return self._siblings()[key]
+
+    def __iter__(self):
+        return iter(self._siblings())
+
+    def __len__(self):
+        return len(self._siblings())
+
+    def __eq__(self, other):
+        # like objectify.StringElement: compare the text with a str
+        if isinstance(other, basestring):
+            return (self.text or '') == other
+        return self is other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = object.__hash__
+
+    def __str__(self):
+        return self.text or ''
+
+    def _build(self, parent=None):
+        """Return a new etree element which represents this element."""
+        if parent is None:
+            elm = etree.Element(self.tag, self.attrib)
+        else:
+            elm = etree.SubElement(parent, self.tag, self.attrib)
+        elm.text = self.text
+        for child in self._children:
+            child._build(elm)
+        return elm
+
+    def objectify(self):
+        """Return the corresponding objectify element.
+
+        The complete document is converted once (subsequent calls
+        return the same objectify tree). The returned element can be
+        modified.
+
+        """
+        path = []
+        elm = self
+        while elm._parent is not None:
+            path.append(elm._parent._children.index(elm))
+            elm = elm._parent
+        root = elm
+        if root._meta['objectified'] is None:
+            data = etree.tostring(root._build())
+            tag_class = {}
+            for tag, klass in root._meta['tag_class'].iteritems():
+                if klass.objectify_class is not None:
+                    tag_class[tag] = klass.objectify_class
+            root._meta['objectified'] = fromstring(data, **tag_class)
+        elm = root._meta['objectified']
+        for i in reversed(path):
+            elm = elm.getchildren()[i]
+        return elm
+
+
+def parse_readonly(source, **tag_class):
+    """Parse source into a tree of ReadOnlyElement objects.
+
+    source is a xml str or a file-like object. The data is parsed in
+    a single iterparse pass (the underlying lxml elements are discarded
+    as soon as they are processed). The root ReadOnlyElement is returned.
+    tag_class is a "tag" => "klass" mapping, where klass is a
+    ReadOnlyElement subclass (its objectify_class attribute is used if
+    the tree is converted via objectify()).
+
+    """
+    if isinstance(source, basestring):
+        source = StringIO(source)
+    root = None
+    stack = []
+    for event, elm in etree.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            klass = tag_class.get(elm.tag, ReadOnlyElement)
+            parent = stack[-1] if stack else None
+            rec = klass(elm.tag, dict(elm.attrib), parent)
+            if root is None:
+                root = rec
+            stack.append(rec)
+            continue
+        rec = stack.pop()
+        text = elm.text
+        if rec._children and text is not None and not text.strip():
+            # ignorable whitespace
+            text = None
+        rec.text = text
+        elm.clear()
+        parent = elm.getparent()
+        if parent is not None:
+            while elm.getprevious() is not None:
+                del parent[0]
+    root._meta = {'tag_class': tag_class, 'objectified': None}
+    return root
+
+
+class ElementStream(object):
+    """Incrementally parses a xml document and yields the root's children.
+
+    Only the children of the root element with a specific tag are
+    yielded. An element is removed from the tree as soon as the next
+    element is yielded. That is, the memory usage does not depend on
+    the size of the document (as long as the caller does not keep
+    references to the yielded elements). A yielded element stays
+    intact if the caller keeps a reference but it is detached from
+    its parent when the next element is yielded.
+    The attributes of the root element are available via the attrib
+    attribute (or get) as soon as the root element was parsed (before
+    that attrib is None).
+
+    Example usage:
+     stream = ElementStream(f, 'entry', directory=Directory, entry=File)
+     for entry in stream:
+         print entry.get('name'), stream.get('rev')
+
+    """
+
+    def __init__(self, source, tag, annotate=None, tree_class=None,
+                 empty_data_class=None, **tag_class):
+        """Constructs a new ElementStream object.
+
+        source is a file-like object (for instance an
+        AbstractHTTPResponse) and tag is the tag of the root's children
+        which should be yielded. tag_class is a "tag" => "klass" mapping
+        (see get_parser). The source is closed after the document was
+        parsed.
+
+        Keyword arguments:
+        annotate -- a dict of attributes which are set on the root
+                    element as soon as it is parsed (default: None)
+        tree_class -- class which is used for tree elements (default: None)
+        empty_data_class -- class which is used for empty data elements
+                            (default: None)
+
+        """
+        super(ElementStream, self).__init__()
+        self.tag = tag
+        self.attrib = None
+        self._source = source
+        self._annotate = annotate or {}
+        self._tree_class = tree_class
+        self._empty_data_class = empty_data_class
+        self._tag_class = tag_class
+
+    def get(self, name, default=None):
+        """Return the value of the root's attribute name or default."""
+        if self.attrib is None:
+            return default
+        return self.attrib.get(name, default)
+
+    def __iter__(self):
+        global STREAM_CHUNK_SIZE
+        if not hasattr(etree, 'XMLPullParser'):
+            # lxml < 3.3: fall back to parsing the complete document
+            for elm in self._iter_document():
+                yield elm
+            return
+        parser = etree.XMLPullParser(events=('start', 'end'),
+                                     remove_blank_text=True)
+        lookup = ElementClassLookup(self._tree_class, self._empty_data_class,
+                                    **self._tag_class)
+        parser.set_element_class_lookup(lookup)
+        depth = 0
+        try:
+            data = True
+            while data:
+                data = self._source.read(STREAM_CHUNK_SIZE)
+                if data:
+                    parser.feed(data)
+                else:
+                    parser.close()
+                for event, elm in parser.read_events():
+                    if event == 'start':
+                        depth += 1
+                        if depth == 1:
+                            self._root_parsed(elm)
+                        continue
+                    depth -= 1
+                    if depth != 1 or elm.tag != self.tag:
+                        continue
+                    self._remove_previous(elm)
+                    yield elm
+        finally:
+            self._source.close()
+
+    def _iter_document(self):
+        """Parses the complete document and yields the root's children.
+
+        The memory usage is not bounded (only used if lxml provides
+        no XMLPullParser).
+
+        """
+        try:
+            data = self._source.read()
+        finally:
+            self._source.close()
+        root = fromstring(data, tree_class=self._tree_class,
+                          empty_data_class=self._empty_data_class,
+                          **self._tag_class)
+        self._root_parsed(root)
+        for elm in root.iterchildren(tag=self.tag):
+            self._remove_previous(elm)
+            yield elm
+
+    def _remove_previous(self, elm):
+        """Removes the already processed siblings of elm."""
+        # objectify's __delitem__ has a different semantics
+        parent = elm.getparent()
+        prev = elm.getprevious()
+        while prev is not None:
+            parent.remove(prev)
+            prev = elm.getprevious()
+
+    def _root_parsed(self, root):
+        """Annotates the root element and records its attributes."""
+        for key, value in self._annotate.iteritems():
+            root.set(key, value)
+        self.attrib = dict(root.attrib)
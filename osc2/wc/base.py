@@ -114,6 +114,43 @@ class TransactionNotifier(Notifier):
         self._notify('processed', *args, **kwargs)
 
 
+class BufferedTransactionListener(TransactionListener):
+    """Buffers all notifications until they are flushed.
+
+    This is used if several transactions run concurrently: each
+    transaction gets its own buffer which is flushed once the
+    transaction is finished. Since the transaction already runs
+    when its notifications are delivered, begin always returns
+    True (that is a listener cannot abort a buffered transaction).
+
+    """
+
+    def __init__(self):
+        """Constructs a new BufferedTransactionListener object."""
+        super(BufferedTransactionListener, self).__init__()
+        self._calls = []
+
+    def begin(self, *args, **kwargs):
+        self._calls.append(('begin', args, kwargs))
+        return True
+
+    def finished(self, *args, **kwargs):
+        self._calls.append(('finished', args, kwargs))
+
+    def transfer(self, *args, **kwargs):
+        self._calls.append(('transfer', args, kwargs))
+
+    def processed(self, *args, **kwargs):
+        self._calls.append(('processed', args, kwargs))
+
+    def flush(self, notifier):
+        """Pass the buffered notifications to notifier."""
+        calls = self._calls
+        self._calls = []
+        for method, args, kwargs in calls:
+            getattr(notifier, method)(*args, **kwargs)
+
+
 class FileConflictError(Exception):
     """Exception raises if an operation can't be executed due to conflicts."""
 
@@ -3,12 +3,17 @@
 import os
 
 from osc2.wc.project import Project
-from osc2.wc.package import Package
+from osc2.wc.package import Package, file_md5
+from osc2.wc.base import AbstractTransactionState
 from osc2.wc.util import (wc_read_files, wc_pkg_data_filename, _storefile,
                           _write_storefile, _VERSION, wc_read_project,
                           _read_storefile, wc_read_packages,
                           missing_storepaths, wc_read_apiurl,
-                          wc_pkg_data_mkdir, _storedir)
+                          wc_pkg_data_mkdir, _storedir, wc_is_sqlite,
+                          wc_is_project, wc_is_package, wc_verify_format,
+                          wc_lock, wc_write_version, WCDatabase, WCStatCache,
+                          SQLiteFileTracker, SQLitePackageTracker,
+                          _STAT_CACHE)
 
 
 def convert_package(path, ext_storedir=None, **kwargs):
@@ -105,3 +110,51 @@ def convert_project(path, project='', apiurl='', **package_states):
         storedir = wc_pkg_data_mkdir(path, package)
         convert_package(package_path, project=project, package=package,
                         apiurl=apiurl, ext_storedir=storedir)
+
+
+def convert_to_sqlite(path):
+    """Convert a working copy to the sqlite format.
+
+    path is the path to a project or package working copy (the
+    packages of a project working copy are converted as well).
+    Afterwards, the tracker entries and the stat cache are stored
+    in the working copy's database (see osc2.wc.util.wc_is_sqlite).
+    A working copy which is already in the sqlite format is not
+    modified. A ValueError is raised if a transaction is pending.
+
+    """
+    wc_verify_format(path)
+    if wc_is_project(path):
+        for entry in wc_read_packages(path):
+            package_path = os.path.join(path, entry.get('name'))
+            if wc_is_package(package_path):
+                convert_to_sqlite(package_path)
+        _convert_to_sqlite(path, SQLitePackageTracker)
+    else:
+        _convert_to_sqlite(path, SQLiteFileTracker)
+
+
+def _convert_to_sqlite(path, tracker_class):
+    """Move the metadata of path into the database.
+
+    tracker_class is the class of the sqlite tracker.
+
+    """
+    global _STAT_CACHE
+    if wc_is_sqlite(path):
+        return
+    with wc_lock(path):
+        if os.path.exists(_storefile(path, AbstractTransactionState.DIR)):
+            msg = "path \"%s\" has a pending transaction" % path
+            raise ValueError(msg)
+        xml_data = _read_storefile(path, tracker_class.filename())
+        entries = WCStatCache(path, file_md5).items()
+        # a leftover database of an interrupted conversion is reset
+        WCDatabase.create(path)
+        tracker_class(path, xml_data).write()
+        # from now on, the working copy is in the sqlite format
+        wc_write_version(path)
+        WCStatCache(path, file_md5).store(entries)
+        os.unlink(_storefile(path, tracker_class.filename()))
+        if os.path.exists(_storefile(path, _STAT_CACHE)):
+            os.unlink(_storefile(path, _STAT_CACHE))
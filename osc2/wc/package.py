@@ -5,6 +5,10 @@ import hashlib
 import copy
 import subprocess
 import errno
+import threading
+import filecmp
+import fnmatch
+import itertools
 from difflib import unified_diff
 
 from lxml import etree
@@ -12,10 +16,13 @@ from lxml import etree
 from osc2.core import Osc
 from osc2.source import File, Directory, Linkinfo
 from osc2.source import Package as SourcePackage
-from osc2.remote import RWLocalFile
+from osc2.remote import RORemoteFile, RWLocalFile
+from osc2.httprequest import HTTPError
 from osc2.util.xml import fromstring
-from osc2.util.io import copy_file
+from osc2.util.io import copy_file, clone_file
 from osc2.util.listinfo import ListInfo
+from osc2.util.merge import merge3
+from osc2.util.parallel import parallel_map, parallel_imap
 from osc2.wc.base import (WorkingCopy, UpdateStateMixin, CommitStateMixin,
                           FileConflictError, PendingTransactionError,
                           no_pending_transaction)
@@ -24,8 +31,31 @@ from osc2.wc.util import (wc_read_package, wc_read_project, wc_read_apiurl,
                           wc_write_apiurl, wc_write_files, wc_read_files,
                           missing_storepaths, WCInconsistentError,
                           wc_pkg_data_filename, XMLTransactionState,
-                          wc_diff_mkdir, _storedir, _PKG_DATA,
-                          wc_verify_format, wc_write_version)
+                          wc_diff_mkdir, wc_diff_revisions, wc_diff_prune,
+                          _storedir, _PKG_DATA,
+                          wc_verify_format, wc_write_version, WCStatCache,
+                          wc_read_sparse, wc_write_sparse, wc_partial_mkdir,
+                          wc_partial_filename, wc_partial_remove, wc_batch)
+from osc2.wc.watch import dirty_set
+
+
+def _consults_watcher(meth):
+    """Consult the working copy watcher (if one runs) during meth.
+
+    Within meth, the md5sums of the files which did not change since
+    they were computed are trusted without a stat call (see module
+    osc2.wc.watch).
+
+    """
+    def wrapper(self, *args, **kwargs):
+        if self._stat_cache.dirty is not None:
+            return meth(self, *args, **kwargs)
+        self._stat_cache.dirty = dirty_set(self.path)
+        try:
+            return meth(self, *args, **kwargs)
+        finally:
+            self._stat_cache.dirty = None
+    return wrapper
 
 
 def file_md5(filename):
@@ -48,6 +78,17 @@ def file_md5(filename):
     return md5.hexdigest()
 
 
+def _has_content(filename, entry):
+    """Return True if filename has the size and md5sum of entry.
+
+    entry is a file entry of a directory listing.
+
+    """
+    size = int(entry.get('size', -1))
+    return (os.path.isfile(filename) and os.path.getsize(filename) == size
+            and file_md5(filename) == entry.get('md5'))
+
+
 def is_binaryfile(filename):
     """Checks if filename is a binary file.
 
@@ -106,9 +147,10 @@ class Merge(object):
                 copy_file(your_filename, out_filename)
                 return Merge.SUCCESS
             return Merge.BINARY
-        merge_cmd = "diff3 -m -E %s %s %s > %s" % (my_filename, old_filename,
-                                                   your_filename, out_filename)
-        ret = subprocess.call(merge_cmd, shell=True)
+        merge_cmd = ['diff3', '-m', '-E', my_filename, old_filename,
+                     your_filename]
+        with open(out_filename, 'w') as f:
+            ret = subprocess.call(merge_cmd, stdout=f)
         if ret == 0:
             return Merge.SUCCESS
         elif ret == 1:
@@ -117,6 +159,44 @@ class Merge(object):
             return Merge.FAILURE
 
 
+class PythonMerge(Merge):
+    """Performs a file merge without spawning a diff3 process.
+
+    The merge itself is done by osc2.util.merge.merge3, which uses
+    diff3 compatible conflict markers. The return values are the
+    same as the ones of class Merge.
+
+    """
+
+    def merge(self, my_filename, old_filename, your_filename, out_filename):
+        try:
+            if filecmp.cmp(my_filename, old_filename, shallow=False):
+                copy_file(your_filename, out_filename)
+                return Merge.SUCCESS
+            elif filecmp.cmp(old_filename, your_filename, shallow=False):
+                if my_filename != out_filename:
+                    copy_file(my_filename, out_filename)
+                return Merge.SUCCESS
+            elif is_binaryfile(my_filename) or is_binaryfile(your_filename):
+                return Merge.BINARY
+            lines = []
+            for filename in (my_filename, old_filename, your_filename):
+                with open(filename, 'rb') as f:
+                    lines.append(f.readlines())
+            # the labels end up in the (byte) lines of the merged file
+            labels = [f.encode('utf-8') if isinstance(f, unicode) else f
+                      for f in (my_filename, your_filename)]
+            merged, conflicts = merge3(*lines, my_label=labels[0],
+                                       your_label=labels[1])
+            with open(out_filename, 'wb') as f:
+                f.writelines(merged)
+        except EnvironmentError:
+            return Merge.FAILURE
+        if conflicts:
+            return Merge.CONFLICT
+        return Merge.SUCCESS
+
+
 class Diff(ListInfo):
     """Encapsulates files for a diff and diff logic.
 
@@ -125,14 +205,30 @@ class Diff(ListInfo):
 
     """
 
-    def __init__(self):
+    def __init__(self, cache_size=0):
+        """Constructs a new Diff object.
+
+        Keyword arguments:
+        cache_size -- if a remote revision is diffed, cleanup keeps
+                      the downloaded files of the most recently used
+                      revisions, as long as they take at most cache_size
+                      bytes (default: 0, that is cleanup removes the
+                      downloaded files)
+
+        """
         super(Diff, self).__init__('unchanged', 'added', 'deleted',
                                    'modified', 'missing', 'skipped')
+        self.cache_size = cache_size
         # all attributes will be set after the Package's diff call
         self.wc_path = ''
         self.old_path = ''
         self._remote_files = None
         self.revision_data = {}
+        # filename => md5 mappings (only known md5sums are contained)
+        self.old_md5s = {}
+        self.wc_md5s = {}
+        # paths of the old files which were already verified or written
+        self._verified = set()
 
     def wc_filename(self, filename):
         """Return the path to the wc filename."""
@@ -141,23 +237,66 @@ class Diff(ListInfo):
     def old_filename(self, filename):
         """Return the path to the old filename."""
         path = os.path.join(self.old_path, filename)
-        if not os.path.exists(path) and self._remote_files is not None:
+        if self._remote_files is not None and path not in self._verified:
             for entry in self._remote_files:
                 if entry.get('name') == filename:
-                    f = entry.file()
-                    f.write_to(path)
+                    # a cached file might be incomplete (for instance,
+                    # if it was not synced to disk before a crash); it
+                    # is verified only once per Diff object
+                    if _has_content(path, entry):
+                        break
+                    if not self._reuse_local_file(entry, path):
+                        f = entry.file()
+                        f.write_to(path)
                     break
+            self._verified.add(path)
         return path
 
+    def _reuse_local_file(self, entry, path):
+        """Materialize a local file with entry's md5sum as path.
+
+        The storefile and the files of the other cached revisions
+        are considered. Return True if such a file exists, otherwise
+        False.
+
+        """
+        filename = entry.get('name')
+        diff_root = os.path.dirname(self.old_path)
+        candidates = [wc_pkg_data_filename(self.wc_path, filename)]
+        for revision in wc_diff_revisions(self.wc_path):
+            candidates.append(os.path.join(diff_root, revision, filename))
+        for candidate in candidates:
+            if candidate != path and _has_content(candidate, entry):
+                clone_file(candidate, path, mtime=int(entry.get('mtime')))
+                return True
+        return False
+
+    def same_content(self, filename):
+        """Return True if the old and the wc file have the same md5sum.
+
+        No md5sum is computed: if one of the md5sums is unknown,
+        False is returned.
+
+        """
+        old_md5 = self.old_md5s.get(filename)
+        return old_md5 is not None and old_md5 == self.wc_md5s.get(filename)
+
     def cleanup(self):
         """Remove downloaded files.
 
+        If a cache_size was specified, the least recently used
+        revisions are removed until the remaining ones fit into
+        the cache.
         Note: it is perfectly ok if subclasses decide to
               cache the downloaded data for some time.
 
         """
         if self._remote_files is None:
             return
+        self._verified.clear()
+        if self.cache_size:
+            wc_diff_prune(self.wc_path, self.cache_size)
+            return
         for filename in os.listdir(self.old_path):
             os.unlink(os.path.join(self.old_path, filename))
         os.rmdir(self.old_path)
@@ -172,17 +311,47 @@ class UnifiedDiff(Diff):
     """Perform unified diff."""
     DIFF_HEADER = "Index: %s\n" + '=' * 67 + '\n'
     DIFF_FILES = "--- %s\t(%s)\n+++ %s\t(%s)\n"
+    # number of lines which are passed to process at once if a
+    # large file is added or deleted
+    STREAM_LINES = 1024
+
+    def __init__(self, jobs=1, max_size=None, **kwargs):
+        """Constructs a new UnifiedDiff object.
+
+        Keyword arguments:
+        jobs -- number of threads which are used to compute the diffs
+                of the modified files (None means the number of cpus);
+                the diffs are still processed in order (default: 1)
+        max_size -- text files which are larger than max_size bytes
+                    are not read into memory; instead, their diff is
+                    passed hunk by hunk to the process method
+                    (default: None, that is no limit)
+        **kwargs -- see class Diff for the details
+
+        """
+        super(UnifiedDiff, self).__init__(**kwargs)
+        self.jobs = jobs
+        self.max_size = max_size
 
     def process(self, data):
         """Process generated diff data.
 
-        data is a list which contains the diff.
+        data is a list which contains the diff. Usually, data
+        contains the complete diff of a file. The diff of a large
+        file (see max_size) is passed in several parts: the
+        first part contains the header and the following parts
+        contain the hunks.
         Subclasses may override this method to present
         the diff data.
 
         """
         pass
 
+    def _is_large(self, *filepaths):
+        if self.max_size is None:
+            return False
+        return max([os.path.getsize(f) for f in filepaths]) > self.max_size
+
     def _diff_binary(self, filename, old_filepath, wc_filepath):
         is_binary = False
         data = [UnifiedDiff.DIFF_HEADER % filename]
@@ -216,6 +385,9 @@ class UnifiedDiff(Diff):
         data = [UnifiedDiff.DIFF_HEADER % filename]
         data.append((UnifiedDiff.DIFF_FILES % (filename, old_revision,
                                                filename, wc_revision)))
+        if self._is_large(filepath):
+            self._stream_add_delete(data, filepath, add)
+            return None
         with open(filepath, 'r') as f:
             diff = f.readlines()
         if add:
@@ -227,6 +399,32 @@ class UnifiedDiff(Diff):
         self._fixup_newline(data)
         return data
 
+    def _stream_add_delete(self, data, filepath, add):
+        """Process the diff of an added or deleted file in parts.
+
+        data contains the header of the diff.
+
+        """
+        with open(filepath, 'r') as f:
+            lines = sum(1 for line in f)
+        if add:
+            data.append('@@ -0,0 +1,%s @@\n' % lines)
+            prefix = '+'
+        else:
+            data.append('@@ -1,%s +0,0 @@\n' % lines)
+            prefix = '-'
+        self.process(data)
+        data = []
+        with open(filepath, 'r') as f:
+            for line in f:
+                if len(data) == UnifiedDiff.STREAM_LINES:
+                    self.process(data)
+                    data = []
+                data.append(prefix + line)
+        self._fixup_newline(data)
+        if data:
+            self.process(data)
+
     def _fixup_newline(self, data):
         if not data:
             return
@@ -238,41 +436,91 @@ class UnifiedDiff(Diff):
             wc_filename = self.wc_filename(filename)
             data = self._diff_add_delete(filename, wc_filename,
                                          'working copy', True)
-            self.process(data)
+            if data is not None:
+                self.process(data)
 
     def _diff_delete(self):
         for filename in self.deleted:
             old_filename = self.old_filename(filename)
             data = self._diff_add_delete(filename, old_filename,
                                          self.revision_data['rev'], False)
-            self.process(data)
+            if data is not None:
+                self.process(data)
 
     def _diff_modified(self):
-        for filename in self.modified:
-            old_filename = self.old_filename(filename)
-            old_revision = "revision %s" % self.revision_data['rev']
-            wc_filename = self.wc_filename(filename)
-            wc_revision = 'working copy'
-            fromfile = "%s\t(%s)" % (filename, old_revision)
-            tofile = "%s\t(%s)" % (filename, wc_revision)
-            data = self._diff_binary(filename, old_filename, wc_filename)
-            if data is not None:
+        # files with the same md5sum are skipped without reading them
+        filenames = [f for f in self.modified if not self.same_content(f)]
+        results = parallel_imap(self._diff_modified_file, filenames,
+                                self.jobs)
+        # izip: the results are processed as soon as they are available
+        for filename, data in itertools.izip(filenames, results):
+            if data is None:
+                # too large: stream it (in order)
+                self._stream_modified(filename)
+            else:
                 self.process(data)
-                continue
-            data = [UnifiedDiff.DIFF_HEADER % filename]
-            with open(old_filename) as f:
-                old = f.readlines()
-            with open(wc_filename) as f:
-                wc = f.readlines()
-            diff = unified_diff(old, wc, fromfile=fromfile, tofile=tofile)
-            # hmm is it possible to avoid the conversion?
-            diff = list(diff)
-            if len(diff) >= 1:
-                diff[0] = diff[0].replace(' \n', '\n')
-                diff[1] = diff[1].replace(' \n', '\n')
-            data.extend(diff)
-            self._fixup_newline(data)
-            self.process(data)
+
+    def _diff_files(self, filename):
+        """Return a tuple (fromfile, tofile) for filename."""
+        old_revision = "revision %s" % self.revision_data['rev']
+        fromfile = "%s\t(%s)" % (filename, old_revision)
+        tofile = "%s\t(%s)" % (filename, 'working copy')
+        return fromfile, tofile
+
+    def _diff_modified_file(self, filename):
+        """Return the diff data of the modified file filename.
+
+        If the file is too large to be read into memory,
+        None is returned.
+
+        """
+        old_filename = self.old_filename(filename)
+        wc_filename = self.wc_filename(filename)
+        data = self._diff_binary(filename, old_filename, wc_filename)
+        if data is not None:
+            return data
+        elif self._is_large(old_filename, wc_filename):
+            return None
+        fromfile, tofile = self._diff_files(filename)
+        data = [UnifiedDiff.DIFF_HEADER % filename]
+        with open(old_filename) as f:
+            old = f.readlines()
+        with open(wc_filename) as f:
+            wc = f.readlines()
+        diff = unified_diff(old, wc, fromfile=fromfile, tofile=tofile)
+        # hmm is it possible to avoid the conversion?
+        diff = list(diff)
+        if len(diff) >= 1:
+            diff[0] = diff[0].replace(' \n', '\n')
+            diff[1] = diff[1].replace(' \n', '\n')
+        data.extend(diff)
+        self._fixup_newline(data)
+        return data
+
+    def _stream_modified(self, filename):
+        """Process the diff of the modified file filename hunk by hunk.
+
+        The diff is computed by an external diff process.
+        A ValueError is raised if the diff process fails.
+
+        """
+        fromfile, tofile = self._diff_files(filename)
+        cmd = ['diff', '-u', '--label', fromfile, '--label', tofile,
+               self.old_filename(filename), self.wc_filename(filename)]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        data = [UnifiedDiff.DIFF_HEADER % filename]
+        in_hunk = False
+        for line in iter(proc.stdout.readline, ''):
+            if line.startswith('@@ '):
+                if in_hunk:
+                    self.process(data)
+                    data = []
+                in_hunk = True
+            data.append(line)
+        proc.stdout.close()
+        if proc.wait() not in (0, 1):
+            raise ValueError("diff failed for file \"%s\"" % filename)
+        self.process(data)
 
     def _diff_missing(self):
         for filename in self.missing:
@@ -373,6 +621,29 @@ class FileSkipHandler(object):
         raise NotImplementedError()
 
 
+class SparseSkipHandler(FileSkipHandler):
+    """Skips the new files which match a sparse checkout pattern.
+
+    Files which are already tracked are not affected (that is, a file
+    which was fetched via Package.materialize is updated as usual).
+
+    """
+
+    def __init__(self, patterns):
+        """Constructs a new SparseSkipHandler object.
+
+        patterns is a list of fnmatch style patterns.
+
+        """
+        super(SparseSkipHandler, self).__init__()
+        self.patterns = patterns
+
+    def skip(self, uinfo):
+        skips = [f for f in uinfo.added
+                 if [p for p in self.patterns if fnmatch.fnmatch(f, p)]]
+        return skips, []
+
+
 class FileCommitPolicy(object):
     """Used to manipulate the calculated commitinfo."""
 
@@ -396,6 +667,7 @@ class PackageUpdateState(XMLTransactionState, UpdateStateMixin):
                                                  uinfo, xml_data, **states)
         if xml_data is None:
             self._xml.append(uinfo.remote_xml)
+            self._write()
 
     def _listnames(self):
         return ('unchanged', 'added', 'deleted', 'modified',
@@ -406,11 +678,13 @@ class PackageUpdateState(XMLTransactionState, UpdateStateMixin):
         """Return the FileUpdateInfo object."""
         lists = self._lists()
         directory = self._xml.find('directory')
+        entries = {}
+        for elm in directory.iterfind('entry'):
+            entries.setdefault(elm.get('name'), elm)
         data = {}
         for filenames in lists.itervalues():
             for filename in filenames:
-                elm = directory.find("//entry[@name='%s']" % filename)
-                data[filename] = elm
+                data[filename] = entries.get(filename)
         return FileUpdateInfo(data=data, remote_xml=directory, **lists)
 
     @property
@@ -423,6 +697,13 @@ class PackageUpdateState(XMLTransactionState, UpdateStateMixin):
         if ustate.name != 'update':
             raise ValueError("no update transaction")
         if ustate.state == UpdateStateMixin.STATE_PREPARE:
+            # keep the downloaded files (they might be reused by
+            # the next update (see Package._reuse_downloads))
+            if os.path.isdir(ustate.location):
+                partial_path = wc_partial_mkdir(path)
+                for filename in os.listdir(ustate.location):
+                    os.rename(os.path.join(ustate.location, filename),
+                              os.path.join(partial_path, filename))
             ustate.cleanup()
             return True
         return False
@@ -477,7 +758,9 @@ class Package(WorkingCopy):
     """Represents a package working copy."""
 
     def __init__(self, path, skip_handlers=None, commit_policies=None,
-                 merge_class=Merge, verify_format=True, **kwargs):
+                 merge_class=Merge, verify_format=True, hash_jobs=None,
+                 transfer_jobs=1, transfer_retries=2, hardlink=False,
+                 merge_jobs=1, **kwargs):
         """Constructs a new package object.
 
         path is the path to the working copy.
@@ -494,6 +777,28 @@ class Package(WorkingCopy):
         merge_class -- class which is used for a file merge
                        (default: Merge)
         verify_format -- verify working copy format (default: True)
+        hash_jobs -- number of threads which are used to compute the
+                     md5sums of the files (None means the number of
+                     cpus) (default: None)
+        transfer_jobs -- number of threads which are used to download
+                         or upload the files during an update or commit
+                         (None means the number of cpus) (default: 1)
+        transfer_retries -- number of retries if an upload fails due to
+                            a network or server error (default: 2)
+        hardlink -- hardlink unmodified working copy files to their
+                    storefiles instead of copying them; the shared files
+                    are read-only, that is they have to be replaced
+                    instead of modified in place (default: False).
+                    WARNING: the permissions do not protect the
+                    storefiles from root or from editors which write
+                    in place (for instance, vim with "backupcopy=yes"
+                    or ":w!"). Such a write also modifies the
+                    storefile. This is detected by wc_check: the
+                    working copy is inconsistent until the storefile
+                    is downloaded again via repair.
+        merge_jobs -- number of threads which are used to merge the
+                      files during an update (None means the number of
+                      cpus) (default: 1)
         **kwargs -- see class WorkingCopy for the details
 
         """
@@ -508,12 +813,29 @@ class Package(WorkingCopy):
         self.skip_handlers = skip_handlers or []
         self.commit_policies = commit_policies or []
         self.merge_class = merge_class
-        with wc_lock(path):
+        self.hash_jobs = hash_jobs
+        self.transfer_jobs = transfer_jobs
+        self.transfer_retries = transfer_retries
+        self.hardlink = hardlink
+        self.merge_jobs = merge_jobs
+        # the patterns of a sparse checkout (see SparseSkipHandler)
+        self.sparse = wc_read_sparse(path)
+        self._stat_cache = WCStatCache(path, file_md5)
+        with wc_lock(path, shared=True):
             self._files = wc_read_files(path)
         # call super at the end due to finish_pending_transaction
         super(Package, self).__init__(path, PackageUpdateState,
                                       PackageCommitState, **kwargs)
 
+    def revision_data(self):
+        """Return a dict which describes the tracked revision.
+
+        The dict contains the attributes of the tracked file list
+        (for instance, rev and srcmd5).
+
+        """
+        return self._files.revision_data()
+
     def files(self):
         """Return list of filenames which are tracked."""
         filenames = []
@@ -539,20 +861,73 @@ class Package(WorkingCopy):
 
         """
         fname = os.path.join(self.path, filename)
-        exists = os.path.exists(fname)
         entry = self._files.find(filename)
         if entry is None:
             return '?'
+        # avoid all stat calls if the watcher knows that the
+        # file did not change
+        digest = self._stat_cache.unchanged_digest(filename)
+        exists = digest is not None or os.path.exists(fname)
         st = entry.get('state')
         if st == 'D':
             return 'D'
         elif st != 'S' and not exists:
             return '!'
-        elif st == ' ' and entry.get('md5') != file_md5(fname):
+        elif st == ' ' and entry.get('md5') != (digest
+                                                or self._md5(filename)):
             return 'M'
         return st
 
+    def _md5(self, filename):
+        """Return the md5sum of the working copy file filename.
+
+        In contrast to file_md5, the md5sum is only computed if the
+        file changed since the last invocation (see WCStatCache).
+        A ValueError is raised if filename does not exist or is no
+        file.
+
+        """
+        fname = os.path.join(self.path, filename)
+        if not os.path.isfile(fname):
+            msg = "filename \"%s\" does not exist or is no file" % fname
+            raise ValueError(msg)
+        return self._stat_cache.digest(filename)
+
+    @_consults_watcher
+    def statuses(self, *filenames):
+        """Return a dict which maps each filename to its status.
+
+        If no filenames are specified, the status of all tracked files
+        is returned. The required md5sums are computed concurrently.
+
+        """
+        if not filenames:
+            filenames = self.files()
+        self._precompute_md5s(*filenames)
+        return dict([(filename, self.status(filename))
+                     for filename in filenames])
+
+    def _precompute_md5s(self, *filenames):
+        """Compute the md5sums which are needed by status.
+
+        Only the md5sums of unchanged files are needed. If no
+        filenames are specified, all tracked files are considered.
+
+        """
+        if not filenames:
+            filenames = self.files()
+        needed = []
+        for filename in filenames:
+            entry = self._files.find(filename)
+            if entry is None or entry.get('state') != ' ':
+                continue
+            if os.path.isfile(os.path.join(self.path, filename)):
+                needed.append(filename)
+        self._stat_cache.digests(needed, self.hash_jobs)
+
+    @_consults_watcher
     def has_conflicts(self):
+        self._precompute_md5s()
         return [c for c in self.files() if self.status(c) == 'C']
 
     def _calculate_updateinfo(self, revision='', remote_files=None, **kwargs):
@@ -567,11 +942,12 @@ class Package(WorkingCopy):
             remote_files = spkg.list(rev=revision, apiurl=self.apiurl,
                                      **kwargs)
         local_files = self.files()
+        self._precompute_md5s(*local_files)
         data = {}
         for rfile in remote_files:
             rfname = rfile.get('name')
             data[rfname] = rfile
-            if rfname not in local_files:
+            if self._files.find(rfname) is None:
                 if os.path.exists(os.path.join(self.path, rfname)):
                     conflicted.append(rfname)
                 else:
@@ -587,7 +963,7 @@ class Package(WorkingCopy):
                 unchanged.append(rfname)
             else:
                 modified.append(rfname)
-        remote_fnames = [f.get('name') for f in remote_files]
+        remote_fnames = set([f.get('name') for f in remote_files])
         for lfname in local_files:
             if lfname not in remote_fnames:
                 st = self.status(lfname)
@@ -608,9 +984,12 @@ class Package(WorkingCopy):
         an invalid skip or unskip list.
 
         """
-        for handler in self.skip_handlers:
+        handlers = self.skip_handlers
+        if self.sparse:
+            handlers = [SparseSkipHandler(self.sparse)] + handlers
+        for handler in handlers:
             skips, unskips = handler.skip(copy.deepcopy(uinfo))
-            inv = [f for f in skips if f not in uinfo.data.keys()]
+            inv = [f for f in skips if f not in uinfo.data]
             inv += [f for f in unskips if f not in uinfo.skipped]
             if inv:
                 msg = "invalid skip/unskip files: %s" % ', '.join(inv)
@@ -653,18 +1032,21 @@ class Package(WorkingCopy):
                     raise FileConflictError(conflicts)
                 if not self._transaction_begin('update', uinfo):
                     return
-                # TODO: if ustate is not None check if we can reuse
-                #       existing files
+                if ustate is not None and ustate.name == 'update':
+                    # the already downloaded files are kept
+                    PackageUpdateState.rollback(self.path)
                 # states might also contain dynamic states like '!' or 'M' etc.
-                states = dict([(f, self.status(f)) for f in self.files()])
+                states = self.statuses()
                 ustate = PackageUpdateState(self.path, uinfo=uinfo, **states)
                 self._update(ustate)
 
     def _update(self, ustate):
         if ustate.state == UpdateStateMixin.STATE_PREPARE:
             uinfo = ustate.info
-            self._download(ustate.location, uinfo.data, *uinfo.added)
-            self._download(ustate.location, uinfo.data, *uinfo.modified)
+            filenames = self._reuse_downloads(ustate.location, uinfo.data,
+                                              uinfo.added + uinfo.modified)
+            self._download(ustate.location, uinfo.data, *filenames)
+            wc_partial_remove(self.path)
             ustate.state = UpdateStateMixin.STATE_UPDATING
         self._perform_merges(ustate)
         self._perform_adds(ustate)
@@ -680,37 +1062,91 @@ class Package(WorkingCopy):
         self.notifier.finished('update', aborted=False)
 
     def _perform_merges(self, ustate):
+        """Merge the remotely modified files into the working copy.
+
+        If more than one merge job is configured, the files are
+        merged concurrently.
+
+        """
         uinfo = ustate.info
+        filenames = list(uinfo.modified)
         filestates = ustate.entrystates
-        for filename in uinfo.modified:
-            wc_filename = os.path.join(self.path, filename)
-            old_filename = wc_pkg_data_filename(self.path, filename)
-            your_filename = os.path.join(ustate.location, filename)
-            st = filestates[filename]
-            if st == '!' or st == 'D' and not os.path.exists(wc_filename):
-                my_filename = old_filename
+        # read it only once (the merge workers must not access the xml)
+        srcmd5 = uinfo.srcmd5
+        if self.merge_jobs == 1 or len(filenames) <= 1:
+            for filename in filenames:
+                self._merge_file(ustate, filename, filestates[filename],
+                                 srcmd5)
+            return
+        lock = threading.Lock()
+        parallel_map(lambda f: self._merge_file(ustate, f, filestates[f],
+                                                srcmd5, lock),
+                     filenames, self.merge_jobs)
+
+    def _merge_file(self, ustate, filename, st, srcmd5, lock=None):
+        """Merge the remotely modified file filename.
+
+        st is the file's state before the update and srcmd5 is the
+        srcmd5 of the new revision. If lock is not None, all
+        transaction state changes and listener notifications are done
+        while holding it.
+
+        """
+        wc_filename = os.path.join(self.path, filename)
+        old_filename = wc_pkg_data_filename(self.path, filename)
+        your_filename = os.path.join(ustate.location, filename)
+        if st == '!' or st == 'D' and not os.path.exists(wc_filename):
+            my_filename = old_filename
+        else:
+            # XXX: in some weird cases wc_filename.mine might be a tracked
+            # file - for now overwrite it
+            my_filename = wc_filename + '.mine'
+            # a rename would be more efficient but also more error prone
+            # (if a update is interrupted)
+            clone_file(wc_filename, my_filename)
+            if os.stat(wc_filename).st_nlink > 1:
+                # the merge writes to wc_filename: do not write
+                # through a hardlink into the storefile
+                os.unlink(wc_filename)
+        merge = self.merge_class()
+        ret = merge.merge(my_filename, old_filename, your_filename,
+                          wc_filename)
+        if ret in (Merge.CONFLICT, Merge.BINARY, Merge.FAILURE):
+            clone_file(your_filename,
+                       wc_filename + '.rev%s' % srcmd5)
+        if lock is None:
+            self._merge_processed(ustate, filename, st, ret, my_filename)
+            return
+        with lock:
+            self._merge_processed(ustate, filename, st, ret, my_filename)
+
+    def _merge_processed(self, ustate, filename, st, ret, my_filename):
+        old_filename = wc_pkg_data_filename(self.path, filename)
+        your_filename = os.path.join(ustate.location, filename)
+        if ret == Merge.SUCCESS:
+            if st == 'D':
+                ustate.processed(filename, 'D')
             else:
-                # XXX: in some weird cases wc_filename.mine might be a tracked
-                # file - for now overwrite it
-                my_filename = wc_filename + '.mine'
-                # a rename would be more efficient but also more error prone
-                # (if a update is interrupted)
-                copy_file(wc_filename, my_filename)
-            merge = self.merge_class()
-            ret = merge.merge(my_filename, old_filename, your_filename,
-                              wc_filename)
-            if ret == Merge.SUCCESS:
-                if st == 'D':
-                    ustate.processed(filename, 'D')
-                else:
-                    ustate.processed(filename, ' ')
-                os.unlink(my_filename)
-            elif ret in (Merge.CONFLICT, Merge.BINARY, Merge.FAILURE):
-                copy_file(your_filename, wc_filename + '.rev%s' % uinfo.srcmd5)
-                ustate.processed(filename, 'C')
-            # copy over new storefile
-            os.rename(your_filename, old_filename)
-            self.notifier.processed(filename, ustate.entrystates[filename], st)
+                ustate.processed(filename, ' ')
+            os.unlink(my_filename)
+        elif ret in (Merge.CONFLICT, Merge.BINARY, Merge.FAILURE):
+            ustate.processed(filename, 'C')
+        # copy over new storefile
+        os.rename(your_filename, old_filename)
+        self.notifier.processed(filename, ustate.entrystates[filename], st)
+
+    def _materialize(self, source, wc_filename, mtime=None):
+        """Materialize the file source as the wc file wc_filename.
+
+        Depending on the hardlink attribute and the capabilities of
+        the filesystem, wc_filename is a hardlink, a reflink or a copy
+        of source.
+
+        Keyword arguments:
+        mtime -- the mtime of wc_filename (default: None)
+
+        """
+        clone_file(source, wc_filename, mtime=mtime, hardlink=self.hardlink)
 
     def _perform_adds(self, ustate):
         uinfo = ustate.info
@@ -718,7 +1154,7 @@ class Package(WorkingCopy):
             wc_filename = os.path.join(self.path, filename)
             store_filename = wc_pkg_data_filename(self.path, filename)
             new_filename = os.path.join(ustate.location, filename)
-            copy_file(new_filename, wc_filename)
+            self._materialize(new_filename, wc_filename)
             ustate.processed(filename, ' ')
             os.rename(new_filename, store_filename)
             self.notifier.processed(filename, ' ', None)
@@ -739,25 +1175,72 @@ class Package(WorkingCopy):
             if os.path.exists(store_filename):
                 store_md5 = file_md5(store_filename)
             if (os.path.isfile(wc_filename)
-                    and file_md5(wc_filename) == store_md5):
+                    and self._md5(filename) == store_md5):
                 os.unlink(wc_filename)
             if store_md5:
                 os.unlink(store_filename)
             ustate.processed(filename, new_state)
             self.notifier.processed(filename, new_state, st)
 
-    def _download(self, location, data, *filenames):
+    def _reuse_downloads(self, location, data, filenames):
+        """Provide the local files which match the new files in location.
+
+        A file of an interrupted update (see PackageUpdateState.rollback)
+        or the storefile is reused if its size and md5sum match the
+        new file's entry in data. The list of the filenames which
+        have to be downloaded is returned.
+
+        """
+        missing = []
         for filename in filenames:
+            entry = data[filename]
             path = os.path.join(location, filename)
-            f = data[filename].file(apiurl=self.apiurl)
+            partial_filename = wc_partial_filename(self.path, filename)
+            store_filename = wc_pkg_data_filename(self.path, filename)
+            if _has_content(partial_filename, entry):
+                os.rename(partial_filename, path)
+            elif _has_content(store_filename, entry):
+                clone_file(store_filename, path,
+                           mtime=int(entry.get('mtime')))
+            else:
+                missing.append(filename)
+        return missing
+
+    def _download(self, location, data, *filenames):
+        """Download the files to location.
+
+        If more than one transfer job is configured, the files are
+        downloaded concurrently. In this case, the largest files are
+        scheduled first so that the small files fill the gaps.
+
+        """
+        if self.transfer_jobs == 1 or len(filenames) <= 1:
+            for filename in filenames:
+                self._download_file(location, data, filename)
+            return
+        filenames = sorted(filenames, reverse=True,
+                           key=lambda f: int(data[f].get('size', 0)))
+        lock = threading.Lock()
+        parallel_map(lambda f: self._download_file(location, data, f, lock),
+                     filenames, self.transfer_jobs)
+
+    def _download_file(self, location, data, filename, lock=None):
+        path = os.path.join(location, filename)
+        f = data[filename].file(apiurl=self.apiurl)
+        if lock is None:
             self.notifier.transfer('download', filename)
-            f.write_to(path)
+        else:
+            # keep the listener notifications serialized
+            with lock:
+                self.notifier.transfer('download', filename)
+        f.write_to(path)
 
     def is_modified(self):
         cinfo = self._calculate_commitinfo()
         return (cinfo.added or cinfo.deleted
                 or cinfo.modified or cinfo.conflicted)
 
+    @_consults_watcher
     def _calculate_commitinfo(self, *filenames):
         unchanged = []
         added = []
@@ -767,6 +1250,7 @@ class Package(WorkingCopy):
         wc_filenames = self.files()
         if not filenames:
             filenames = wc_filenames
+        self._precompute_md5s(*wc_filenames)
         for filename in wc_filenames:
             st = self.status(filename)
             if filename not in filenames:
@@ -852,7 +1336,7 @@ class Package(WorkingCopy):
                     raise WCOutOfDateError(local, remote, msg)
                 if not self._transaction_begin('commit', cinfo):
                     return
-                states = dict([(f, self.status(f)) for f in self.files()])
+                states = self.statuses()
                 cstate = PackageCommitState(self.path, cinfo=cinfo, **states)
                 self._commit(cstate, **kwargs)
 
@@ -885,10 +1369,11 @@ class Package(WorkingCopy):
             if os.path.exists(store_filename):
                 # just to reduce disk space usage
                 os.unlink(store_filename)
-            copy_file(commit_filename, wc_filename)
+            self._materialize(commit_filename, wc_filename)
             os.rename(commit_filename, store_filename)
         self._files.merge(cstate.entrystates, cstate.filelist)
         # fixup mtimes
+        self._precompute_md5s()
         for filename in self.files():
             if self.status(filename) != ' ':
                 continue
@@ -912,9 +1397,10 @@ class Package(WorkingCopy):
                 # skip added files
                 continue
             _append_entry(xml, self._files.find(filename))
+        self._stat_cache.digests(cinfo.added + cinfo.modified,
+                                 self.hash_jobs)
         for filename in cinfo.added + cinfo.modified:
-            wc_filename = os.path.join(self.path, filename)
-            md5 = file_md5(wc_filename)
+            md5 = self._md5(filename)
             _append_entry(xml, {'name': filename, 'md5': md5})
         xml_data = etree.tostring(xml, pretty_print=True)
         return xml_data
@@ -942,19 +1428,59 @@ class Package(WorkingCopy):
         return send_filenames
 
     def _commit_files(self, cstate, send_filenames):
-        for filename in send_filenames:
-            st = self.status(filename)
-            wc_filename = os.path.join(self.path, filename)
-            path = "/source/%s/%s/%s" % (self.project, self.name, filename)
-            lfile = RWLocalFile(wc_filename, wb_path=path, append=True)
+        """Upload the files and move them into the transaction dir.
+
+        If more than one transfer job is configured, the files are
+        uploaded concurrently. The bookkeeping (transaction state and
+        listener notifications) is serialized.
+
+        """
+        states = self.statuses(*send_filenames)
+        lock = threading.Lock()
+        if self.transfer_jobs == 1 or len(send_filenames) <= 1:
+            for filename in send_filenames:
+                self._commit_file(cstate, filename, states[filename], lock)
+            return
+        parallel_map(lambda f: self._commit_file(cstate, f, states[f], lock),
+                     send_filenames, self.transfer_jobs)
+
+    def _commit_file(self, cstate, filename, st, lock):
+        wc_filename = os.path.join(self.path, filename)
+        with lock:
             self.notifier.transfer('upload', filename)
-            lfile.write_back(force=True, rev='repository', apiurl=self.apiurl)
+        self._upload(wc_filename, filename)
+        with lock:
             cstate.processed(filename, ' ')
             commit_filename = os.path.join(cstate.location, filename)
             # move wcfile into transaction dir
-            os.rename(lfile.path, commit_filename)
+            os.rename(wc_filename, commit_filename)
             self.notifier.processed(filename, ' ', st)
 
+    def _upload(self, wc_filename, filename):
+        """Upload wc_filename.
+
+        The upload is retried if it fails due to a network
+        or server error.
+
+        """
+        path = "/source/%s/%s/%s" % (self.project, self.name, filename)
+        retries = self.transfer_retries
+        while True:
+            lfile = RWLocalFile(wc_filename, wb_path=path, append=True)
+            try:
+                lfile.write_back(force=True, rev='repository',
+                                 apiurl=self.apiurl)
+                return
+            except HTTPError as e:
+                if e.code < 500 or retries <= 0:
+                    raise
+            except IOError:
+                if retries <= 0:
+                    raise
+            finally:
+                lfile.close()
+            retries -= 1
+
     def latest_revision(self):
         """Return the latest remote revision."""
         spkg = SourcePackage(self.project, self.name)
@@ -984,6 +1510,51 @@ class Package(WorkingCopy):
             raise ValueError("file \"%s\" has no conflicts" % filename)
         self._files.set(filename, ' ')
 
+    @no_pending_transaction
+    def materialize(self, *filenames):
+        """Fetch the skipped files filenames.
+
+        The files are downloaded in the working copy's revision and
+        are tracked as unchanged files (state ' ') afterwards. This
+        way the files of a sparse checkout are fetched lazily. If no
+        filenames are specified, all skipped files are fetched.
+        A ValueError is raised if a file is not skipped, if a file
+        with the same name already exists in the working copy or if
+        the md5sum of a downloaded file does not match.
+
+        """
+        with wc_lock(self.path):
+            if not filenames:
+                filenames = [f for f in self.files()
+                             if self.status(f) == 'S']
+            for filename in filenames:
+                if self.status(filename) != 'S':
+                    raise ValueError("file \"%s\" is not skipped" % filename)
+                elif os.path.lexists(os.path.join(self.path, filename)):
+                    msg = "file \"%s\" already exists" % filename
+                    raise ValueError(msg)
+            for filename in filenames:
+                self._materialize_skipped(filename)
+
+    def _materialize_skipped(self, filename):
+        entry = self._files.find(filename)
+        path = "/source/%s/%s/%s" % (self.project, self.name, filename)
+        rev = self._files.revision_data().get('srcmd5')
+        mtime = int(float(entry.get('mtime')))
+        wc_filename = os.path.join(self.path, filename)
+        store_filename = wc_pkg_data_filename(self.path, filename)
+        self.notifier.transfer('download', filename)
+        f = RORemoteFile(path, mtime=mtime, rev=rev, apiurl=self.apiurl)
+        f.write_to(store_filename)
+        if file_md5(store_filename) != entry.get('md5'):
+            os.unlink(store_filename)
+            msg = "md5sum of file \"%s\" does not match" % filename
+            raise ValueError(msg)
+        self._materialize(store_filename, wc_filename, mtime=mtime)
+        self._files.set(filename, ' ')
+        self._files.write()
+        self.notifier.processed(filename, ' ', 'S')
+
     def revert(self, *filenames):
         """Revert filenames.
 
@@ -996,7 +1567,7 @@ class Package(WorkingCopy):
         if not filenames:
             filenames = [f for f in self.files() if self.status(f) != 'S']
         super(Package, self).revert(*filenames)
-        with wc_lock(self.path):
+        with wc_batch(self.path):
             for filename in filenames:
                 self._revert(filename)
 
@@ -1016,10 +1587,10 @@ class Package(WorkingCopy):
         elif st == 'D':
             self._files.set(filename, ' ')
             if not os.path.exists(wc_filename):
-                copy_file(store_filename, wc_filename)
+                self._materialize(store_filename, wc_filename)
         elif st in ('M', '!'):
             self._files.set(filename, ' ')
-            copy_file(store_filename, wc_filename)
+            self._materialize(store_filename, wc_filename)
         self._files.write()
 
     def add(self, filename):
@@ -1153,6 +1724,10 @@ class Package(WorkingCopy):
             srcmd5 = directory.get('srcmd5')
             diff.old_path = wc_diff_mkdir(self.path, srcmd5)
             diff.revision_data = {'rev': revision, 'srcmd5': srcmd5}
+            # (locally) modified files have a different md5sum
+            # than their storefile, so this is only needed here
+            diff.old_md5s = dict([(entry.get('name'), entry.get('md5'))
+                                  for entry in directory])
         else:
             info = self._calculate_commitinfo(*filenames)
             consider_filenames(info, filenames)
@@ -1170,15 +1745,33 @@ class Package(WorkingCopy):
                 diff.append(filename, 'missing')
             else:
                 diff.append(filename, 'modified')
+        for filename in diff.modified:
+            if filename in diff.old_md5s:
+                diff.wc_md5s[filename] = self._md5(filename)
+
+    def prune_diff_cache(self, max_size=0):
+        """Remove cached files of remote revision diffs.
+
+        The least recently used revisions are removed until the
+        remaining ones take at most max_size bytes (by default, all
+        cached files are removed). The list of the removed
+        revisions (srcmd5s) is returned.
+
+        """
+        with wc_lock(self.path):
+            return wc_diff_prune(self.path, max_size)
 
     @classmethod
     def wc_check(cls, path):
         """Check path is a consistent package working copy.
 
-        A 3-tuple (missing, xml_data) is returned:
+        A 3-tuple (missing, xml_data, pkg_data) is returned:
         - missing is a tuple which contains all missing storefiles
         - xml_data is a str which contains the invalid files xml str
           (if the xml is valid xml_data is the empty str (''))
+        - pkg_data is a list which contains the filenames whose
+          storefile is missing or was modified through a hardlink
+          (see _modified_storefiles)
 
         """
         meta = missing_storepaths(path, '_project', '_package',
@@ -1195,8 +1788,40 @@ class Package(WorkingCopy):
         filenames = [f.get('name') for f in files
                      if f.get('state') not in ('A', 'S')]
         pkg_data = missing_storepaths(path, *filenames, data=True)
+        pkg_data.extend(Package._modified_storefiles(path, files, filenames))
         return (missing, '', pkg_data)
 
+    @staticmethod
+    def _modified_storefiles(path, files, filenames):
+        """Return the filenames whose storefile was modified in place.
+
+        A storefile which is hardlinked to its working copy file (see
+        the hardlink parameter of Package.__init__) is modified if
+        the working copy file is modified in place (for instance, by
+        an editor which ignores the missing write permissions). In
+        this case, the md5sum of the shared file differs from the
+        tracked md5sum.
+
+        """
+        modified = []
+        stat_cache = None
+        for filename in filenames:
+            wc_filename = os.path.join(path, filename)
+            try:
+                st = os.stat(wc_pkg_data_filename(path, filename))
+                if (st.st_nlink < 2
+                        or not os.path.samestat(st, os.stat(wc_filename))):
+                    continue
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                continue
+            if stat_cache is None:
+                stat_cache = WCStatCache(path, file_md5)
+            if stat_cache.digest(filename) != files.find(filename).get('md5'):
+                modified.append(filename)
+        return modified
+
     @staticmethod
     def repair(path, ext_storedir=None, revision='latest', **kwargs):
         """Repair a working copy.
@@ -1240,6 +1865,10 @@ class Package(WorkingCopy):
         missing, xml_data, pkg_data = Package.wc_check(path)
         for filename in pkg_data:
             fname = wc_pkg_data_filename(path, filename)
+            if os.path.exists(fname):
+                # a modified storefile (the working copy file keeps
+                # its data)
+                os.unlink(fname)
             f = files.find(filename).file()
             f.write_to(fname)
         # clean unused storefiles
@@ -1249,7 +1878,8 @@ class Package(WorkingCopy):
                 os.unlink(os.path.join(store, filename))
 
     @staticmethod
-    def init(path, project, package, apiurl, ext_storedir=None, **kwargs):
+    def init(path, project, package, apiurl, ext_storedir=None, sparse=None,
+             sqlite=False, **kwargs):
         """Initializes a directory as a package working copy.
 
         path is a path to a directory, project is the name
@@ -1260,13 +1890,21 @@ class Package(WorkingCopy):
         ext_storedir -- path to the storedir (default: None).
                         If not specified a "flat" package is created,
                         otherwise path/.osc is a symlink to storedir.
+        sparse -- list of fnmatch style patterns; new files which match
+                  a pattern are skipped on update and can be fetched
+                  later via the materialize method (default: None)
+        sqlite -- create a working copy in the sqlite format (if
+                  ext_storedir is an initialized storedir, its format
+                  is used) (default: False)
         kwargs -- optional keyword args which are passed to Package's
                   __init__ method
 
         """
-        wc_init(path, ext_storedir=ext_storedir)
+        wc_init(path, ext_storedir=ext_storedir, sqlite=sqlite)
         wc_write_project(path, project)
         wc_write_package(path, package)
         wc_write_apiurl(path, apiurl)
         wc_write_files(path, '<directory/>')
+        if sparse:
+            wc_write_sparse(path, sparse)
         return Package(path, **kwargs)
@@ -2,9 +2,11 @@
 
 import os
 import shutil
+import threading
 
 from osc2.wc.base import (WorkingCopy, UpdateStateMixin, CommitStateMixin,
-                          PendingTransactionError, FileConflictError)
+                          PendingTransactionError, FileConflictError,
+                          BufferedTransactionListener)
 from osc2.wc.package import Package
 from osc2.wc.util import (wc_read_project, wc_read_apiurl, wc_read_packages,
                           wc_init, wc_write_apiurl, wc_write_project,
@@ -12,10 +14,54 @@ from osc2.wc.util import (wc_read_project, wc_read_apiurl, wc_read_packages,
                           WCInconsistentError, wc_is_project, wc_is_package,
                           wc_pkg_data_mkdir, XMLTransactionState, _storedir,
                           _STORE, wc_pkg_data_filename, wc_verify_format,
-                          _PKG_DATA, wc_write_version)
+                          _PKG_DATA, wc_write_version, wc_is_sqlite,
+                          wc_batch)
+from osc2.wc.watch import dirty_set
 from osc2.source import Project as SourceProject
 from osc2.remote import RemotePackage
+from osc2.httprequest import HTTPError
 from osc2.util.listinfo import ListInfo
+from osc2.util.parallel import parallel_map
+
+
+def _clears_package_cache(meth):
+    """Clear the project's package cache after meth was called.
+
+    Can be used to decorate methods which might modify the
+    package working copies.
+
+    """
+    def wrapper(self, *args, **kwargs):
+        try:
+            return meth(self, *args, **kwargs)
+        finally:
+            self._package_cache.clear()
+    return wrapper
+
+
+def _shares_dirty_set(meth):
+    """Consult the working copy watcher only once during meth.
+
+    The project's DirtySet is shared by the packages which are
+    returned by method package (otherwise, each package consults the
+    watcher itself (see osc2.wc.package._consults_watcher)).
+    Must only decorate methods which do not modify the working copy.
+
+    """
+    def wrapper(self, *args, **kwargs):
+        if self._dirty is not None:
+            return meth(self, *args, **kwargs)
+        # None if the project is not watched (a package might still be
+        # watched itself)
+        self._dirty = dirty_set(self.path)
+        try:
+            return meth(self, *args, **kwargs)
+        finally:
+            self._dirty = None
+            for pkg in self._dirty_packages:
+                pkg._stat_cache.dirty = None
+            self._dirty_packages = []
+    return wrapper
 
 
 class PackageUpdateInfo(ListInfo):
@@ -105,10 +151,26 @@ class ProjectCommitState(XMLTransactionState, CommitStateMixin):
         return ('unchanged', 'added', 'deleted', 'modified', 'conflicted')
 
     def processed(self, package, new_state=None):
-        # set back to STATE_TRANSFER
-        self.state = CommitStateMixin.STATE_TRANSFER
+        # set back to STATE_TRANSFER (during a concurrent commit the
+        # state stays STATE_COMMITTING, because other packages might
+        # be committed already)
+        if not self.concurrent:
+            self.state = CommitStateMixin.STATE_TRANSFER
         super(ProjectCommitState, self).processed(package, new_state)
 
+    @property
+    def concurrent(self):
+        """Return True if the packages are committed concurrently."""
+        return self._xml.get('concurrent') == '1'
+
+    @concurrent.setter
+    def concurrent(self, concurrent):
+        if concurrent:
+            self._xml.set('concurrent', '1')
+        elif 'concurrent' in self._xml.attrib:
+            del self._xml.attrib['concurrent']
+        self._write()
+
     @property
     def info(self):
         """Return the ProjectCommitInfo object."""
@@ -153,7 +215,12 @@ class Project(WorkingCopy):
             raise WCInconsistentError(path, meta, xml_data, pkg_data)
         self.apiurl = wc_read_apiurl(path)
         self.name = wc_read_project(path)
-        with wc_lock(path):
+        # package name => Package object (see method package)
+        self._package_cache = {}
+        # the shared DirtySet (see _shares_dirty_set)
+        self._dirty = None
+        self._dirty_packages = []
+        with wc_lock(path, shared=True):
             self._packages = wc_read_packages(path)
         super(Project, self).__init__(path, ProjectUpdateState,
                                       ProjectCommitState, **kwargs)
@@ -192,16 +259,32 @@ class Project(WorkingCopy):
     def has_conflicts(self):
         return []
 
-    def _calculate_updateinfo(self, *packages):
+    @_shares_dirty_set
+    def _calculate_updateinfo(self, *packages, **kwargs):
+        """Return a PackageUpdateInfo object.
+
+        Keyword arguments:
+        sourceinfo -- the source info of the remote packages (see
+                      _remote_sourceinfo); if specified, the remote
+                      packages are not listed (default: None)
+
+        """
         added = []
         deleted = []
         candidates = []
         conflicted = []
-        sprj = SourceProject(self.name)
-        remote_pkgs = [pkg.name for pkg in sprj.list(apiurl=self.apiurl)]
+        sourceinfo = kwargs.get('sourceinfo')
+        if sourceinfo is not None:
+            remote_pkgs = sorted(sourceinfo.keys())
+        else:
+            sprj = SourceProject(self.name)
+            remote_pkgs = [pkg.name for pkg in sprj.list(apiurl=self.apiurl)]
         local_pkgs = self.packages()
+        # sets for the membership tests
+        remote_set = set(remote_pkgs)
+        local_set = set(local_pkgs)
         for package in remote_pkgs:
-            if package in local_pkgs:
+            if package in local_set:
                 candidates.append(package)
             else:
                 added.append(package)
@@ -210,7 +293,7 @@ class Project(WorkingCopy):
             pkg = self.package(package)
             if pkg is not None and not pkg.is_updateable():
                 conflicted.append(package)
-            elif st != 'A' and package not in remote_pkgs:
+            elif st != 'A' and package not in remote_set:
                 deleted.append(package)
         # check for conflicts
         for package in candidates[:]:
@@ -218,15 +301,17 @@ class Project(WorkingCopy):
             if (self._status(package) in ('A', '!')
                     or not pkg.is_updateable()):
                 conflicted.append(package)
-                candidates.remove(package)
         for package in added[:]:
             path = os.path.join(self.path, package)
             st = self._status(package)
             if st == '?' and os.path.exists(path):
                 conflicted.append(package)
-                added.remove(package)
+        conflicted_set = set(conflicted)
+        candidates = [p for p in candidates if p not in conflicted_set]
+        added = [p for p in added if p not in conflicted_set]
         if packages:
             # only consider specified packages
+            packages = set(packages)
             candidates = [p for p in candidates if p in packages]
             added = [p for p in added if p in packages]
             deleted = [p for p in deleted if p in packages]
@@ -253,6 +338,7 @@ class Project(WorkingCopy):
                 break
         state.clear_info(entry)
 
+    @_clears_package_cache
     def update(self, *packages, **kwargs):
         """Update project working copy.
 
@@ -261,10 +347,16 @@ class Project(WorkingCopy):
         will be updated.
 
         Keyword arguments:
+        jobs -- number of packages which are updated concurrently
+                (None means the number of cpus) (default: 1)
+        sparse -- list of sparse checkout patterns for the newly
+                  checked out packages (see Package.init)
+                  (default: None)
         **kwargs -- optional keyword arguments which will be passed
                     to the Package's update method
 
         """
+        sparse = kwargs.pop('sparse', None)
         with wc_lock(self.path):
             ustate = ProjectUpdateState.read_state(self.path)
             if not self.is_updateable(rollback=True):
@@ -272,40 +364,140 @@ class Project(WorkingCopy):
             if (ustate is not None
                     and ustate.state == UpdateStateMixin.STATE_UPDATING):
                 self._clear_uinfo(ustate)
-                self._update(ustate)
+                self._update(ustate, jobs=kwargs.get('jobs', 1),
+                             sparse=sparse)
             else:
-                uinfo = self._calculate_updateinfo(*packages)
+                sourceinfo = self._remote_sourceinfo(**kwargs)
+                uinfo = self._calculate_updateinfo(*packages,
+                                                   sourceinfo=sourceinfo)
                 conflicts = uinfo.conflicted
                 if conflicts:
                     # a package might be in conflicts because
                     # its is_updateable method returned False
                     raise FileConflictError(conflicts)
+                if sourceinfo is not None:
+                    unchanged = self._unchanged_candidates(
+                        uinfo, sourceinfo, expand=kwargs.get('expand'))
+                    for package in unchanged:
+                        uinfo.remove(package)
                 if not self._transaction_begin('prj_update', uinfo):
                     return
                 states = dict([(p, self._status(p)) for p in self.packages()])
                 ustate = ProjectUpdateState(self.path, uinfo=uinfo, **states)
-                self._update(ustate, **kwargs)
+                self._update(ustate, sparse=sparse, **kwargs)
                 self.notifier.finished('prj_update', aborted=False)
 
-    def _update(self, ustate, **kwargs):
-        self._perform_adds(ustate, **kwargs)
+    def _remote_sourceinfo(self, **kwargs):
+        """Return the source info of all remote packages or None.
+
+        The source info is retrieved with a single http request (see
+        source.Project.sourceinfo). It is only retrieved if the
+        packages are updated to the latest revision and kwargs
+        contains no other parameters for the http request (otherwise
+        None is returned).
+
+        """
+        revision = kwargs.get('revision')
+        params = set(kwargs.keys()) - set(['jobs', 'revision', 'expand'])
+        if params or revision not in (None, '', 'latest'):
+            return None
+        sprj = SourceProject(self.name)
+        try:
+            return sprj.sourceinfo(apiurl=self.apiurl)
+        except HTTPError:
+            # for instance, an old server which does not support it
+            return None
+
+    def _unchanged_candidates(self, uinfo, sourceinfo, expand=False):
+        """Return a list of candidates which did not change remotely.
+
+        sourceinfo is the source info of the remote packages (see
+        _remote_sourceinfo). It is compared with the revision of
+        each candidate.
+
+        Keyword arguments:
+        expand -- if True, the srcmd5 of the expanded sources of a
+                  link is compared (default: False)
+
+        """
+        unchanged = []
+        for package in uinfo.candidates:
+            info = sourceinfo.get(package)
+            if info is None or 'error' in info:
+                continue
+            # the srcmd5 of a link is the srcmd5 of the expanded sources
+            srcmd5 = info.get('srcmd5')
+            if not expand and 'lsrcmd5' in info:
+                srcmd5 = info['lsrcmd5']
+            local = self.package(package).revision_data().get('srcmd5')
+            if srcmd5 is not None and local == srcmd5:
+                unchanged.append(package)
+        return unchanged
+
+    def _update(self, ustate, jobs=1, sparse=None, **kwargs):
+        self._perform_adds(ustate, jobs, sparse, **kwargs)
         self._perform_deletes(ustate)
-        self._perform_candidates(ustate, **kwargs)
+        self._perform_candidates(ustate, jobs, **kwargs)
         self._packages.merge(ustate.entrystates)
         ustate.cleanup()
 
-    def _perform_adds(self, ustate, **kwargs):
+    def _run_jobs(self, func, packages, jobs, done=None):
+        """Call func(package, transaction_listener) for each package.
+
+        The calls are executed by at most jobs threads. The
+        notifications of each call are buffered and passed to
+        the listeners after the call returned (this way the
+        notifications of different packages do not interleave).
+        If specified, done(package) is called afterwards. Both,
+        the delivery of the notifications and done, are serialized.
+
+        """
+        lock = threading.Lock()
+
+        def run(package):
+            buf = BufferedTransactionListener()
+            try:
+                func(package, [buf])
+            finally:
+                with lock:
+                    buf.flush(self.notifier)
+            if done is not None:
+                with lock:
+                    done(package)
+
+        parallel_map(run, packages, jobs)
+
+    def _perform_adds(self, ustate, jobs=1, sparse=None, **kwargs):
         uinfo = ustate.info
         tl = self.notifier.listener
+
+        def checkout(package, transaction_listener):
+            tmp_dir = os.path.join(ustate.location, package)
+            storedir = wc_pkg_data_filename(self.path, package)
+            if os.path.exists(storedir):
+                # leftover of an interrupted checkout
+                shutil.rmtree(storedir)
+            os.mkdir(storedir)
+            pkg = Package.init(tmp_dir, self.name, package,
+                               self.apiurl, storedir, sparse=sparse,
+                               sqlite=wc_is_sqlite(self.path),
+                               transaction_listener=transaction_listener)
+            pkg.update(**kwargs)
+
+        prepared = []
+        if (jobs != 1 and len(uinfo.added) > 1
+                and ustate.state == UpdateStateMixin.STATE_PREPARE):
+            # check out all packages into the transaction dir before
+            # any of them is moved into the wc (a rollback is still
+            # possible, because the state stays STATE_PREPARE)
+            self._run_jobs(checkout, uinfo.added, jobs)
+            prepared = uinfo.added
         for package in uinfo.added:
             tmp_dir = os.path.join(ustate.location, package)
             storedir = wc_pkg_data_filename(self.path, package)
             if ustate.state == UpdateStateMixin.STATE_PREPARE:
-                os.mkdir(storedir)
-                pkg = Package.init(tmp_dir, self.name, package,
-                                   self.apiurl, storedir,
-                                   transaction_listener=tl)
-                pkg.update(**kwargs)
+                if package not in prepared:
+                    checkout(package, tl)
                 ustate.state = UpdateStateMixin.STATE_UPDATING
             # fixup symlink
             new_dir = os.path.join(self.path, package)
@@ -333,21 +525,33 @@ class Project(WorkingCopy):
             self.notifier.finished('update', aborted=False)
             self.notifier.processed(package, None, st)
 
-    def _perform_candidates(self, ustate, **kwargs):
+    def _perform_candidates(self, ustate, jobs=1, **kwargs):
         uinfo = ustate.info
-        tl = self.notifier.listener
-        for package in uinfo.candidates:
-            pkg = self.package(package, transaction_listener=tl)
+
+        def update(package, transaction_listener):
+            pkg = self.package(package,
+                               transaction_listener=transaction_listener)
             # pkg should never ever be None at this point
             if pkg is None:
                 msg = "package \"%s\" is an invalid candidate." % package
                 raise ValueError(msg)
             pkg.update(**kwargs)
+
+        def processed(package):
             # FIXME: is ' ' the correct state?
             ustate.processed(package, ' ')
             # FIXME: old state should be self._status(package)
             self.notifier.processed(package, ' ', ' ')
 
+        if jobs != 1 and len(uinfo.candidates) > 1:
+            # each package is updated in its own transaction
+            self._run_jobs(update, uinfo.candidates, jobs, processed)
+            return
+        tl = self.notifier.listener
+        for package in uinfo.candidates:
+            update(package, tl)
+            processed(package)
+
     def _remove_wc_dir(self, package, notify=False):
         pkg = self.package(package)
         if pkg is not None:
@@ -366,6 +570,7 @@ class Project(WorkingCopy):
         if os.path.exists(store):
             shutil.rmtree(store)
 
+    @_shares_dirty_set
     def _calculate_commitinfo(self, *packages):
         unchanged = []
         added = []
@@ -395,6 +600,7 @@ class Project(WorkingCopy):
         return PackageCommitInfo(self.name, unchanged, added, deleted,
                                  modified, conflicted)
 
+    @_clears_package_cache
     def commit(self, *packages, **kwargs):
         """Commit project working copy.
 
@@ -407,16 +613,20 @@ class Project(WorkingCopy):
                              of filenames (only these filenames will
                              be committed) (default: {})
         comment -- a commit message (default: '')
+        jobs -- number of packages which are committed concurrently
+                (None means the number of cpus) (default: 1)
 
         """
+        jobs = kwargs.get('jobs', 1)
         with wc_lock(self.path):
             cstate = ProjectCommitState.read_state(self.path)
             if not self.is_commitable(rollback=True):
                 raise PendingTransactionError('commit')
             if (cstate is not None
                     and cstate.state == CommitStateMixin.STATE_COMMITTING):
-                self._clear_cinfo(cstate)
-                self._commit(cstate, {}, '')
+                if not cstate.concurrent:
+                    self._clear_cinfo(cstate)
+                self._commit(cstate, {}, '', jobs)
             else:
                 package_filenames = kwargs.get('package_filenames', {})
                 if [p for p in packages if p in package_filenames]:
@@ -434,34 +644,81 @@ class Project(WorkingCopy):
                 states = dict([(p, self._status(p)) for p in self.packages()])
                 cstate = ProjectCommitState(self.path, cinfo=cinfo, **states)
                 comment = kwargs.get('comment', '')
-                self._commit(cstate, package_filenames, comment)
+                self._commit(cstate, package_filenames, comment, jobs)
                 self.notifier.finished('prj_commit', aborted=False)
 
-    def _commit(self, cstate, package_filenames, comment):
-        self._commit_adds(cstate, package_filenames, comment)
+    def _commit(self, cstate, package_filenames, comment, jobs=1):
+        self._commit_adds(cstate, package_filenames, comment, jobs)
         self._commit_deletes(cstate)
-        self._commit_modified(cstate, package_filenames, comment)
+        self._commit_modified(cstate, package_filenames, comment, jobs)
         self._packages.merge(cstate.entrystates)
         cstate.cleanup()
 
-    def _commit_adds(self, cstate, package_filenames, comment):
-        cinfo = cstate.info
+    def _commit_packages(self, cstate, packages, commit, done, jobs):
+        """Commit the packages.
+
+        commit(package, transaction_listener) commits a single
+        package and done(package) records the commit in cstate.
+        If the state is STATE_COMMITTING, an interrupted commit is
+        finished: the pending package transactions are finished but
+        no new package transaction is started (that is, a package
+        which is still modified is not committed).
+
+        """
+        resume = cstate.state == CommitStateMixin.STATE_COMMITTING
+        committed = {}
+
+        def run(package, transaction_listener):
+            if not resume:
+                commit(package, transaction_listener)
+                committed[package] = True
+                return
+            # a pending package transaction is finished by self.package
+            pkg = self.package(package,
+                               transaction_listener=transaction_listener)
+            committed[package] = pkg is not None and not pkg.is_modified()
+
+        def finish(package):
+            if committed[package]:
+                done(package)
+            else:
+                cstate.processed(package, cstate.entrystates[package])
+
+        if jobs != 1 and len(packages) > 1:
+            # from now on a rollback is not possible anymore
+            cstate.state = CommitStateMixin.STATE_COMMITTING
+            cstate.concurrent = True
+            self._run_jobs(run, packages, jobs, finish)
+            cstate.concurrent = False
+            cstate.state = CommitStateMixin.STATE_TRANSFER
+            return
         tl = self.notifier.listener
-        for package in cinfo.added:
-            if cstate.state == CommitStateMixin.STATE_TRANSFER:
-                # check if package was created in the meantime
-                exists = RemotePackage.exists(self.name, package,
-                                              apiurl=self.apiurl)
-                if not exists:
-                    pkg = RemotePackage(self.name, package)
-                    pkg.store(apiurl=self.apiurl)
-                pkg = self.package(package, transaction_listener=tl)
-                filenames = package_filenames.get(package, [])
-                pkg.commit(*filenames, comment=comment)
-                cstate.state = CommitStateMixin.STATE_COMMITTING
+        for package in packages:
+            run(package, tl)
+            cstate.state = CommitStateMixin.STATE_COMMITTING
+            finish(package)
+
+    def _commit_adds(self, cstate, package_filenames, comment, jobs=1):
+        cinfo = cstate.info
+
+        def commit(package, transaction_listener):
+            # check if package was created in the meantime
+            exists = RemotePackage.exists(self.name, package,
+                                          apiurl=self.apiurl)
+            if not exists:
+                pkg = RemotePackage(self.name, package)
+                pkg.store(apiurl=self.apiurl)
+            pkg = self.package(package,
+                               transaction_listener=transaction_listener)
+            filenames = package_filenames.get(package, [])
+            pkg.commit(*filenames, comment=comment)
+
+        def done(package):
             cstate.processed(package, ' ')
             self.notifier.processed(package, ' ', 'A')
 
+        self._commit_packages(cstate, cinfo.added, commit, done, jobs)
+
     def _commit_deletes(self, cstate):
         cinfo = cstate.info
         for package in cinfo.deleted:
@@ -472,18 +729,22 @@ class Project(WorkingCopy):
             cstate.processed(package, None)
             self.notifier.processed(package, None, 'D')
 
-    def _commit_modified(self, cstate, package_filenames, comment):
+    def _commit_modified(self, cstate, package_filenames, comment, jobs=1):
         cinfo = cstate.info
-        tl = self.notifier.listener
-        for package in cinfo.modified:
-            if cstate.state == CommitStateMixin.STATE_TRANSFER:
-                pkg = self.package(package, transaction_listener=tl)
-                filenames = package_filenames.get(package, [])
-                pkg.commit(*filenames, comment=comment)
-                cstate.state = CommitStateMixin.STATE_COMMITTING
+
+        def commit(package, transaction_listener):
+            pkg = self.package(package,
+                               transaction_listener=transaction_listener)
+            filenames = package_filenames.get(package, [])
+            pkg.commit(*filenames, comment=comment)
+
+        def done(package):
             cstate.processed(package, ' ')
             self.notifier.processed(package, ' ', ' ')
 
+        self._commit_packages(cstate, cinfo.modified, commit, done, jobs)
+
+    @_clears_package_cache
     def revert(self, *packages):
         """Reverts the specified packages.
 
@@ -495,7 +756,7 @@ class Project(WorkingCopy):
         if not packages:
             packages = self.packages()
         super(Project, self).revert(*packages)
-        with wc_lock(self.path):
+        with wc_batch(self.path):
             for package in packages:
                 self._revert(package)
 
@@ -534,6 +795,7 @@ class Project(WorkingCopy):
             self._packages.set(package, ' ')
             self._packages.write()
 
+    @_clears_package_cache
     def add(self, package, *filenames, **kwargs):
         """Add a new package to the project.
 
@@ -568,7 +830,8 @@ class Project(WorkingCopy):
                 raise ValueError(msg)
             storedir = wc_pkg_data_mkdir(self.path, package)
             pkg = Package.init(pkg_path, self.name, package, self.apiurl,
-                               ext_storedir=storedir)
+                               ext_storedir=storedir,
+                               sqlite=wc_is_sqlite(self.path))
             self._packages.add(package, state='A')
             self._packages.write()
             if no_files:
@@ -576,9 +839,11 @@ class Project(WorkingCopy):
             elif not filenames:
                 filenames = [f for f in os.listdir(pkg.path)
                              if os.path.isfile(os.path.join(pkg.path, f))]
-            for filename in filenames:
-                pkg.add(filename)
+            with wc_batch(pkg.path):
+                for filename in filenames:
+                    pkg.add(filename)
 
+    @_clears_package_cache
     def remove(self, package):
         """Mark a package for deletion.
 
@@ -612,14 +877,29 @@ class Project(WorkingCopy):
         or if package is untracked.
 
         *args and **kwargs are additional arguments for the
-        Package's __init__ method.
+        Package's __init__ method. If neither *args nor **kwargs
+        are specified, the Package object is cached (that is,
+        subsequent calls return the same object until a method
+        which modifies the working copy is called).
 
         """
         path = os.path.join(self.path, package)
         st = self._status(package)
         if st in ('!', '?') or not wc_is_package(path):
+            self._package_cache.pop(package, None)
             return None
-        return Package(path, *args, **kwargs)
+        if args or kwargs:
+            # the returned object might be used to modify the package
+            self._package_cache.pop(package, None)
+            return Package(path, *args, **kwargs)
+        pkg = self._package_cache.get(package)
+        if pkg is None:
+            pkg = Package(path)
+            self._package_cache[package] = pkg
+        if self._dirty is not None and pkg._stat_cache.dirty is None:
+            pkg._stat_cache.dirty = self._dirty.subset(package)
+            self._dirty_packages.append(pkg)
+        return pkg
 
     @classmethod
     def wc_check(cls, path):
@@ -708,8 +988,13 @@ class Project(WorkingCopy):
         *args and **kwargs are additional arguments for the
         Project's __init__ method.
 
+        Keyword arguments:
+        sqlite -- create a working copy in the sqlite format (its
+                  packages are created in this format as well)
+                  (default: False)
+
         """
-        wc_init(path)
+        wc_init(path, sqlite=kwargs.pop('sqlite', False))
         wc_write_project(path, project)
         wc_write_apiurl(path, apiurl)
         wc_write_packages(path, '<packages/>')
@@ -5,17 +5,25 @@ instance.
 """
 
 import os
+import copy
+import json
+import time
 import errno
 import fcntl
+import logging
+import stat
 import shutil
+import sqlite3
+import threading
+from collections import deque
 
 from lxml import etree, objectify
 
 from osc2.wc.base import AbstractTransactionState
 from osc2.source import File, Directory, Linkinfo
 from osc2.util.io import mkstemp
+from osc2.util.parallel import parallel_map
 from osc2.util.xml import fromstring
-from osc2.util.xpath import XPathBuilder
 
 __all__ = ['wc_is_project', 'wc_is_package', 'wc_read_project',
            'wc_read_package', 'wc_read_apiurl']
@@ -24,8 +32,15 @@ __all__ = ['wc_is_project', 'wc_is_package', 'wc_read_project',
 _STORE = '.osc'
 _PKG_DATA = 'data'
 _DIFF_DATA = 'diff'
+# the files which were downloaded by an interrupted update
+_PARTIAL_DATA = 'partial'
 _LOCK = 'wc.lock'
+_STAT_CACHE = '_md5cache'
+_DATABASE = '_wc.db'
 _VERSION = 2.0
+# the format version of a working copy whose metadata is stored in
+# a sqlite database (see WCDatabase)
+_SQLITE_VERSION = 3.0
 
 
 class WCInconsistentError(Exception):
@@ -47,24 +62,49 @@ class WCFormatVersionError(Exception):
         self.version = version
 
 
+# lock filename => [file object, number of holders, exclusive, busy]
+# (busy is True while a thread acquires or upgrades the lock; the
+# other threads have to wait until it is done)
+_held_locks = {}
+_held_locks_cond = threading.Condition(threading.Lock())
+
+
 class WCLock(object):
     """Represents a lock on a working copy.
 
-    "Coordinates" working copy locking.
+    "Coordinates" working copy locking. A lock is either exclusive
+    (for operations which modify the working copy) or shared (for
+    read-only operations): several shared locks can be held at the
+    same time. Like all fcntl locks, the lock is held by the process
+    (that is, it does not protect against other threads of the same
+    process). Therefore, a lock which is already held by the process
+    is not acquired again: it is released when the outermost lock is
+    released (a shared lock is converted into an exclusive lock if
+    an exclusive lock is requested).
+    The number of seconds the last lock call had to wait for the
+    lock is available via the wait_time attribute (a wait is also
+    logged).
 
     """
 
-    def __init__(self, path):
+    def __init__(self, path, shared=False):
         """Constructs a new WCLock object.
 
         path is the path to wc working copy.
         No lock is acquired (it must be explicitly locked
         via the lock() method).
 
+        Keyword arguments:
+        shared -- if True, a shared lock is acquired instead of an
+                  exclusive lock (default: False)
+
         """
         super(WCLock, self).__init__()
         self._path = path
         self._fobj = None
+        self.shared = shared
+        self.wait_time = 0.0
+        self._logger = logging.getLogger(__name__)
 
     def has_lock(self):
         """Check if this object has lock on the working copy.
@@ -74,11 +114,27 @@ class WCLock(object):
         """
         return self._fobj is not None
 
+    def _acquire(self, f, mode):
+        """Acquire the lock on f.
+
+        Return True if the lock was acquired without waiting.
+
+        """
+        try:
+            fcntl.lockf(f, mode | fcntl.LOCK_NB)
+            return True
+        except IOError as e:
+            if e.errno not in (errno.EACCES, errno.EAGAIN):
+                raise
+        fcntl.lockf(f, mode)
+        return False
+
     def lock(self):
         """Acquire the lock on the working copy.
 
         This call might block if the working copy is already
-        locked.
+        locked (a shared lock only blocks if an exclusive lock
+        is held).
         A RuntimeError is raised if this object already
         has a lock on the working copy.
 
@@ -89,9 +145,80 @@ class WCLock(object):
             # it smells like a programming/logic error (IMHO)
             raise RuntimeError('Double lock occured')
         lock = _storefile(self._path, _LOCK)
-        f = open(lock, 'w')
-        fcntl.lockf(f, fcntl.LOCK_EX)
-        self._fobj = f
+        key = os.path.realpath(lock)
+        mode = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        start = time.time()
+        waited = False
+        # a second file object for the same lock file must not be
+        # opened (closing it would release the process' lock). Hence,
+        # the registry entry is marked as busy while the lock file is
+        # locked (the registry lock is not held while blocking)
+        with _held_locks_cond:
+            while True:
+                held = _held_locks.get(key)
+                if held is None:
+                    held = _held_locks[key] = [None, 0, False, True]
+                    break
+                if not held[3]:
+                    if self.shared or held[2]:
+                        # nothing to acquire
+                        held[1] += 1
+                        self._fobj = held[0]
+                        break
+                    held[3] = True
+                    break
+                waited = True
+                _held_locks_cond.wait()
+        if self._fobj is None:
+            try:
+                if held[0] is None:
+                    held[0], blocked = self._lock_file(lock, mode)
+                else:
+                    blocked = not self._acquire(held[0], mode)
+                waited = waited or blocked
+            except:
+                with _held_locks_cond:
+                    if held[0] is None:
+                        del _held_locks[key]
+                    held[3] = False
+                    _held_locks_cond.notify_all()
+                raise
+            with _held_locks_cond:
+                held[1] += 1
+                held[2] = held[2] or not self.shared
+                held[3] = False
+                self._fobj = held[0]
+                _held_locks_cond.notify_all()
+        self.wait_time = 0.0
+        if waited:
+            self.wait_time = time.time() - start
+            self._logger.debug('waited %.3fs for the %s lock on %s',
+                               self.wait_time,
+                               'shared' if self.shared else 'exclusive',
+                               self._path)
+
+    def _lock_file(self, lock, mode):
+        """Lock the lock file lock.
+
+        A (file object, waited) tuple is returned.
+
+        """
+        waited = False
+        while True:
+            # a shared lock requires a file which is open for reading
+            f = open(lock, 'a+')
+            if not self._acquire(f, mode):
+                waited = True
+            # the lock file might have been removed by the previous
+            # lock holder (in this case, we have to lock the new file)
+            try:
+                if os.fstat(f.fileno()).st_ino == os.stat(lock).st_ino:
+                    break
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            f.close()
+        return f, waited
 
     def unlock(self):
         """Release the lock on the working copy.
@@ -103,11 +230,26 @@ class WCLock(object):
         global _LOCK
         if not self.has_lock():
             raise RuntimeError('Attempting to release an unaquired lock.')
-        fcntl.lockf(self._fobj, fcntl.LOCK_UN)
-        self._fobj.close()
-        self._fobj = None
         lock = _storefile(self._path, _LOCK)
-        os.unlink(lock)
+        with _held_locks_cond:
+            self._fobj = None
+            held = _held_locks[os.path.realpath(lock)]
+            held[1] -= 1
+            if held[1] or held[3]:
+                # still held by another thread or a thread upgrades
+                # the lock (it becomes a holder afterwards)
+                return
+            del _held_locks[os.path.realpath(lock)]
+            # the lock file is only removed if no other process holds
+            # a (shared) lock
+            try:
+                fcntl.lockf(held[0], fcntl.LOCK_EX | fcntl.LOCK_NB)
+                os.unlink(lock)
+            except IOError as e:
+                if e.errno not in (errno.EACCES, errno.EAGAIN):
+                    raise
+            fcntl.lockf(held[0], fcntl.LOCK_UN)
+            held[0].close()
 
     def __enter__(self):
         self.lock()
@@ -119,6 +261,129 @@ class WCLock(object):
         return False
 
 
+# the active batches (see WCBatch)
+_batches = []
+_batches_lock = threading.Lock()
+
+
+class WCBatch(object):
+    """Coalesces the storefile writes of a working copy.
+
+    While a batch is active, the storefiles which are written via
+    _write_storefile are kept in memory (a storefile which is
+    written several times is only written once) and are read from
+    there. They are written when the batch is flushed.
+    A batch only covers the storefiles which reside directly in the
+    storedir (the files of a transaction, for instance, are written
+    immediately). In order to keep the working copy consistent
+    in case of a crash, the batch is flushed before a transaction
+    state is written or removed (see XMLTransactionState).
+    Each storefile is replaced atomically. If fsync is True, the
+    storefiles and the storedir are fsync'ed when the batch is
+    flushed.
+
+    """
+
+    def __init__(self, path, fsync=False):
+        """Constructs a new WCBatch object.
+
+        path is the path to the working copy.
+
+        Keyword arguments:
+        fsync -- fsync the written storefiles and the storedir
+                 (default: False)
+
+        """
+        super(WCBatch, self).__init__()
+        self._path = path
+        self._storedir = os.path.realpath(_storedir(path))
+        self.fsync = fsync
+        # storefile => data (in the order of the first write)
+        self._pending = {}
+        self._order = []
+        self._lock = threading.RLock()
+        self._wc_lock = WCLock(path)
+
+    def covers(self, filename):
+        """Return True if the storefile filename is covered."""
+        return os.path.dirname(filename) == self._storedir
+
+    def write(self, filename, data):
+        """Keep data as the new content of the storefile filename."""
+        with self._lock:
+            if filename not in self._pending:
+                self._order.append(filename)
+            self._pending[filename] = data
+
+    def read(self, filename):
+        """Return the pending data of filename (or None)."""
+        with self._lock:
+            return self._pending.get(filename)
+
+    def flush(self):
+        """Write all pending storefiles."""
+        with self._lock:
+            for filename in self._order:
+                _write_file(filename, self._pending[filename], self.fsync)
+            if self.fsync and self._order:
+                fd = os.open(self._storedir, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            self._pending = {}
+            self._order = []
+
+    def __enter__(self):
+        # the pending writes have to be protected until they are flushed
+        self._wc_lock.lock()
+        with _batches_lock:
+            _batches.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            # the pending writes belong to already performed changes
+            self.flush()
+        finally:
+            with _batches_lock:
+                _batches.remove(self)
+            self._wc_lock.unlock()
+        # don't suppress any exception
+        return False
+
+
+def _batch(filename):
+    """Return the innermost batch which covers filename.
+
+    A (batch, normalized filename) tuple is returned (the normalized
+    filename is used by the batch). If filename is not covered,
+    None is returned.
+
+    """
+    if not _batches:
+        return None
+    filename = os.path.join(os.path.realpath(os.path.dirname(filename)),
+                            os.path.basename(filename))
+    with _batches_lock:
+        for batch in reversed(_batches):
+            if batch.covers(filename):
+                return batch, filename
+    return None
+
+
+def _flush_batch(path):
+    """Flush the batches which cover the storefiles of path."""
+    global _LOCK
+    if not _batches:
+        return
+    filename = os.path.join(os.path.realpath(_storedir(path)), _LOCK)
+    with _batches_lock:
+        batches = [batch for batch in _batches if batch.covers(filename)]
+    for batch in batches:
+        batch.flush()
+
+
 class AbstractEntryTracker(object):
     """Keeps track of entries.
 
@@ -215,6 +480,22 @@ class XMLEntryTracker(AbstractEntryTracker):
         # XXX: validation
         self._xml = self._fromstring(xml_data)
         self._tag = entry_tag
+        # name => element index (built lazily, None means invalid)
+        self._index = None
+
+    def _entries(self):
+        """Return the name => element index.
+
+        The index has to be invalidated (set to None) if self._xml
+        is replaced.
+
+        """
+        if self._index is None:
+            self._index = {}
+            for elm in self._xml.iter(self._tag):
+                # like the xpath lookup: the first entry wins
+                self._index.setdefault(elm.get('name'), elm)
+        return self._index
 
     def add(self, name, state):
         if self.find(name) is not None:
@@ -222,17 +503,18 @@ class XMLEntryTracker(AbstractEntryTracker):
         elm = self._xml.makeelement(self._tag, name=name,
                                     state=state)
         self._xml.append(elm)
+        self._entries()[name] = elm
 
     def remove(self, name):
         elm = self.find(name)
         if elm is None:
             raise ValueError("entry \"%s\" does not exist" % name)
-        self._xml.remove(elm)
+        elm.getparent().remove(elm)
+        # names are unique (see add)
+        del self._entries()[name]
 
     def find(self, name):
-        xpb = XPathBuilder()
-        xp = xpb.descendant(self._tag)[xpb.attr('name') == name]
-        return self._xml.find(xp.tostring())
+        return self._entries().get(name)
 
     def set(self, name, new_state):
         entry = self.find(name)
@@ -283,7 +565,7 @@ class XMLPackageTracker(XMLEntryTracker):
                 self.set(package, st)
         for package in self._xml.findall(self._tag):
             name = package.get('name')
-            if name not in new_states.keys():
+            if name not in new_states:
                 self.remove(name)
         self.write()
 
@@ -302,6 +584,7 @@ class XMLFileTracker(XMLEntryTracker):
                 or set(filenames) != set(st_filenames)):
             raise ValueError("data of new_states and new_entries mismatch")
         self._xml = new_entries
+        self._index = None
         for filename, st in new_states.iteritems():
             if st == 'A':
                 # add files with state 'A' again
@@ -331,8 +614,710 @@ class XMLFileTracker(XMLEntryTracker):
         return '_files'
 
 
+# maximum number of database connections which are kept open
+WC_DB_CONNECTIONS = 16
+
+# (database filename, inode, device) => [connection, lock, evicted]
+_db_connections = {}
+# the keys of _db_connections in least recently used order
+_db_order = deque()
+_db_lock = threading.Lock()
+
+
+class WCDatabase(object):
+    """Provides access to the sqlite database of a working copy.
+
+    The database of a working copy in the sqlite format (see
+    wc_is_sqlite) contains the tracker entries, the stat cache and
+    the journal of a pending transaction.
+    All WCDatabase objects of a database share a single connection
+    (which can be used by several threads). The connection is opened
+    on demand. At most WC_DB_CONNECTIONS connections are kept open
+    (the least recently used connection is closed; it is reopened
+    if it is needed again).
+
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tracker (
+            tracker TEXT PRIMARY KEY,
+            root TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS entry (
+            tracker TEXT NOT NULL,
+            name TEXT NOT NULL,
+            pos INTEGER NOT NULL,
+            attrs TEXT NOT NULL,
+            PRIMARY KEY (tracker, name)
+        );
+        CREATE INDEX IF NOT EXISTS entry_pos ON entry (tracker, pos);
+        CREATE TABLE IF NOT EXISTS stat_cache (
+            filename TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime INTEGER NOT NULL,
+            ino INTEGER NOT NULL,
+            ctime INTEGER NOT NULL,
+            hashed_at INTEGER NOT NULL,
+            digest TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS journal (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            record TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path):
+        """Constructs a new WCDatabase object.
+
+        path is the path to the working copy. A ValueError is raised
+        if the working copy has no database.
+
+        """
+        global _DATABASE
+        super(WCDatabase, self).__init__()
+        filename = _storefile(path, _DATABASE)
+        try:
+            st = os.stat(filename)
+        except OSError:
+            st = None
+        if st is None or not stat.S_ISREG(st.st_mode):
+            raise ValueError("path \"%s\" has no database" % path)
+        # a recreated database has a new key
+        self._key = (os.path.realpath(filename), st.st_ino, st.st_dev)
+
+    def _acquire(self):
+        """Return the locked [connection, lock, evicted] entry."""
+        global WC_DB_CONNECTIONS
+        evicted = []
+        with _db_lock:
+            entry = _db_connections.get(self._key)
+            if entry is None:
+                entry = _db_connections[self._key] = [None, threading.RLock(),
+                                                      False]
+                while len(_db_order) >= WC_DB_CONNECTIONS:
+                    evicted.append(_db_connections.pop(_db_order.popleft()))
+            else:
+                _db_order.remove(self._key)
+            _db_order.append(self._key)
+        for old in evicted:
+            with old[1]:
+                old[2] = True
+                WCDatabase._close(old)
+        entry[1].acquire()
+        if entry[0] is None:
+            try:
+                entry[0] = sqlite3.connect(self._key[0], timeout=60,
+                                           check_same_thread=False)
+                entry[0].text_factory = str
+                entry[0].execute('PRAGMA synchronous = NORMAL')
+            except:
+                WCDatabase._release(entry)
+                raise
+        return entry
+
+    @staticmethod
+    def _release(entry):
+        """Unlock the entry (see _acquire)."""
+        try:
+            if entry[2]:
+                # the entry was evicted while it was used
+                WCDatabase._close(entry)
+        finally:
+            entry[1].release()
+
+    @staticmethod
+    def _close(entry):
+        if entry[0] is not None:
+            entry[0].close()
+            entry[0] = None
+
+    def query(self, sql, *args):
+        """Return the rows of the query sql (as a list)."""
+        entry = self._acquire()
+        try:
+            return entry[0].execute(sql, args).fetchall()
+        finally:
+            WCDatabase._release(entry)
+
+    def execute(self, *statements):
+        """Execute the statements in a single database transaction.
+
+        Each statement is a tuple (sql, args) or a tuple
+        (sql, args_list, True) (the latter executes sql for each args
+        in args_list).
+
+        """
+        entry = self._acquire()
+        try:
+            conn = entry[0]
+            with conn:
+                for statement in statements:
+                    if len(statement) > 2 and statement[2]:
+                        conn.executemany(statement[0], statement[1])
+                    else:
+                        conn.execute(statement[0], statement[1])
+        finally:
+            WCDatabase._release(entry)
+
+    def close(self):
+        """Close the database connection.
+
+        The connection is shared with the other WCDatabase objects
+        of the database (it is reopened on demand).
+
+        """
+        with _db_lock:
+            entry = _db_connections.pop(self._key, None)
+            if entry is None:
+                return
+            _db_order.remove(self._key)
+        with entry[1]:
+            entry[2] = True
+            WCDatabase._close(entry)
+
+    @staticmethod
+    def create(path):
+        """Create the database of the working copy path.
+
+        The data of an existing database is removed.
+
+        """
+        global _DATABASE
+        conn = sqlite3.connect(_storefile(path, _DATABASE))
+        try:
+            # the wal journal mode is persistent
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.executescript(WCDatabase.SCHEMA)
+            with conn:
+                for table in ('tracker', 'entry', 'stat_cache', 'journal'):
+                    conn.execute('DELETE FROM %s' % table)
+        finally:
+            conn.close()
+
+
+class SQLiteEntryTracker(AbstractEntryTracker):
+    """Can be used for trackers which are backed up by the database.
+
+    In contrast to a XMLEntryTracker the entries are not read
+    when the object is constructed: an entry is looked up via an
+    (indexed) query when it is needed and the write method only
+    writes the changed entries.
+    Concrete subclasses must implement the filename classmethod
+    (the filename is the name of the tracker in the database).
+
+    """
+
+    def __init__(self, path, entry_tag, xml_data=None):
+        """Create a new SQLiteEntryTracker object.
+
+        path is the path to the working copy.
+        A ValueError is raised if the tracker does not exist.
+
+        Keyword arguments:
+        xml_data -- if specified, the tracker's data is replaced with
+                    the xml str xml_data (the new data is written by
+                    the write method) (default: None)
+
+        """
+        super(SQLiteEntryTracker, self).__init__()
+        self._path = path
+        self._tag = entry_tag
+        self._db = WCDatabase(path)
+        # name => element (None means that the entry does not exist)
+        self._cache = {}
+        # name => position of the cached entries
+        self._pos = {}
+        # the names of the entries which have to be written
+        self._changed = set()
+        # if True, all entries have to be written (see _replace)
+        self._replaced = False
+        self._next_pos = None
+        if xml_data is not None:
+            self._replace(self._fromstring(xml_data))
+            return
+        rows = self._db.query('SELECT root FROM tracker WHERE tracker = ?',
+                              self.filename())
+        if not rows:
+            raise ValueError("%s tracker does not exist" % self.filename())
+        self._root = self._fromstring(rows[0][0])
+
+    def _element(self, name, pos, attrs):
+        """Create, cache and return the element for entry name."""
+        elm = self._root.makeelement(self._tag)
+        for key, value in json.loads(attrs):
+            elm.set(key, value)
+        # the root is the parent (like in a XMLEntryTracker)
+        self._root.append(elm)
+        self._cache[name] = elm
+        self._pos[name] = pos
+        return elm
+
+    def _new_pos(self):
+        if self._next_pos is None:
+            rows = self._db.query('SELECT MAX(pos) FROM entry '
+                                  'WHERE tracker = ?', self.filename())
+            self._next_pos = 0
+            if rows[0][0] is not None:
+                self._next_pos = rows[0][0] + 1
+            if self._pos:
+                self._next_pos = max(self._next_pos,
+                                     max(self._pos.values()) + 1)
+        pos = self._next_pos
+        self._next_pos += 1
+        return pos
+
+    def _replace(self, root):
+        """Replace the root and all entries with root's entries."""
+        self._root = root
+        self._cache = {}
+        self._pos = {}
+        for elm in self._root.iterchildren(self._tag):
+            name = elm.get('name')
+            if name in self._cache:
+                # like the xpath lookup: the first entry wins
+                continue
+            self._cache[name] = elm
+            self._pos[name] = len(self._pos)
+        self._next_pos = len(self._pos)
+        self._changed = set(self._cache.keys())
+        self._replaced = True
+
+    def add(self, name, state):
+        if self.find(name) is not None:
+            raise ValueError("entry \"%s\" already exists" % name)
+        attrs = json.dumps([('name', name), ('state', state)])
+        self._element(name, self._new_pos(), attrs)
+        self._changed.add(name)
+
+    def remove(self, name):
+        elm = self.find(name)
+        if elm is None:
+            raise ValueError("entry \"%s\" does not exist" % name)
+        elm.getparent().remove(elm)
+        self._cache[name] = None
+        self._changed.add(name)
+
+    def find(self, name):
+        if name in self._cache:
+            return self._cache[name]
+        elif self._replaced:
+            return None
+        rows = self._db.query('SELECT pos, attrs FROM entry '
+                              'WHERE tracker = ? AND name = ?',
+                              self.filename(), name)
+        if not rows:
+            self._cache[name] = None
+            return None
+        return self._element(name, rows[0][0], rows[0][1])
+
+    def set(self, name, new_state):
+        entry = self.find(name)
+        if entry is None:
+            raise ValueError("entry \"%s\" does not exist" % name)
+        entry.set('state', new_state)
+        self._changed.add(name)
+
+    def _root_data(self):
+        """Return the xml str of the root (without the entries)."""
+        entries = list(self._root.iterchildren(self._tag))
+        for elm in entries:
+            self._root.remove(elm)
+        try:
+            return etree.tostring(self._root)
+        finally:
+            self._root.extend(entries)
+
+    def write(self):
+        tracker = self.filename()
+        statements = []
+        if self._replaced:
+            statements.append(('INSERT OR REPLACE INTO tracker (tracker, '
+                               'root) VALUES (?, ?)',
+                               (tracker, self._root_data())))
+            statements.append(('DELETE FROM entry WHERE tracker = ?',
+                               (tracker, )))
+        deleted = []
+        rows = []
+        for name in self._changed:
+            elm = self._cache[name]
+            if elm is None:
+                deleted.append((tracker, name))
+            else:
+                attrs = json.dumps(elm.attrib.items())
+                rows.append((tracker, name, self._pos[name], attrs))
+        statements.append(('DELETE FROM entry WHERE tracker = ? AND '
+                           'name = ?', deleted, True))
+        statements.append(('INSERT OR REPLACE INTO entry (tracker, name, '
+                           'pos, attrs) VALUES (?, ?, ?, ?)', rows, True))
+        self._db.execute(*statements)
+        self._changed = set()
+        self._replaced = False
+
+    def __iter__(self):
+        if not self._replaced:
+            rows = self._db.query('SELECT name, pos, attrs FROM entry '
+                                  'WHERE tracker = ? ORDER BY pos',
+                                  self.filename())
+            for name, pos, attrs in rows:
+                if name not in self._cache:
+                    self._element(name, pos, attrs)
+        entries = [(self._pos[name], elm)
+                   for name, elm in self._cache.iteritems()
+                   if elm is not None]
+        entries.sort(key=lambda e: e[0])
+        return iter([elm for pos, elm in entries])
+
+    def xml_data(self):
+        """Return the xml str of the tracker (including all entries)."""
+        root = self._fromstring(self._root_data())
+        for elm in self:
+            root.append(copy.deepcopy(elm))
+        return etree.tostring(root, pretty_print=True)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._root, name)
+
+    @classmethod
+    def filename(cls):
+        raise NotImplementedError()
+
+    @classmethod
+    def _fromstring(cls, data):
+        return fromstring(data)
+
+    @classmethod
+    def check(cls, path):
+        try:
+            rows = WCDatabase(path).query('SELECT root FROM tracker WHERE '
+                                          'tracker = ?', cls.filename())
+            if not rows:
+                return False
+            objectify.fromstring(rows[0][0])
+        except (ValueError, sqlite3.Error, etree.XMLSyntaxError):
+            return False
+        return True
+
+
+class SQLitePackageTracker(SQLiteEntryTracker):
+    """Represents the packages of a project wc in the sqlite format."""
+
+    def __init__(self, path, xml_data=None):
+        super(SQLitePackageTracker, self).__init__(path, 'package',
+                                                   xml_data)
+
+    @classmethod
+    def filename(cls):
+        return '_packages'
+
+    def merge(self, new_states):
+        for package, st in new_states.iteritems():
+            if self.find(package) is None:
+                self.add(package, st)
+            else:
+                self.set(package, st)
+        for package in list(self):
+            name = package.get('name')
+            if name not in new_states:
+                self.remove(name)
+        self.write()
+
+
+class SQLiteFileTracker(SQLiteEntryTracker):
+    """Represents the files of a package wc in the sqlite format."""
+
+    def __init__(self, path, xml_data=None):
+        super(SQLiteFileTracker, self).__init__(path, 'entry', xml_data)
+
+    def merge(self, new_states, new_entries):
+        filenames = [entry.get('name') for entry in new_entries]
+        # ignore locally added files
+        st_filenames = [f for f, st in new_states.iteritems() if st != 'A']
+        if (len(filenames) != len(st_filenames)
+                or set(filenames) != set(st_filenames)):
+            raise ValueError("data of new_states and new_entries mismatch")
+        self._replace(new_entries)
+        for filename, st in new_states.iteritems():
+            if st == 'A':
+                # add files with state 'A' again
+                self.add(filename, st)
+            else:
+                self.set(filename, st)
+        self.write()
+
+    def revision_data(self):
+        """Return a dict which contains the revision data."""
+        return {'rev': self._root.get('rev'),
+                'srcmd5': self._root.get('srcmd5')}
+
+    def is_link(self):
+        """Return True if package is a link."""
+        return self._root.find('linkinfo') is not None
+
+    @classmethod
+    def _fromstring(cls, data):
+        return fromstring(data, entry=File, directory=Directory,
+                          linkinfo=Linkinfo)
+
+    @classmethod
+    def filename(cls):
+        return '_files'
+
+
+def _stat_key(st):
+    """Return a (size, mtime_ns, inode, ctime_ns) tuple for st."""
+    return (st.st_size, int(st.st_mtime * 1000000000), st.st_ino,
+            int(st.st_ctime * 1000000000))
+
+
+class WCStatCache(object):
+    """Caches the digests of the working copy files.
+
+    A digest is only recomputed if the file's stat data (size, mtime,
+    inode and ctime) changed. Since the timestamps might have a coarse
+    granularity, an entry is considered as "racy" (and the digest is
+    recomputed) if the file was modified in the same second in which
+    the digest was computed (or later). That is, the cache never
+    returns a stale digest for a file which was modified right after
+    it was hashed (similar to git's index).
+
+    The cache is stored in the storedir. New entries are appended to
+    the cache file (the file is compacted when it is loaded and
+    contains too many outdated entries). A corrupt cache file is
+    ignored.
+    Digests which were computed by the object itself are trusted
+    without the racy check as long as the stat data does not change
+    and the filesystem provides subsecond timestamps.
+    If the dirty attribute is set to a DirtySet (see osc2.wc.watch),
+    a digest is trusted without even a stat call if the file did
+    not change since the digest was computed.
+    If the working copy is in the sqlite format, the cache is stored
+    in the database: an entry is only read when it is needed.
+
+    """
+
+    def __init__(self, path, digest_func):
+        """Constructs a new WCStatCache object.
+
+        path is the path to the working copy and digest_func is
+        a function which computes the digest of a file (it is
+        called with the filename).
+
+        """
+        super(WCStatCache, self).__init__()
+        self._path = path
+        self._digest_func = digest_func
+        self._entries = None
+        self.dirty = None
+        self._db = None
+        if wc_is_sqlite(path):
+            self._db = WCDatabase(path)
+
+    def _load(self):
+        """Read the cache file."""
+        global _STAT_CACHE
+        self._entries = {}
+        if self._db is not None:
+            # the entries are read on demand (see _entry)
+            return
+        lines = 0
+        corrupt = False
+        try:
+            with open(_storefile(self._path, _STAT_CACHE), 'r') as f:
+                for line in f:
+                    lines += 1
+                    data = line.rstrip('\n').split(' ', 6)
+                    try:
+                        if len(data) != 7 or not line.endswith('\n'):
+                            raise ValueError()
+                        key = tuple([int(i) for i in data[1:5]])
+                        hashed_at = int(data[5])
+                    except ValueError:
+                        # ignore corrupt or incomplete entries
+                        corrupt = True
+                        continue
+                    self._entries[data[6]] = (key, hashed_at, data[0])
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        # an incomplete last line would corrupt the next appended entry
+        if corrupt or lines > 2 * len(self._entries) + 64:
+            self.write()
+
+    def _line(self, filename, key, hashed_at, digest):
+        data = (digest, ) + key + (hashed_at, filename)
+        return '%s %d %d %d %d %d %s\n' % data
+
+    def _entry(self, filename):
+        """Return the (key, hashed_at, digest) tuple or None."""
+        if self._entries is None:
+            self._load()
+        if self._db is None or filename in self._entries:
+            return self._entries.get(filename)
+        rows = self._db.query('SELECT size, mtime, ino, ctime, hashed_at, '
+                              'digest FROM stat_cache WHERE filename = ?',
+                              filename)
+        entry = None
+        if rows:
+            entry = (tuple(rows[0][:4]), rows[0][4], rows[0][5])
+        self._entries[filename] = entry
+        return entry
+
+    def items(self):
+        """Return the list of cached entries.
+
+        Each entry is a (filename, key, hashed_at, digest) tuple.
+
+        """
+        if self._db is not None:
+            rows = self._db.query('SELECT filename, size, mtime, ino, '
+                                  'ctime, hashed_at, digest FROM stat_cache')
+            return [(row[0], tuple(row[1:5]), row[5], row[6])
+                    for row in rows]
+        if self._entries is None:
+            self._load()
+        return [(filename, ) + entry
+                for filename, entry in self._entries.iteritems()
+                if entry is not None]
+
+    def store(self, entries):
+        """Store the entries.
+
+        entries is a list of (filename, key, hashed_at, digest)
+        tuples (see items).
+
+        """
+        global _STAT_CACHE
+        if self._db is not None:
+            rows = [(filename, ) + key + (hashed_at, digest)
+                    for filename, key, hashed_at, digest in entries]
+            self._db.execute(('INSERT OR REPLACE INTO stat_cache (filename, '
+                              'size, mtime, ino, ctime, hashed_at, digest) '
+                              'VALUES (?, ?, ?, ?, ?, ?, ?)', rows, True))
+            return
+        lines = [self._line(*entry) for entry in entries
+                 if '\n' not in entry[0]]
+        if lines and _has_storedir(self._path):
+            with open(_storefile(self._path, _STAT_CACHE), 'a') as f:
+                f.write(''.join(lines))
+
+    def _lookup(self, filename, key):
+        """Return the cached digest or None."""
+        entry = self._entry(filename)
+        if entry is None or entry[0] != key:
+            return None
+        # an entry is racy if the file was modified (or its mtime
+        # was changed) in the same second (or later) the digest
+        # was computed
+        changed = max(key[1], key[3]) // 1000000000
+        if changed < entry[1] // 1000000000:
+            return entry[2]
+        return None
+
+    def _compute(self, filename):
+        """Return a (key, hashed_at, digest) tuple for filename."""
+        fname = os.path.join(self._path, filename)
+        hashed_at = int(time.time() * 1000000000)
+        digest = self._digest_func(fname)
+        # the file might have been modified in the meantime (in this
+        # case the entry is racy)
+        key = _stat_key(os.stat(fname))
+        return key, hashed_at, digest
+
+    def unchanged_digest(self, filename):
+        """Return the digest of filename if it is known to be unchanged.
+
+        The digest is only returned if the dirty attribute is set and
+        the file did not change since its digest was computed (in
+        this case, the file also still exists). Otherwise None is
+        returned. No stat call is made.
+
+        """
+        if self.dirty is None:
+            return None
+        entry = self._entry(filename)
+        if entry is None or self.dirty.is_dirty(filename, entry[1]):
+            return None
+        return entry[2]
+
+    def digest(self, filename):
+        """Return the digest of the working copy file filename.
+
+        filename is relative to the working copy. The digest
+        function is only invoked if there is no valid cache entry.
+
+        """
+        return self.digests([filename])[filename]
+
+    def digests(self, filenames, jobs=1):
+        """Return a dict which maps each filename to its digest.
+
+        Like digest but the missing digests are computed concurrently.
+
+        Keyword arguments:
+        jobs -- the number of worker threads (None means the number
+                of cpus) (default: 1)
+
+        """
+        if self._entries is None:
+            self._load()
+        digests = {}
+        missing = []
+        for filename in filenames:
+            digest = self.unchanged_digest(filename)
+            if digest is not None:
+                digests[filename] = digest
+                continue
+            key = _stat_key(os.stat(os.path.join(self._path, filename)))
+            digest = self._lookup(filename, key)
+            if digest is None:
+                missing.append(filename)
+            else:
+                digests[filename] = digest
+        entries = []
+        results = parallel_map(self._compute, missing, jobs)
+        for filename, (key, hashed_at, digest) in zip(missing, results):
+            self._entries[filename] = (key, hashed_at, digest)
+            digests[filename] = digest
+            entries.append((filename, key, hashed_at, digest))
+        if entries:
+            self.store(entries)
+        return digests
+
+    def write(self):
+        """Write the compacted cache file."""
+        global _STAT_CACHE
+        if self._entries is None or self._db is not None:
+            # there is nothing to compact in the database
+            return
+        lines = []
+        for filename, (key, hashed_at, digest) in self._entries.iteritems():
+            if '\n' not in filename:
+                lines.append(self._line(filename, key, hashed_at, digest))
+        _write_storefile(self._path, _STAT_CACHE, ''.join(lines).rstrip())
+
+
 class XMLTransactionState(AbstractTransactionState):
-    """Represents the state of a transaction"""
+    """Represents the state of a transaction
+
+    The state is stored in a xml document. In order to avoid a rewrite
+    of the complete document, the frequent changes (processed entries
+    and state changes) are appended to a journal. The journal is
+    replayed when the state is read and it is compacted (that is, its
+    records are merged into the xml document) if it gets too large or
+    if the document's structure changes.
+    If the working copy is in the sqlite format, the journal is stored
+    in the database (each record is appended in its own database
+    transaction).
+
+    """
+
+    JOURNAL = os.path.join(AbstractTransactionState.DIR, 'journal')
+    # the journal is fsync'ed after this number of records
+    JOURNAL_FSYNC_RECORDS = 64
+    # the journal is compacted after this number of records
+    JOURNAL_COMPACT_RECORDS = 1024
 
     def __init__(self, path, name, initial_state, info=None,
                  xml_data=None, **states):
@@ -352,12 +1337,20 @@ class XMLTransactionState(AbstractTransactionState):
                 or (info is None and xml_data is None)):
             raise ValueError('either specify info or xml_data')
         super(XMLTransactionState, self).__init__(path)
+        self._db = None
+        if wc_is_sqlite(path):
+            self._db = WCDatabase(path)
         trans_dir = _storefile(self._path, XMLTransactionState.DIR)
         data_dir = os.path.join(trans_dir, _PKG_DATA)
         self._location = data_dir
+        self._records = 0
+        # entry => element indices for the info lists and the states
+        self._info_index = None
+        self._state_index = None
         if xml_data:
             self._xml = fromstring(xml_data, entry=File, directory=Directory,
                                    linkinfo=Linkinfo)
+            self._replay()
         else:
             self.cleanup()
             os.mkdir(trans_dir)
@@ -378,6 +1371,8 @@ class XMLTransactionState(AbstractTransactionState):
         for entry, st in states.iteritems():
             elm = states_elm.makeelement('state', entry=entry, name=st)
             states_elm.append(elm)
+            if self._state_index is not None:
+                self._state_index[entry] = elm
 
     def _add_list(self, listname, info):
         info_elm = self._xml.find('info')
@@ -390,29 +1385,123 @@ class XMLTransactionState(AbstractTransactionState):
             getattr(child, 'file').__setitem__(-1, data)
 
     def _write(self):
+        """Write the xml document and remove the journal."""
         objectify.deannotate(self._xml)
         etree.cleanup_namespaces(self._xml)
         xml_data = etree.tostring(self._xml, pretty_print=True)
+        # the state might depend on the pending storefile writes
+        _flush_batch(self._path)
         _write_storefile(self._path, XMLTransactionState.FILENAME, xml_data)
+        # the journal's records are part of the document now (if we
+        # crash before the journal is removed, the replay is a no-op)
+        self._clear_journal()
+        self._records = 0
+        self._info_index = None
+        self._state_index = None
 
-    def processed(self, entry, new_state=None):
+    def _append(self, *record):
+        """Append record to the journal.
+
+        If the xml document does not exist anymore (for instance,
+        because the transaction was rolled back in the meantime),
+        the complete document is written instead.
+
+        """
+        filename = _storefile(self._path, XMLTransactionState.FILENAME)
+        if not os.path.exists(filename):
+            self._write()
+            return
+        if self._db is not None:
+            self._db.execute(('INSERT INTO journal (record) VALUES (?)',
+                              (json.dumps(record), )))
+            self._records += 1
+        else:
+            journal = _storefile(self._path, XMLTransactionState.JOURNAL)
+            with open(journal, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+                f.flush()
+                self._records += 1
+                if self._records % self.JOURNAL_FSYNC_RECORDS == 0:
+                    os.fsync(f.fileno())
+        if self._records >= self.JOURNAL_COMPACT_RECORDS:
+            self._write()
+
+    def _journal_records(self):
+        """Return the list of the journal's records."""
+        if self._db is not None:
+            rows = self._db.query('SELECT record FROM journal ORDER BY id')
+            return [json.loads(row[0]) for row in rows]
+        journal = _storefile(self._path, XMLTransactionState.JOURNAL)
+        if not os.path.exists(journal):
+            return []
+        records = []
+        with open(journal, 'r') as f:
+            for line in f:
+                try:
+                    if not line.endswith('\n'):
+                        raise ValueError()
+                    records.append(json.loads(line))
+                except ValueError:
+                    # incomplete record (crash during the append)
+                    break
+        return records
+
+    def _clear_journal(self):
+        """Remove all records from the journal."""
+        if self._db is not None:
+            self._db.execute(('DELETE FROM journal', ()))
+            return
+        journal = _storefile(self._path, XMLTransactionState.JOURNAL)
+        if os.path.exists(journal):
+            os.unlink(journal)
+
+    def _replay(self):
+        """Apply the journal's records to the xml document."""
+        for record in self._journal_records():
+            if record[0] == 'state':
+                self._xml.set('state', record[1])
+            elif record[0] == 'processed':
+                self._processed(record[1], record[2], replay=True)
+            self._records += 1
+
+    def _indices(self):
+        """Return the (info index, state index) tuple."""
+        if self._info_index is None:
+            self._info_index = {}
+            for list_elm in self._xml.find('info').iterchildren():
+                for elm in list_elm.iterchildren():
+                    self._info_index.setdefault(elm.text, elm)
+        if self._state_index is None:
+            self._state_index = {}
+            for elm in self._xml.find('states').iterchildren():
+                self._state_index.setdefault(elm.get('entry'), elm)
+        return self._info_index, self._state_index
+
+    def _processed(self, entry, new_state, replay=False):
+        info_index, state_index = self._indices()
         # remove file from info
-        info_elm = self._xml.find('info')
-        elm = info_elm.find("//*[text() = '%s']" % entry)
+        elm = info_index.pop(entry, None)
         if elm is None:
+            if replay:
+                # already part of the xml document
+                return
             raise ValueError("file \"%s\" is not known" % entry)
         elm.getparent().remove(elm)
         # update states
-        elm = self._xml.find("//state[@entry = '%s']" % entry)
+        elm = state_index.get(entry)
         if elm is None:
             self._add_states({entry: new_state})
-            elm = self._xml.find("//state[@entry = '%s']" % entry)
+            elm = state_index[entry]
         if new_state is None:
             # remove node
             elm.getparent().remove(elm)
+            del state_index[entry]
         else:
             elm.set('name', new_state)
-        self._write()
+
+    def processed(self, entry, new_state=None):
+        self._processed(entry, new_state)
+        self._append('processed', entry, new_state)
 
     @property
     def location(self):
@@ -428,8 +1517,10 @@ class XMLTransactionState(AbstractTransactionState):
 
     @state.setter
     def state(self, new_state):
+        if new_state == self.state:
+            return
         self._xml.set('state', new_state)
-        self._write()
+        self._append('state', new_state)
 
     @property
     def entrystates(self):
@@ -467,9 +1558,13 @@ class XMLTransactionState(AbstractTransactionState):
 
     def cleanup(self):
         """Remove _transaction dir"""
+        # the pending storefile writes complete the transaction
+        _flush_batch(self._path)
         path = _storefile(self._path, XMLTransactionState.DIR)
         if os.path.exists(path):
             shutil.rmtree(path)
+        if self._db is not None:
+            self._clear_journal()
 
     @classmethod
     def read_state(cls, path):
@@ -528,13 +1623,24 @@ def missing_storepaths(path, *paths, **kwargs):
     storedir = _storedir(path)
     if data:
         storedir = _storefile(path, _PKG_DATA)
+    trackers = {}
+    if not data and not dirs and wc_is_sqlite(path):
+        # the trackers are stored in the database
+        trackers = {'_files': SQLiteFileTracker,
+                    '_packages': SQLitePackageTracker}
     missing = []
     for p in paths:
         storepath = os.path.join(storedir, p)
-        if dirs:
+        if p in trackers:
+            if not trackers[p].check(path):
+                missing.append(p)
+        elif dirs:
             if not os.path.isdir(storepath):
                 missing.append(p)
         else:
+            found = _batch(storepath)
+            if found is not None and found[0].read(found[1]) is not None:
+                continue
             if not os.path.isfile(storepath):
                 missing.append(p)
     return missing
@@ -559,9 +1665,15 @@ def _read_storefile(path, filename):
 def _read_file(filename):
     """Reads the file specified via filename.
 
-    The returned data is stripped.
+    The returned data is stripped. If the file is covered by a batch,
+    its pending data is returned (see WCBatch).
 
     """
+    found = _batch(filename)
+    if found is not None:
+        data = found[0].read(found[1])
+        if data is not None:
+            return data.strip()
     with open(filename, 'r') as f:
         return f.read().strip()
 
@@ -579,19 +1691,36 @@ def _write_storefile(path, filename, data):
     if not _has_storedir(path):
         raise ValueError("path \"%s\" has no storedir" % path)
     fname = _storefile(path, filename)
+    if data:
+        data += '\n'
+    found = _batch(fname)
+    if found is not None:
+        found[0].write(found[1], data)
+        return
+    _write_file(fname, data)
+
+
+def _write_file(filename, data, fsync=False):
+    """Atomically replace filename's content with data.
+
+    Keyword arguments:
+    fsync -- fsync the file before it is renamed (default: False)
+
+    """
     tmpfile = None
     try:
-        tmpfile = mkstemp(dir=_storedir(path), delete=False)
+        tmpfile = mkstemp(dir=os.path.dirname(filename), delete=False)
         tmpfile.write(data)
-        if data:
-            tmpfile.write('\n')
+        if fsync:
+            tmpfile.flush()
+            os.fsync(tmpfile.fileno())
     finally:
         if tmpfile is not None:
             tmpfile.close()
-            os.rename(tmpfile, fname)
+            os.rename(tmpfile, filename)
 
 
-def wc_lock(path):
+def wc_lock(path, shared=False):
     """Return a WCLock object.
 
     path is the path to the working copy.
@@ -601,8 +1730,45 @@ def wc_lock(path):
     with wc_lock(path) as lock:
         ...
 
+    Keyword arguments:
+    shared -- return a shared lock (for read-only operations)
+              (default: False)
+
+    """
+    return WCLock(path, shared)
+
+
+def wc_batch(path, fsync=False):
+    """Return a WCBatch object.
+
+    path is the path to the working copy. While the batch is
+    active, the working copy is (exclusively) locked:
+
+    with wc_batch(path):
+        ...
+
+    Keyword arguments:
+    fsync -- fsync the storefiles and the storedir when the batch
+             is flushed (default: False)
+
+    """
+    return WCBatch(path, fsync)
+
+
+def wc_is_sqlite(path):
+    """Test if the working copy path is in the sqlite format.
+
+    path is the path to the working copy. In this format, the
+    tracker entries, the stat cache and the transaction journal
+    are stored in a sqlite database (see WCDatabase).
+
     """
-    return WCLock(path)
+    global _SQLITE_VERSION
+    try:
+        version_fmt = float(_read_file(_storefile(path, '_version')))
+    except (IOError, ValueError):
+        return False
+    return version_fmt >= _SQLITE_VERSION
 
 
 def wc_is_project(path):
@@ -645,6 +1811,11 @@ def wc_read_packages(path, raw=False):
            instead of an object (default: False)
 
     """
+    if wc_is_sqlite(path):
+        tracker = SQLitePackageTracker(path)
+        if raw:
+            return tracker.xml_data()
+        return tracker
     if raw:
         return _read_storefile(path, XMLPackageTracker.filename())
     return XMLPackageTracker(path)
@@ -685,11 +1856,29 @@ def wc_read_files(path, raw=False):
            instead of an object (default: False)
 
     """
+    if wc_is_sqlite(path):
+        tracker = SQLiteFileTracker(path)
+        if raw:
+            return tracker.xml_data()
+        return tracker
     if raw:
         return _read_storefile(path, '_files')
     return XMLFileTracker(path)
 
 
+def wc_read_sparse(path):
+    """Return the list of sparse checkout patterns.
+
+    path is the path to the package working copy. If no
+    patterns are stored, an empty list is returned.
+
+    """
+    if missing_storepaths(path, '_sparse'):
+        return []
+    data = _read_storefile(path, '_sparse')
+    return [pattern for pattern in data.splitlines() if pattern]
+
+
 def wc_write_apiurl(path, apiurl):
     """Write the _apiurl file.
 
@@ -726,6 +1915,9 @@ def wc_write_packages(path, xml_data):
     path is the path to the project working copy.
 
     """
+    if wc_is_sqlite(path):
+        SQLitePackageTracker(path, xml_data).write()
+        return
     _write_storefile(path, '_packages', xml_data)
 
 
@@ -736,20 +1928,41 @@ def wc_write_files(path, xml_data):
     xml_data is the xml str.
 
     """
+    if wc_is_sqlite(path):
+        SQLiteFileTracker(path, xml_data).write()
+        return
     _write_storefile(path, '_files', xml_data)
 
 
+def wc_write_sparse(path, patterns):
+    """Write the _sparse file.
+
+    path is the path to the package working copy and patterns
+    is a list of fnmatch style patterns. A ValueError is raised
+    if a pattern contains a newline.
+
+    """
+    if [p for p in patterns if '\n' in p]:
+        raise ValueError("a pattern must not contain a newline")
+    _write_storefile(path, '_sparse', '\n'.join(patterns))
+
+
 def wc_write_version(path):
     """Write the working copy's format version.
 
     path is the path to the package working copy.
+    If the working copy has a database, the version of
+    the sqlite format is written.
 
     """
-    global _VERSION
-    _write_storefile(path, '_version', str(_VERSION))
+    global _VERSION, _SQLITE_VERSION, _DATABASE
+    version = _VERSION
+    if os.path.isfile(_storefile(path, _DATABASE)):
+        version = _SQLITE_VERSION
+    _write_storefile(path, '_version', str(version))
 
 
-def wc_init(path, ext_storedir=None):
+def wc_init(path, ext_storedir=None, sqlite=False):
     """Initialize path as a working copy.
 
     path is the path to the new working copy. If path
@@ -764,6 +1977,8 @@ def wc_init(path, ext_storedir=None):
     ext_storedir -- path to an external storedir (default: None).
                     If specified the path/.osc dir is a symlink to
                     ext_storedir.
+    sqlite -- create a working copy in the sqlite format (see
+              wc_is_sqlite) (default: False)
 
     """
     global _PKG_DATA
@@ -803,6 +2018,8 @@ def wc_init(path, ext_storedir=None):
     else:
         os.mkdir(storedir)
     if write_version:
+        if sqlite:
+            WCDatabase.create(path)
         wc_write_version(path)
     data_path = _storefile(path, _PKG_DATA)
     if not os.path.isdir(data_path):
@@ -855,9 +2072,102 @@ def wc_diff_mkdir(path, revision):
     diff_path = os.path.join(_storefile(path, _DIFF_DATA), revision)
     if not os.path.exists(diff_path):
         os.makedirs(diff_path)
+    elif revision:
+        # mark it as recently used (see wc_diff_prune)
+        os.utime(diff_path, None)
     return diff_path
 
 
+def wc_diff_revisions(path):
+    """Return the revisions whose diff dirs exist.
+
+    The revisions are sorted by their last usage (the least
+    recently used revision comes first).
+
+    """
+    global _DIFF_DATA
+    diff_root = _storefile(path, _DIFF_DATA)
+    if not os.path.isdir(diff_root):
+        return []
+    revisions = []
+    for revision in os.listdir(diff_root):
+        mtime = os.path.getmtime(os.path.join(diff_root, revision))
+        revisions.append((mtime, revision))
+    return [revision for mtime, revision in sorted(revisions)]
+
+
+def wc_diff_prune(path, max_size=0):
+    """Remove the least recently used diff dirs.
+
+    Diff dirs are removed until the total size of the remaining
+    ones is at most max_size bytes (if max_size is 0, all diff dirs
+    are removed). If no diff dir is left, the diff root dir is removed
+    as well. The list of the removed revisions is returned.
+
+    """
+    global _DIFF_DATA
+    diff_root = _storefile(path, _DIFF_DATA)
+    revisions = wc_diff_revisions(path)
+    sizes = {}
+    for revision in revisions:
+        diff_path = os.path.join(diff_root, revision)
+        sizes[revision] = sum([os.path.getsize(os.path.join(diff_path, f))
+                               for f in os.listdir(diff_path)])
+    total = sum(sizes.values())
+    removed = []
+    for revision in revisions:
+        if max_size and total <= max_size:
+            break
+        diff_path = os.path.join(diff_root, revision)
+        # shutil.rmtree is too "dangerous"
+        for filename in os.listdir(diff_path):
+            os.unlink(os.path.join(diff_path, filename))
+        os.rmdir(diff_path)
+        total -= sizes[revision]
+        removed.append(revision)
+    if removed and len(removed) == len(revisions):
+        os.rmdir(diff_root)
+    return removed
+
+
+def wc_partial_mkdir(path):
+    """Return the path to the partial dir.
+
+    The partial dir contains the files which were downloaded by
+    an interrupted update (they can be reused when the update is
+    restarted). If the directory does not exist it will be created.
+
+    """
+    global _PARTIAL_DATA
+    partial_path = _storefile(path, _PARTIAL_DATA)
+    if not os.path.exists(partial_path):
+        os.mkdir(partial_path)
+    return partial_path
+
+
+def wc_partial_filename(path, filename):
+    """Return the filename to the partial dir's filename.
+
+    path is the path to the working copy. filename is the
+    name of the file.
+
+    """
+    global _PARTIAL_DATA
+    return os.path.join(_storefile(path, _PARTIAL_DATA), filename)
+
+
+def wc_partial_remove(path):
+    """Remove the partial dir (if it exists)."""
+    global _PARTIAL_DATA
+    partial_path = _storefile(path, _PARTIAL_DATA)
+    if not os.path.isdir(partial_path):
+        return
+    # shutil.rmtree is too "dangerous"
+    for filename in os.listdir(partial_path):
+        os.unlink(os.path.join(partial_path, filename))
+    os.rmdir(partial_path)
+
+
 def wc_verify_format(path):
     """Check if the working copy format.
 
@@ -877,7 +2187,7 @@ def _wc_verify_format(storedir):
     invalid/unsupported wc version format.
 
     """
-    global _VERSION
+    global _VERSION, _SQLITE_VERSION
     filename = os.path.join(storedir, '_version')
     try:
         version_fmt = _read_file(filename)
@@ -888,8 +2198,10 @@ def _wc_verify_format(storedir):
         raise WCFormatVersionError(None)
     except ValueError as e:
         raise WCFormatVersionError(version_fmt)
-    if version_fmt - _VERSION >= 1 or version_fmt - _VERSION <= -1:
-        raise WCFormatVersionError(version_fmt)
+    for version in (_VERSION, _SQLITE_VERSION):
+        if abs(version_fmt - version) < 1:
+            return
+    raise WCFormatVersionError(version_fmt)
 
 
 def wc_parent(path):
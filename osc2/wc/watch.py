@@ -0,0 +1,412 @@
+"""Provides an inotify based working copy watcher (linux only).
+
+The watcher records the changes below a project or package working
+copy in a journal (the so called dirty set) which is stored in the
+working copy's storedir. A status computation consults the journal
+(see dirty_set) so that only the files which changed since their
+md5sums were computed have to be examined again.
+
+"""
+
+import os
+import time
+import errno
+import struct
+import select
+import ctypes
+import threading
+
+from osc2.util.io import _libc_func
+from osc2.wc.util import (wc_is_project, wc_parent, _storefile,
+                          _has_storedir, _STORE)
+
+__all__ = ['WCWatcher', 'DirtySet', 'dirty_set']
+
+_JOURNAL = '_dirty'
+_COOKIE_PREFIX = '_dirty_cookie.'
+
+# see inotify(7)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 02000000
+
+
+def _now():
+    """Return the current time in nanoseconds."""
+    return int(time.time() * 1000000000)
+
+
+class Inotify(object):
+    """A minimal inotify binding (based on ctypes).
+
+    An OSError is raised if inotify is not available.
+
+    """
+    _EVENT = struct.Struct('iIII')
+
+    def __init__(self):
+        """Constructs a new Inotify object."""
+        super(Inotify, self).__init__()
+        self._init = _libc_func('inotify_init1', ctypes.c_int,
+                                (ctypes.c_int, ))
+        self._add_watch = _libc_func('inotify_add_watch', ctypes.c_int,
+                                     (ctypes.c_int, ctypes.c_char_p,
+                                      ctypes.c_uint32))
+        if self._init is None or self._add_watch is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.fd = self._init(IN_CLOEXEC)
+        if self.fd < 0:
+            self._raise()
+
+    def _raise(self):
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path, mask):
+        """Watch path and return the watch descriptor."""
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+        wd = self._add_watch(self.fd, path, mask)
+        if wd < 0:
+            self._raise()
+        return wd
+
+    def read(self, timeout=None):
+        """Return a list of (wd, mask, name) tuples.
+
+        If no event occurs within timeout seconds, an empty
+        list is returned.
+
+        """
+        try:
+            readable = select.select([self.fd], [], [], timeout)[0]
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return []
+        if not readable:
+            return []
+        data = os.read(self.fd, 65536)
+        events = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, length = self._EVENT.unpack_from(data, pos)
+            pos += self._EVENT.size
+            name = data[pos:pos + length].rstrip('\0')
+            pos += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        """Close the inotify instance."""
+        os.close(self.fd)
+
+
+class WCWatcher(object):
+    """Records the changes below a working copy in the dirty set journal.
+
+    The journal consists of the following records:
+    S <ns> <pid> -- the watcher (with pid pid) watches the wc since ns
+    E <ns> <path> -- path (relative to the wc) changed at ns
+    C <name> -- a reader created the cookie name (see dirty_set)
+    The journal is removed when the watcher stops.
+
+    """
+    # the journal is compacted after this number of records
+    JOURNAL_COMPACT_RECORDS = 10000
+    EVENT_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_CREATE
+                  | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO)
+    DIR_MASK = EVENT_MASK | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+    def __init__(self, path):
+        """Constructs a new WCWatcher object.
+
+        path is the path to a project or package working copy.
+        A ValueError is raised if path is no working copy and an
+        OSError is raised if inotify is not available.
+
+        """
+        super(WCWatcher, self).__init__()
+        if not _has_storedir(path):
+            raise ValueError("path \"%s\" is no working copy" % path)
+        self.path = path
+        self._project = wc_is_project(path)
+        self._inotify = Inotify()
+        # wd => directory (relative to the wc)
+        self._wds = {}
+        # path => ns of its last change
+        self._dirty = {}
+        self._started = None
+        self._journal = None
+        self._records = 0
+
+    def _watch(self, reldir):
+        try:
+            wd = self._inotify.add_watch(os.path.join(self.path, reldir),
+                                         WCWatcher.DIR_MASK)
+        except OSError as e:
+            # the directory vanished in the meantime
+            if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise
+        self._wds[wd] = reldir
+
+    def _start(self):
+        """Watch the wc and start a new journal."""
+        self._watch('')
+        self._watch(_STORE)
+        if self._project:
+            for name in os.listdir(self.path):
+                if (not name.startswith('.')
+                        and os.path.isdir(os.path.join(self.path, name))):
+                    self._watch(name)
+        # a change which happened before this point is visible to
+        # every digest which is computed afterwards
+        self._restart()
+
+    def _restart(self):
+        """Forget all changes (they happened before the new start)."""
+        self._started = _now()
+        self._dirty = {}
+        self._write_journal()
+
+    def _write_journal(self):
+        global _JOURNAL
+        if self._journal is not None:
+            self._journal.close()
+        journal = _storefile(self.path, _JOURNAL)
+        tmp_journal = journal + '.tmp'
+        lines = ['S %d %d\n' % (self._started, os.getpid())]
+        for path, ns in self._dirty.iteritems():
+            lines.append('E %d %s\n' % (ns, path))
+        with open(tmp_journal, 'w') as f:
+            f.write(''.join(lines))
+        os.rename(tmp_journal, journal)
+        self._journal = open(journal, 'a')
+        self._records = 0
+
+    def _append(self, line):
+        self._records += 1
+        if self._records > self.JOURNAL_COMPACT_RECORDS:
+            self._write_journal()
+        self._journal.write(line)
+        self._journal.flush()
+
+    def _process(self, events):
+        """Record the changes which are described by events."""
+        lines = []
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                # some events are lost
+                self._restart()
+                lines = []
+                continue
+            reldir = self._wds.get(wd)
+            if mask & IN_IGNORED:
+                self._wds.pop(wd, None)
+                continue
+            elif reldir is None or name == _STORE:
+                continue
+            elif reldir == _STORE:
+                if mask & IN_CREATE and name.startswith(_COOKIE_PREFIX):
+                    lines.append('C %s\n' % name)
+                continue
+            if (self._project and not reldir and mask & IN_ISDIR
+                    and mask & (IN_CREATE | IN_MOVED_TO)):
+                self._watch(name)
+            path = reldir
+            if name:
+                path = os.path.join(reldir, name)
+            if not path or '\n' in path:
+                continue
+            ns = _now()
+            self._dirty[path] = ns
+            lines.append('E %d %s\n' % (ns, path))
+        for line in lines:
+            self._append(line)
+
+    def run(self, stop=None, timeout=0.5):
+        """Watch the working copy until stop is set.
+
+        stop is a threading.Event (if stop is None, the working copy
+        is watched until an exception (for instance a
+        KeyboardInterrupt) occurs). timeout is the maximum number of
+        seconds after which stop is checked.
+
+        """
+        global _JOURNAL
+        try:
+            self._start()
+            while stop is None or not stop.is_set():
+                events = self._inotify.read(timeout)
+                if events:
+                    self._process(events)
+        finally:
+            self._inotify.close()
+            if self._journal is not None:
+                self._journal.close()
+                os.unlink(_storefile(self.path, _JOURNAL))
+
+
+class DirtySet(object):
+    """Provides the changes of a watched working copy."""
+
+    def __init__(self, started, dirty, prefix=''):
+        """Constructs a new DirtySet object.
+
+        started is the time (in nanoseconds) since which the wc
+        is watched. dirty is a dict which maps a path (relative to the
+        watched wc) to the time of its last change. prefix is the path
+        of the considered wc relative to the watched wc.
+
+        """
+        super(DirtySet, self).__init__()
+        self.started = started
+        self._dirty = dirty
+        self._prefix = prefix
+
+    def is_dirty(self, filename, since):
+        """Return True if filename might have changed since since.
+
+        since is a time in nanoseconds. filename is relative
+        to the considered wc.
+
+        """
+        if since < self.started:
+            return True
+        path = os.path.join(self._prefix, filename)
+        for path in (path, self._prefix):
+            if self._dirty.get(path, -1) >= since:
+                return True
+        return False
+
+    def subset(self, name):
+        """Return the DirtySet of the wc name.
+
+        name is the path of a wc relative to the considered wc
+        (for instance, a package of the considered project wc).
+
+        """
+        return DirtySet(self.started, self._dirty,
+                        os.path.join(self._prefix, name))
+
+
+class _JournalReader(object):
+    """Incrementally reads a journal."""
+
+    def __init__(self, journal):
+        super(_JournalReader, self).__init__()
+        self.journal = journal
+        self._ino = None
+        self._offset = 0
+        self.started = None
+        self.pid = None
+        self.dirty = {}
+        self.cookies = set()
+
+    def read(self):
+        """Read the new records.
+
+        Return False if the journal does not exist.
+
+        """
+        try:
+            f = open(self.journal, 'r')
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+        with f:
+            ino = os.fstat(f.fileno()).st_ino
+            if ino != self._ino:
+                # the journal was rewritten
+                self._ino = ino
+                self._offset = 0
+                self.dirty = {}
+            f.seek(self._offset)
+            data = f.read()
+        # ignore an incomplete last line
+        data = data[:data.rfind('\n') + 1]
+        self._offset += len(data)
+        for line in data.splitlines():
+            record = line.split(' ', 2)
+            if record[0] == 'S':
+                self.started = int(record[1])
+                self.pid = int(record[2])
+                self.dirty = {}
+            elif record[0] == 'E':
+                self.dirty[record[2]] = int(record[1])
+            elif record[0] == 'C':
+                self.cookies.add(record[1])
+        return True
+
+
+_readers = {}
+_readers_lock = threading.Lock()
+_cookies = [0]
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def dirty_set(path, timeout=1.0):
+    """Return the DirtySet for the working copy path.
+
+    If path is not watched (neither path itself nor its parent
+    wc is watched by a WCWatcher), None is returned. In order to make
+    sure that all changes which happened before this call are
+    contained in the DirtySet, a cookie is created in the storedir
+    of the watched wc and the function waits (at most timeout
+    seconds) until the watcher recorded it. If the watcher does not
+    respond in time, None is returned.
+
+    """
+    global _JOURNAL, _COOKIE_PREFIX
+    root = path
+    prefix = ''
+    journal = _storefile(root, _JOURNAL)
+    if not os.path.exists(journal):
+        root = wc_parent(path)
+        if root is None:
+            return None
+        prefix = os.path.basename(os.path.abspath(path))
+        journal = _storefile(root, _JOURNAL)
+        if not os.path.exists(journal):
+            return None
+    journal = os.path.realpath(journal)
+    with _readers_lock:
+        reader = _readers.setdefault(journal, _JournalReader(journal))
+        _cookies[0] += 1
+        cookie = '%s%d.%d' % (_COOKIE_PREFIX, os.getpid(), _cookies[0])
+        if not reader.read() or not _pid_alive(reader.pid):
+            return None
+        cookie_file = os.path.join(os.path.dirname(journal), cookie)
+        open(cookie_file, 'w').close()
+        try:
+            deadline = time.time() + timeout
+            while cookie not in reader.cookies:
+                if time.time() > deadline or not reader.read():
+                    return None
+                time.sleep(0.0005)
+            reader.cookies.discard(cookie)
+        finally:
+            os.unlink(cookie_file)
+        # the reader's dict is only updated with newer changes (that
+        # is, the DirtySet only gets more conservative)
+        return DirtySet(reader.started, reader.dirty, prefix)
@@ -3,12 +3,15 @@ import cStringIO
 import unittest
 import urllib2
 import shutil
+import threading
 from difflib import unified_diff
 
 from osc2.util.io import mkdtemp
 from test.xmltest import compare_xml
 
 EXPECTED_REQUESTS = []
+# protects EXPECTED_REQUESTS if requests are issued concurrently
+EXPECTED_REQUESTS_LOCK = threading.Lock()
 
 
 class RequestWrongOrder(Exception):
@@ -95,8 +98,30 @@ class MyHTTPHandler(urllib2.HTTPHandler, urllib2.HTTPSHandler):
         # HTTPHandler's inheritance hierarchy extends object
         urllib2.HTTPHandler.__init__(self, *args, **kwargs)
 
+    def _next_request(self, req):
+        """Return the next expected request.
+
+        An expected request which was added with unordered=True
+        can be matched by any issued request (this is needed for
+        tests which issue requests concurrently).
+
+        """
+        with EXPECTED_REQUESTS_LOCK:
+            r = self._exp_requests[0]
+            for cand in self._exp_requests:
+                if not cand[2].get('unordered', False):
+                    break
+                if (req.get_full_url() == cand[1]
+                        and req.get_method() == cand[0]):
+                    r = cand
+                    break
+            self._exp_requests.remove(r)
+        kwargs = dict(r[2])
+        kwargs.pop('unordered', None)
+        return r[0], r[1], kwargs
+
     def http_open(self, req):
-        r = self._exp_requests.pop(0)
+        r = self._next_request(req)
         if req.get_full_url() != r[1] or req.get_method() != r[0]:
             raise RequestWrongOrder(req.get_full_url(), r[1], req.get_method(),
                                     r[0])
@@ -9,15 +9,19 @@ from test import test_oscargs
 from test import test_builder
 from test import test_fetch
 from test import test_search
+from test import test_requestindex
 from test.wc import test_util
 from test.wc import test_project
 from test.wc import test_package
 from test.wc import test_convert
+from test.wc import test_watch
 from test.util import test_xpath
 from test.util import test_cpio
 from test.util import test_xml
 from test.util import test_io
 from test.util import test_delegation
+from test.util import test_parallel
+from test.util import test_merge
 from test.cli.util import test_shell
 
 
@@ -31,15 +35,19 @@ def additional_tests():
     suite.addTests(test_builder.suite())
     suite.addTests(test_fetch.suite())
     suite.addTests(test_search.suite())
+    suite.addTests(test_requestindex.suite())
     suite.addTests(test_util.suite())
     suite.addTests(test_project.suite())
     suite.addTests(test_package.suite())
     suite.addTests(test_convert.suite())
+    suite.addTests(test_watch.suite())
     suite.addTests(test_xpath.suite())
     suite.addTests(test_cpio.suite())
     suite.addTests(test_xml.suite())
     suite.addTests(test_io.suite())
     suite.addTests(test_delegation.suite())
+    suite.addTests(test_parallel.suite())
+    suite.addTests(test_merge.suite())
     suite.addTests(test_shell.suite())
     return suite
 
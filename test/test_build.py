@@ -3,7 +3,8 @@ from cStringIO import StringIO
 
 from lxml import etree
 
-from osc2.build import BuildResult, BinaryList, BuildInfo, BuildDependency
+from osc2.build import (BuildResult, BinaryList, BuildInfo, BuildDependency,
+                        Status, ReadOnlyBinaryList)
 from test.osctest import OscTest
 from test.httptest import GET, POST
 
@@ -20,6 +21,7 @@ class TestBuild(OscTest):
     def tearDown(self):
         super(TestBuild, self).tearDown()
         BuildResult.RESULT_SCHEMA = ''
+        BinaryList.SCHEMA = ''
 
     @GET('http://localhost/build/test/_result', file='prj_result.xml')
     def test_buildresult1(self):
@@ -121,6 +123,44 @@ class TestBuild(OscTest):
         self.assertRaises(AttributeError, res.result[0].status[0].__getattr__,
                           'asdf')
 
+    @GET('http://localhost/build/test/_result', file='prj_result.xml')
+    def test_buildresult7(self):
+        """read-only project result"""
+        br = BuildResult('test')
+        res = br.result(readonly=True)
+        self.assertTrue(len(res.result[:]) == 2)
+        self.assertEqual(res.result[0].get('arch'), 'i586')
+        self.assertTrue(len(res.result[0].status[:]) == 3)
+        self.assertEqual(res.result[0].status[0].get('package'), 'foo')
+        self.assertEqual(res.result[0].status[0].details, '')
+        self.assertEqual(res.result[0].status[2].details, 'builds on host foo')
+        self.assertEqual(res.result[1].get('dirty'), 'true')
+        self.assertRaises(AttributeError, getattr, res.result[1].status[0],
+                          'asdf')
+        # convert to objectify
+        status = res.result[1].status[2].objectify()
+        self.assertTrue(isinstance(status, Status))
+        self.assertEqual(status.get('package'), 'osc')
+        self.assertEqual(status.getparent().get('arch'), 'x86_64')
+
+    @GET('http://localhost/build/test/_result', file='prj_result.xml')
+    def test_buildresult8(self):
+        """stream project result"""
+        br = BuildResult('test')
+        stream = br.result(stream=True)
+        results = []
+        for res in stream:
+            self.assertEqual(stream.get('state'),
+                             '11111111111111111111111111111111')
+            results.append((res.get('arch'), res.status[2].details))
+        self.assertEqual(results, [('i586', 'builds on host foo'),
+                                   ('x86_64', '')])
+
+    def test_buildresult9(self):
+        """readonly and stream are mutually exclusive"""
+        br = BuildResult('test')
+        self.assertRaises(ValueError, br.result, readonly=True, stream=True)
+
     @GET('http://localhost/build/test/_result', text='<invalid />')
     def test_buildresult6(self):
         """test validation"""
@@ -175,6 +215,39 @@ class TestBuild(OscTest):
         bfile = blist.binary[2].file()
         self.assertEqual(bfile.read(), 'glibc-devel.rpm')
 
+    @GET('http://localhost/build/test/repo/i586/_repository',
+         file='binarylist1.xml')
+    @GET('http://localhost/build/test/repo/i586/_repository/glibc.rpm',
+         text='glibc.rpm')
+    def test_binarylist_readonly(self):
+        """read-only binarylist"""
+        br = BuildResult('test', repository='repo', arch='i586')
+        blist = br.binarylist(readonly=True)
+        self.assertTrue(isinstance(blist, ReadOnlyBinaryList))
+        self.assertTrue(len(blist.binary[:]) == 3)
+        self.assertEqual(blist.get('repository'), 'repo')
+        self.assertEqual([b.get('filename') for b in blist.binary],
+                         ['osc.rpm', 'glibc.rpm', 'glibc-devel.rpm'])
+        self.assertEqual(blist.binary[1].get('size'), '12244')
+        bfile = blist.binary[1].file()
+        self.assertEqual(bfile.read(), 'glibc.rpm')
+        self.assertTrue(isinstance(blist.objectify(), BinaryList))
+
+    @GET('http://localhost/build/test/repo/i586/_repository',
+         file='binarylist1.xml')
+    @GET('http://localhost/build/test/repo/i586/_repository/glibc.rpm',
+         text='glibc.rpm')
+    def test_binarylist_stream(self):
+        """stream binarylist"""
+        br = BuildResult('test', repository='repo', arch='i586')
+        filenames = []
+        for binary in br.binarylist(stream=True):
+            filenames.append(binary.get('filename'))
+            if binary.get('filename') == 'glibc.rpm':
+                self.assertEqual(binary.file().read(), 'glibc.rpm')
+        self.assertEqual(filenames,
+                         ['osc.rpm', 'glibc.rpm', 'glibc-devel.rpm'])
+
     @GET('http://localhost/build/test/repo/i586/osc',
          text='<invalid />')
     def test_binarylist3(self):
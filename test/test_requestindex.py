@@ -0,0 +1,122 @@
+import os
+import unittest
+import urllib
+
+from osc2.requestindex import RequestIndex
+from test.osctest import OscTest
+from test.httptest import GET
+
+SCOPE = 'action/target/@project = "openSUSE:Factory"'
+SYNC_SCOPE = ('((%s) and @id > 108) or ((%s) and state/@when >= '
+              '"2012-03-12T21:05:12")' % (SCOPE, SCOPE))
+STATE_SCOPE = '(state/@name = "new") and (%s)' % SCOPE
+STATE_SYNC_SCOPE = ('((%s) and @id > 108) or ((%s) and state/@when >= '
+                    '"2012-03-12T21:05:12")' % (STATE_SCOPE, SCOPE))
+
+
+def search_url(xp):
+    return ('http://localhost/search/request?match='
+            + urllib.quote_plus(xp))
+
+
+def suite():
+    return unittest.makeSuite(TestRequestIndex)
+
+
+class TestRequestIndex(OscTest):
+    def __init__(self, *args, **kwargs):
+        kwargs['fixtures_dir'] = 'test_requestindex_fixtures'
+        super(TestRequestIndex, self).__init__(*args, **kwargs)
+
+    def setUp(self):
+        super(TestRequestIndex, self).setUp()
+        filename = os.path.join(self._tmp_dir, 'index.db')
+        self.index = RequestIndex(filename, 'http://localhost')
+
+    def tearDown(self):
+        self.index.close()
+        super(TestRequestIndex, self).tearDown()
+
+    def _ids(self, requests):
+        return [r.get('id') for r in requests]
+
+    @GET(search_url(SCOPE), file='collection_request1.xml')
+    def test_index1(self):
+        """initial sync"""
+        self.assertFalse(self.index.is_synced(SCOPE))
+        self.assertEqual(self.index.sync(SCOPE), 3)
+        self.assertTrue(self.index.is_synced(SCOPE))
+        requests = self.index.find(states=['new', 'review'])
+        self.assertEqual(self._ids(requests), ['1', '42', '108'])
+        self.assertEqual(requests[1].action.get('type'), 'submit')
+        self.assertEqual(self.index.find(states=['review']), [])
+
+    @GET(search_url(SCOPE), file='collection_request1.xml')
+    def test_index2(self):
+        """query by user, project and package"""
+        self.index.sync(SCOPE)
+        requests = self.index.find(user='factory-auto')
+        self.assertEqual(self._ids(requests), ['1', '42', '108'])
+        self.assertEqual(self.index.find(user='licensedigger'), [])
+        requests = self.index.find(project='foo', package='libxyz')
+        self.assertEqual(self._ids(requests), ['108'])
+        requests = self.index.find(states=['new'], project='openSUSE:Factory',
+                                   package='bar')
+        self.assertEqual(self._ids(requests), ['1'])
+        self.assertEqual(self.index.find(project='bar'), [])
+
+    @GET(search_url(SCOPE), file='collection_request1.xml')
+    @GET(search_url(SYNC_SCOPE), file='collection_request_sync.xml')
+    def test_index3(self):
+        """incremental sync"""
+        self.index.sync(SCOPE)
+        self.assertEqual(self.index.sync(SCOPE), 2)
+        requests = self.index.find(states=['new'])
+        self.assertEqual(self._ids(requests), ['1', '108', '109'])
+        requests = self.index.find(states=['accepted'])
+        self.assertEqual(self._ids(requests), ['42'])
+        # user data of the old request is replaced
+        requests = self.index.find(user='factory-auto')
+        self.assertEqual(self._ids(requests), ['1', '108'])
+        requests = self.index.find(package='xyz')
+        self.assertEqual(self._ids(requests), ['109'])
+
+    @GET(search_url(SCOPE), file='collection_request1.xml')
+    def test_index4(self):
+        """get a single request and replace it"""
+        self.index.sync(SCOPE)
+        request = self.index.request('42')
+        self.assertIsNotNone(request)
+        self.assertEqual(request.state.get('name'), 'new')
+        self.assertIsNone(self.index.request('43'))
+        request.state.set('name', 'declined')
+        self.index.add(request)
+        self.assertEqual(self._ids(self.index.find(states=['declined'])),
+                         ['42'])
+        self.assertEqual(self._ids(self.index.find(states=['new'])),
+                         ['1', '108'])
+
+    @GET(search_url(STATE_SCOPE), file='collection_request1.xml')
+    @GET(search_url(STATE_SYNC_SCOPE), file='collection_request_sync.xml')
+    def test_index5(self):
+        """incremental sync (changed requests are not filtered by state)"""
+        self.index.sync(STATE_SCOPE, changes=SCOPE)
+        self.assertEqual(self.index.sync(STATE_SCOPE, changes=SCOPE), 2)
+        requests = self.index.find(states=['accepted'])
+        self.assertEqual(self._ids(requests), ['42'])
+
+    @GET(search_url(SCOPE), file='collection_request1.xml')
+    @GET(search_url(STATE_SCOPE), file='collection_request2.xml')
+    def test_index6(self):
+        """find only returns the requests which were synced by scope"""
+        self.index.sync(SCOPE)
+        # request 42 was accepted in the meantime
+        self.assertEqual(self.index.sync(STATE_SCOPE, changes=SCOPE), 2)
+        requests = self.index.find(states=['new'], scope=STATE_SCOPE)
+        self.assertEqual(self._ids(requests), ['1', '108'])
+        requests = self.index.find(states=['new'], scope=SCOPE)
+        self.assertEqual(self._ids(requests), ['1', '42', '108'])
+        self.assertEqual(self.index.find(scope='foo'), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,7 @@ import unittest
 
 from lxml import etree
 
+from osc2.remote import Request
 from osc2.search import find_request, RequestCollection
 from osc2.util.xpath import XPathBuilder
 from test.osctest import OscTest
@@ -85,5 +86,19 @@ class TestSearch(OscTest):
         xp = xpb.state[xpb.attr('name') == 'declined']
         self.assertRaises(etree.DocumentInvalid, find_request, xp)
 
+    @GET(('http://localhost/search/request?match='
+          '%2Fstate%5B%40name+%3D+%22new%22%5D'),
+         file='collection_request1.xml')
+    def test_request5(self):
+        """test find_request (stream results)"""
+        collection = find_request('/state[@name = "new"]', stream=True)
+        self.assertIsNone(collection.get('matches'))
+        ids = ['1', '42', '108']
+        for r in collection:
+            self.assertTrue(isinstance(r, Request))
+            self.assertEqual(r.get('id'), ids.pop(0))
+            self.assertEqual(collection.get('matches'), '3')
+        self.assertTrue(len(ids) == 0)
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,7 +2,8 @@ import unittest
 
 from lxml import etree
 
-from osc2.source import Project, Package
+from osc2.source import (Project, Package, File, Directory,
+                         ReadOnlyDirectory, ReadOnlyFile)
 from test.osctest import OscTest
 from test.httptest import GET
 
@@ -40,6 +41,23 @@ class TestSource(OscTest):
         pkgs = prj.list()
         self.assertTrue(len(pkgs) == 0)
 
+    @GET('http://localhost/source/openSUSE%3AFactory?view=info',
+         file='prj_sourceinfo.xml')
+    def test2_1(self):
+        """test sourceinfo"""
+        prj = Project('openSUSE:Factory')
+        info = prj.sourceinfo()
+        self.assertEqual(sorted(info.keys()), ['glibc', 'osc', 'python'])
+        self.assertEqual(info['osc']['srcmd5'],
+                         'aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa')
+        self.assertEqual(info['osc']['verifymd5'],
+                         'baaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa')
+        self.assertEqual(info['glibc']['lsrcmd5'],
+                         'daaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa')
+        self.assertFalse('error' in info['glibc'])
+        self.assertEqual(info['python']['error'],
+                         'conflict in file python.spec')
+
     @GET('http://localhost/source/openSUSE%3AFactory', text='<invalid />')
     def test3(self):
         """test invalid xml data (package list)"""
@@ -116,5 +134,31 @@ class TestSource(OscTest):
         self.assertEqual(log.revision[1].comment, 'request')
         self.assertEqual(log.revision[1].requestid, '123')
 
+    @GET('http://localhost/source/foo/bar', file='file_list.xml')
+    @GET('http://localhost/source/foo/osc/osc.spec?rev=fff',
+         file='osc.spec')
+    def test8(self):
+        """test read-only file list"""
+        Package.LIST_SCHEMA = self.fixture_file('directory.xsd')
+        pkg = Package('foo', 'bar')
+        files = pkg.list(readonly=True)
+        self.assertTrue(isinstance(files, ReadOnlyDirectory))
+        self.assertEqual(files.get('name'), 'osc')
+        self.assertEqual(files.get('project'), 'foo')
+        self.assertEqual([e.get('name') for e in files],
+                         ['osc-0.132.4.tar.gz', 'osc.spec'])
+        self.assertTrue(isinstance(files.entry[1], ReadOnlyFile))
+        self.assertEqual(files.entry[1].get('md5'), 'ef2')
+        self.assertEqual(files.entry[1].get('size'), '3761')
+        f = files.entry[1].file()
+        self.assertEqual(f.read(), '# this is\n# no spec\n')
+        # convert to objectify
+        entry = files.entry[1].objectify()
+        self.assertTrue(isinstance(entry, File))
+        self.assertTrue(isinstance(entry.getparent(), Directory))
+        self.assertEqual(entry.get('name'), 'osc.spec')
+        self.assertEqual(entry.getparent().get('project'), 'foo')
+        self.assertTrue(files.objectify() is entry.getparent())
+
 if __name__ == '__main__':
     unittest.main()
@@ -4,7 +4,8 @@ import sys
 import tempfile
 from cStringIO import StringIO
 
-from osc2.util.io import TemporaryDirectory, mkdtemp, mkstemp
+from osc2.util.io import (TemporaryDirectory, mkdtemp, mkstemp,
+                         clone_file)
 from test.osctest import OscTestCase
 
 
@@ -290,5 +291,59 @@ class TestIO(OscTestCase):
                 self.assertEqual(f.read(), 'foobar')
         self.assertFalse(os.path.isfile(tmpfile))
 
+    def test_clone_file1(self):
+        """clone a file"""
+        with mkdtemp(dir=self._tmpdir) as tmpdir:
+            source = os.path.join(tmpdir, 'source')
+            dest = os.path.join(tmpdir, 'dest')
+            with open(source, 'w') as f:
+                f.write('foo\n' * 10000)
+            strategy = clone_file(source, dest, mtime=1311541427)
+            self.assertTrue(strategy in ('reflink', 'kernel', 'copy'))
+            with open(dest, 'r') as f:
+                self.assertEqual(f.read(), 'foo\n' * 10000)
+            st = os.stat(dest)
+            self.assertNotEqual(st.st_ino, os.stat(source).st_ino)
+            self.assertEqual(st.st_mtime, 1311541427)
+            self.assertEqual(st.st_mode & 0777, 0644)
+            # no temporary files are left behind
+            self.assertEqual(sorted(os.listdir(tmpdir)), ['dest', 'source'])
+
+    def test_clone_file2(self):
+        """clone an empty file (replaces an existing dest)"""
+        with mkdtemp(dir=self._tmpdir) as tmpdir:
+            source = os.path.join(tmpdir, 'source')
+            dest = os.path.join(tmpdir, 'dest')
+            open(source, 'w').close()
+            with open(dest, 'w') as f:
+                f.write('bar')
+            clone_file(source, dest, mode=0600)
+            self.assertEqual(os.path.getsize(dest), 0)
+            self.assertEqual(os.stat(dest).st_mode & 0777, 0600)
+
+    def test_clone_file3(self):
+        """hardlink a file"""
+        with mkdtemp(dir=self._tmpdir) as tmpdir:
+            source = os.path.join(tmpdir, 'source')
+            dest = os.path.join(tmpdir, 'dest')
+            with open(source, 'w') as f:
+                f.write('foo')
+            self.assertEqual(clone_file(source, dest, hardlink=True),
+                             'hardlink')
+            st = os.stat(dest)
+            self.assertEqual(st.st_ino, os.stat(source).st_ino)
+            # write permissions are removed
+            self.assertEqual(st.st_mode & 0777, 0444)
+            self.assertEqual(sorted(os.listdir(tmpdir)), ['dest', 'source'])
+
+    def test_clone_file4(self):
+        """clone a nonexistent file (raises a ValueError)"""
+        with mkdtemp(dir=self._tmpdir) as tmpdir:
+            source = os.path.join(tmpdir, 'source')
+            dest = os.path.join(tmpdir, 'dest')
+            self.assertRaises(ValueError, clone_file, source, dest)
+            os.mkdir(source)
+            self.assertRaises(ValueError, clone_file, source, dest)
+
 if __name__ == '__main__':
     unittest.main()
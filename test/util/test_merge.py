@@ -0,0 +1,73 @@
+import unittest
+
+from osc2.util.merge import merge3
+from test.osctest import OscTestCase
+
+
+def lines(data):
+    return data.splitlines(True)
+
+
+def suite():
+    return unittest.makeSuite(TestMerge)
+
+
+class TestMerge(OscTestCase):
+    def test_merge1(self):
+        """non-overlapping changes"""
+        old = lines('a\nb\nc\nd\ne\n')
+        mine = lines('A\nb\nc\nd\ne\n')
+        yours = lines('a\nb\nc\nd\nE\nf\n')
+        merged, conflicts = merge3(mine, old, yours)
+        self.assertEqual(''.join(merged), 'A\nb\nc\nd\nE\nf\n')
+        self.assertEqual(conflicts, 0)
+
+    def test_merge2(self):
+        """identical changes on both sides"""
+        old = lines('a\nb\nc\n')
+        mine = lines('a\nB\nc\n')
+        merged, conflicts = merge3(mine, old, list(mine))
+        self.assertEqual(''.join(merged), 'a\nB\nc\n')
+        self.assertEqual(conflicts, 0)
+        # only one side changed
+        merged, conflicts = merge3(old, old, mine)
+        self.assertEqual(''.join(merged), 'a\nB\nc\n')
+        merged, conflicts = merge3(mine, old, old)
+        self.assertEqual(''.join(merged), 'a\nB\nc\n')
+        self.assertEqual(conflicts, 0)
+
+    def test_merge3(self):
+        """overlapping changes (diff3 compatible conflict markers)"""
+        old = lines('a\nb\nc\nd\n')
+        mine = lines('a\nmy b\nc\nd\n')
+        yours = lines('a\nyour b\nc\nyour d\n')
+        merged, conflicts = merge3(mine, old, yours, my_label='foo.mine',
+                                   your_label='foo.new')
+        exp = ('a\n<<<<<<< foo.mine\nmy b\n=======\nyour b\n'
+               '>>>>>>> foo.new\nc\nyour d\n')
+        self.assertEqual(''.join(merged), exp)
+        self.assertEqual(conflicts, 1)
+
+    def test_merge4(self):
+        """conflict at the end of a file without a trailing newline"""
+        old = lines('a\nb')
+        mine = lines('a\nc')
+        yours = lines('a\nd')
+        merged, conflicts = merge3(mine, old, yours)
+        exp = 'a\n<<<<<<< mine\nc\n=======\nd\n>>>>>>> yours\n'
+        self.assertEqual(''.join(merged), exp)
+        self.assertEqual(conflicts, 1)
+
+    def test_merge5(self):
+        """empty files and insertions at the same position"""
+        self.assertEqual(merge3([], [], []), ([], 0))
+        merged, conflicts = merge3(['a\n'], [], ['b\n'])
+        exp = '<<<<<<< mine\na\n=======\nb\n>>>>>>> yours\n'
+        self.assertEqual(''.join(merged), exp)
+        self.assertEqual(conflicts, 1)
+        merged, conflicts = merge3(['a\n', 'x\n'], ['x\n'], ['x\n', 'b\n'])
+        self.assertEqual(''.join(merged), 'a\nx\nb\n')
+        self.assertEqual(conflicts, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import threading
+import unittest
+
+from osc2.util.parallel import parallel_map, parallel_imap, default_jobs
+from test.osctest import OscTestCase
+
+
+def suite():
+    return unittest.makeSuite(TestParallel)
+
+
+class TestParallel(OscTestCase):
+    def test_parallel_map1(self):
+        """results are returned in order"""
+        self.assertEqual(parallel_map(lambda x: x * 2, range(20), jobs=4),
+                         [x * 2 for x in range(20)])
+        self.assertEqual(parallel_map(lambda x: x, [], jobs=4), [])
+        self.assertTrue(default_jobs() >= 1)
+
+    def test_parallel_map2(self):
+        """items are processed concurrently"""
+        barrier = threading.Semaphore(0)
+
+        def func(x):
+            # blocks forever if the items are processed sequentially
+            barrier.release()
+            if x == 0:
+                for i in range(3):
+                    barrier.acquire()
+            return threading.current_thread()
+        threads = parallel_map(func, range(3), jobs=3)
+        self.assertEqual(len(threads), 3)
+
+    def test_parallel_map3(self):
+        """an exception is propagated"""
+        def func(x):
+            if x == 3:
+                raise ValueError('x')
+            return x
+        self.assertRaises(ValueError, parallel_map, func, range(5), jobs=2)
+        self.assertRaises(ValueError, parallel_map, func, range(5), jobs=1)
+
+    def test_parallel_imap1(self):
+        """results are yielded in order (before all items are processed)"""
+        done = threading.Event()
+
+        def func(x):
+            if x == 3:
+                # blocks until the first result was consumed
+                done.wait(5)
+            return x * 2
+        results = parallel_imap(func, range(4), jobs=2)
+        self.assertEqual(results.next(), 0)
+        done.set()
+        self.assertEqual(list(results), [2, 4, 6])
+        self.assertEqual(list(parallel_imap(func, [], jobs=2)), [])
+
+    def test_parallel_imap2(self):
+        """an exception is propagated"""
+        def func(x):
+            if x == 3:
+                raise ValueError('x')
+            return x
+        self.assertRaises(ValueError, list, parallel_imap(func, range(5), 2))
+        self.assertRaises(ValueError, list, parallel_imap(func, range(5), 1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,14 @@
+import threading
 import unittest
 from collections import Sequence
+from cStringIO import StringIO
 
-from osc2.util.xml import fromstring
+from lxml import etree
+
+import osc2.util.xml
+from osc2.util.xml import (fromstring, compile_xpath, get_parser,
+                          OscElement, ReadOnlyElement, parse_readonly,
+                          ElementStream)
 from test.osctest import OscTestCase
 
 
@@ -83,9 +90,183 @@ class TestXML(OscTestCase):
         data = self.xml.findall('2 + 3')
         self.assertEqual(data, 5.0)
 
+    def test_find_variables(self):
+        """Find single element using an xpath with variables"""
+        elm = self.xml.find('//bar[@name = $name]', name='xyz')
+        self.assertIsNotNone(elm)
+        self.assertEqual(elm.get('name'), 'xyz')
+        # no quoting issues
+        elm = self.xml.find('//bar[@name = $name]', name='x"y\'z')
+        self.assertIsNone(elm)
+
+    def test_findall_variables(self):
+        """Test findall with an xpath with variables"""
+        elms = self.xml.findall('//bar[count(foo) = $cnt]', cnt=0)
+        self.assertEqual(len(elms), 2)
+
+    def test_compile_xpath(self):
+        """Compiled xpath objects are cached"""
+        xp = compile_xpath('//bar[@name = $name]')
+        self.assertTrue(xp is compile_xpath('//bar[@name = $name]'))
+        self.assertFalse(xp is compile_xpath('//bar'))
+        self.assertEqual(len(xp(self.xml, name='xyz')), 1)
+
+    def test_compile_xpath_lru(self):
+        """The least recently used xpath is evicted"""
+        size = osc2.util.xml.XPATH_CACHE_SIZE
+        try:
+            osc2.util.xml.XPATH_CACHE_SIZE = 2
+            foo = compile_xpath('//foo')
+            bar = compile_xpath('//bar')
+            self.assertTrue(foo is compile_xpath('//foo'))
+            compile_xpath('//baz')
+            self.assertTrue(foo is compile_xpath('//foo'))
+            self.assertFalse(bar is compile_xpath('//bar'))
+        finally:
+            osc2.util.xml.XPATH_CACHE_SIZE = size
+
+    def test_get_parser(self):
+        """Configured parsers are cached"""
+        class Bar(OscElement):
+            pass
+
+        parser = get_parser(bar=Bar)
+        self.assertTrue(parser is get_parser(bar=Bar))
+        self.assertFalse(parser is get_parser())
+        self.assertFalse(parser is get_parser(bar=Bar, tree_class=Bar))
+        xml = fromstring('<foo><bar/></foo>', bar=Bar)
+        self.assertTrue(isinstance(xml.bar, Bar))
+        self.assertFalse(isinstance(xml, Bar))
+
+    def test_get_parser_thread(self):
+        """Parsers are not shared between threads"""
+        parsers = []
+        thread = threading.Thread(target=lambda: parsers.append(get_parser()))
+        thread.start()
+        thread.join()
+        self.assertEqual(len(parsers), 1)
+        self.assertFalse(parsers[0] is get_parser())
+
     def test_iterfind(self):
         """iterfind is not overriden (the default does not support an xpath)"""
         self.assertRaises(SyntaxError, self.xml.iterfind, '//foo')
 
+    def test_parse_readonly(self):
+        """parse into ReadOnlyElement objects"""
+        class Bar(ReadOnlyElement):
+            __slots__ = ()
+        data = """<root a="b">
+                    <foo><bar name="xyz"><baz>text</baz></bar><bar/></foo>
+                    <foo/>
+                  </root>"""
+        for source in (data, StringIO(data)):
+            root = parse_readonly(source, bar=Bar)
+            self.assertEqual(root.tag, 'root')
+            self.assertEqual(root.get('a'), 'b')
+            self.assertIsNone(root.get('x'))
+            self.assertIsNone(root.text)
+            self.assertEqual(len(root.foo), 2)
+            self.assertEqual(len(root.findall('foo/bar')), 2)
+            self.assertTrue(isinstance(root.foo.bar, Bar))
+            self.assertEqual(root.foo.bar.get('name'), 'xyz')
+            self.assertEqual(root.foo.bar.baz, 'text')
+            self.assertTrue(root.foo[1] is root.findall('foo')[1])
+            self.assertTrue(root.foo.bar.getparent() is root.foo)
+            self.assertIsNone(root.find('bar'))
+            self.assertRaises(AttributeError, getattr, root, 'bar')
+
+    def test_parse_readonly_objectify(self):
+        """convert a ReadOnlyElement to an objectify element"""
+        class Bar(OscElement):
+            pass
+
+        class ReadOnlyBar(ReadOnlyElement):
+            __slots__ = ()
+            objectify_class = Bar
+        root = parse_readonly('<root><foo/><foo><bar name="x"/></foo></root>',
+                              bar=ReadOnlyBar)
+        root.attrib['c'] = 'd'
+        bar = root.foo[1].bar.objectify()
+        self.assertTrue(isinstance(bar, Bar))
+        self.assertEqual(bar.get('name'), 'x')
+        self.assertEqual(bar.getparent().getparent().get('c'), 'd')
+        # the conversion is done only once
+        self.assertTrue(root.objectify() is bar.getparent().getparent())
+        bar.set('name', 'y')
+        self.assertEqual(root.objectify().foo[1].bar.get('name'), 'y')
+        self.assertEqual(root.foo[1].bar.get('name'), 'x')
+
+    def test_element_stream(self):
+        """incrementally parse a document"""
+        class Bar(OscElement):
+            pass
+
+        class Source(object):
+            def __init__(self, data):
+                self.sio = StringIO(data)
+                self.closed = False
+
+            def read(self, size=-1):
+                return self.sio.read(size)
+
+            def close(self):
+                self.closed = True
+        data = """<root a="b">
+                    <bar name="x"><foo/></bar>
+                    <foo/>
+                    <bar name="y"><bar/></bar>
+                    <bar name="z"/>
+                  </root>"""
+        chunk_size = osc2.util.xml.STREAM_CHUNK_SIZE
+        osc2.util.xml.STREAM_CHUNK_SIZE = 7
+        try:
+            source = Source(data)
+            stream = ElementStream(source, 'bar', annotate={'c': 'd'},
+                                   bar=Bar)
+            self.assertIsNone(stream.attrib)
+            self.assertIsNone(stream.get('a'))
+            names = []
+            for elm in stream:
+                self.assertTrue(isinstance(elm, Bar))
+                # processed siblings are removed
+                self.assertIsNone(elm.getprevious())
+                self.assertEqual(elm.getparent().get('c'), 'd')
+                names.append(elm.get('name'))
+            self.assertEqual(names, ['x', 'y', 'z'])
+            self.assertEqual(stream.attrib, {'a': 'b', 'c': 'd'})
+            self.assertEqual(stream.get('a'), 'b')
+            self.assertTrue(source.closed)
+        finally:
+            osc2.util.xml.STREAM_CHUNK_SIZE = chunk_size
+
+    def test_element_stream_invalid(self):
+        """incrementally parse an incomplete document"""
+        stream = ElementStream(StringIO('<root><bar/><bar>'), 'bar')
+        it = iter(stream)
+        self.assertEqual(it.next().tag, 'bar')
+        self.assertRaises(etree.XMLSyntaxError, it.next)
+
+    def test_element_stream_fallback(self):
+        """parse the complete document (lxml without XMLPullParser)"""
+        class Bar(OscElement):
+            pass
+
+        data = '<root a="b"><bar name="x"/><foo/><bar name="y"/></root>'
+        pull_parser = etree.XMLPullParser
+        del etree.XMLPullParser
+        try:
+            stream = ElementStream(StringIO(data), 'bar', annotate={'c': 'd'},
+                                   bar=Bar)
+            names = []
+            for elm in stream:
+                self.assertTrue(isinstance(elm, Bar))
+                self.assertIsNone(elm.getprevious())
+                self.assertEqual(elm.getparent().get('c'), 'd')
+                names.append(elm.get('name'))
+            self.assertEqual(names, ['x', 'y'])
+            self.assertEqual(stream.attrib, {'a': 'b', 'c': 'd'})
+        finally:
+            etree.XMLPullParser = pull_parser
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,10 +1,12 @@
 import os
 import unittest
 
-from osc2.wc.convert import convert_package, convert_project
+from osc2.wc.convert import (convert_package, convert_project,
+                             convert_to_sqlite)
 from osc2.wc.project import Project
 from osc2.wc.package import Package
-from osc2.wc.util import WCInconsistentError, WCFormatVersionError
+from osc2.wc.util import (WCInconsistentError, WCFormatVersionError,
+                          wc_is_sqlite)
 from test.osctest import OscTest
 from test.httptest import GET
 
@@ -108,5 +110,33 @@ class TestConvert(OscTest):
         pkg = prj.package('deleted')
         self.assertEqual(pkg.files(), ['deleted'])
 
+    def test_sqlite1(self):
+        """test sqlite convert (project)"""
+        path = self.fixture_file('project_1')
+        convert_project(path)
+        convert_to_sqlite(path)
+        for wc_path in (path, os.path.join(path, 'foo'),
+                        os.path.join(path, 'added')):
+            self.assertTrue(wc_is_sqlite(wc_path))
+        self._not_exists(path, '_packages', store=True)
+        prj = Project(path)
+        self.assertEqual(prj._status('foo'), ' ')
+        self.assertEqual(prj._status('added'), 'A')
+        self.assertEqual(prj._status('deleted'), 'D')
+        pkg = prj.package('foo')
+        self.assertEqual(pkg.files(), ['file', 'deleted', 'modified',
+                                       'added', 'added2'])
+        self.assertEqual(pkg.status('deleted'), 'D')
+
+    def test_sqlite2(self):
+        """test sqlite convert (pending transaction)"""
+        path = self.fixture_file('project_1')
+        convert_project(path)
+        pkg_path = os.path.join(path, 'foo')
+        os.mkdir(os.path.join(pkg_path, '.osc', '_transaction'))
+        self.assertRaises(ValueError, convert_to_sqlite, path)
+        self.assertFalse(wc_is_sqlite(pkg_path))
+        self.assertFalse(wc_is_sqlite(path))
+
 if __name__ == '__main__':
     unittest.main()
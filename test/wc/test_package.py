@@ -1,16 +1,20 @@
 import os
 import unittest
 import stat
+import shutil
 import sys
 
 from lxml import etree
 
+import osc2.wc.package
 from osc2.wc.base import (TransactionListener, FileConflictError,
                           PendingTransactionError)
 from osc2.wc.package import (Package, FileSkipHandler, PackageUpdateState,
                              FileUpdateInfo, file_md5, is_binaryfile,
-                             FileCommitPolicy, UnifiedDiff, Diff)
-from osc2.wc.util import WCInconsistentError, WCFormatVersionError
+                             FileCommitPolicy, UnifiedDiff, Diff, PythonMerge)
+from osc2.wc.util import (WCInconsistentError, WCFormatVersionError,
+                          wc_is_sqlite, wc_batch)
+from osc2.wc.convert import convert_to_sqlite
 from osc2.source import Package as SourcePackage
 from osc2.util.io import mkdtemp
 from test.osctest import OscTest
@@ -172,6 +176,58 @@ class TestPackage(OscTest):
         self.assertEqual(pkg.status('nonexistent'), '?')
         self.assertEqual(pkg.status('unknown'), '?')
 
+    def test9_1(self):
+        """test statuses (md5sums are computed concurrently)"""
+        path = self.fixture_file('status1')
+        pkg = Package(path, hash_jobs=4)
+        states = pkg.statuses()
+        self.assertEqual(states, {'file1': ' ', 'added': 'A', 'added2': 'A',
+                                  'delete': 'D', 'delete_mod': 'D',
+                                  'missing': '!', 'modified': 'M',
+                                  'skipped': 'S', 'conflict': 'C'})
+        self.assertEqual(pkg.statuses('file1', 'unknown'),
+                         {'file1': ' ', 'unknown': '?'})
+
+    def test9_2(self):
+        """test _download (files are downloaded concurrently)"""
+        class RemoteFile(object):
+            def __init__(self, name, started):
+                self.name = name
+                self.started = started
+
+            def write_to(self, dest):
+                self.started.append(self.name)
+                with open(dest, 'w') as f:
+                    f.write(self.name)
+
+        class Entry(object):
+            def __init__(self, name, size, started):
+                self.attrib = {'name': name, 'size': str(size)}
+                self.started = started
+
+            def get(self, key, default=None):
+                return self.attrib.get(key, default)
+
+            def file(self, **kwargs):
+                return RemoteFile(self.get('name'), self.started)
+
+        path = self.fixture_file('status1')
+        tl = TL()
+        pkg = Package(path, transfer_jobs=2, transaction_listener=[tl])
+        location = mkdtemp(dir=self._tmp_dir)
+        started = []
+        sizes = {'small': 1, 'big': 100, 'medium': 50, 'tiny': 0}
+        data = dict([(name, Entry(name, size, started))
+                     for name, size in sizes.iteritems()])
+        pkg._download(location, data, 'small', 'big', 'medium', 'tiny')
+        # the largest files are scheduled first
+        self.assertEqual(set(started[:2]), set(['big', 'medium']))
+        self.assertEqual(sorted(tl._transfer),
+                         [('download', name) for name in sorted(sizes)])
+        for name in sizes:
+            fname = os.path.join(location, name)
+            self.assertEqual(open(fname, 'r').read(), name)
+
     @GET('http://localhost/source/prj/foo', file='foo_list1.xml')
     def test10(self):
         """test _calculate_updateinfo 1"""
@@ -389,6 +445,104 @@ class TestPackage(OscTest):
         # default mode 644
         self.assertEqual(stat.S_IMODE(st.st_mode), 420)
 
+    def test_status_cache(self):
+        """test status (the md5 of an unchanged file is cached)"""
+        # a digest which is computed in the same second in which the
+        # file was changed is not cached
+        path = self.fixture_file('status1')
+        fname = os.path.join(path, 'file1')
+        os.utime(fname, (-1, 1310908346))
+        pkg = Package(path)
+        self.assertEqual(pkg.status('file1'), ' ')
+        self.assertEqual(pkg.status('file1'), ' ')
+        # the cache is persisted
+        pkg = Package(path)
+        self.assertEqual(pkg.status('file1'), ' ')
+        # same size and mtime (but ctime changes)
+        with open(fname, 'w') as f:
+            f.write('foo baz\n')
+        os.utime(fname, (-1, 1310908346))
+        self.assertEqual(pkg.status('file1'), 'M')
+        self.assertEqual(Package(path).status('file1'), 'M')
+
+    def test_sqlite1(self):
+        """test status (sqlite wc)"""
+        path = self.fixture_file('status1')
+        statuses = Package(path).statuses()
+        convert_to_sqlite(path)
+        self.assertTrue(wc_is_sqlite(path))
+        self._not_exists(path, '_files', store=True)
+        self._exists(path, '_wc.db', store=True)
+        pkg = Package(path)
+        self.assertEqual(pkg.statuses(), statuses)
+        self.assertEqual(pkg.files(), ['file1', 'added', 'added2', 'delete',
+                                       'delete_mod', 'missing', 'modified',
+                                       'skipped', 'conflict'])
+        # the converted stat cache is used
+        self.assertTrue(len(pkg._stat_cache.items()) > 0)
+        # converting twice is a no-op
+        convert_to_sqlite(path)
+        self.assertEqual(Package(path).statuses(), statuses)
+
+    @GET('http://localhost/source/prj/update_1?rev=latest',
+         file='update_1_files.xml')
+    @GET(('http://localhost/source/prj/update_1/foo'
+          '?rev=aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa'), file='update_1_foo')
+    def test_sqlite2(self):
+        """test update (sqlite wc)"""
+        path = self.fixture_file('update_1')
+        convert_to_sqlite(path)
+        pkg = Package(path)
+        pkg.update()
+        self._check_md5(path, 'foo', '50747782d12074c2c04ba7f90bf264c9')
+        self._check_md5(path, 'foo', '50747782d12074c2c04ba7f90bf264c9',
+                        data=True)
+        self._not_exists(path, 'foobar')
+        self._not_exists(path, '_transaction', store=True)
+        pkg = Package(path)
+        self.assertEqual(pkg.files(), ['foo', 'bar'])
+        self.assertEqual(pkg.status('foo'), ' ')
+        self.assertEqual(pkg.status('bar'), ' ')
+        self.assertEqual(pkg.status('foobar'), '?')
+
+    @GET('http://apiurl/source/prj/update_2?rev=latest',
+         file='commit_1_latest.xml')
+    @POST('http://apiurl/source/prj/update_2?cmd=commitfilelist',
+          exp_content_type='application/xml', expfile='commit_1_lfiles.xml',
+          file='commit_1_mfiles.xml')
+    @PUT('http://apiurl/source/prj/update_2/foo?rev=repository',
+         expfile='commit_1_foo', text=UPLOAD_REV)
+    @POST('http://apiurl/source/prj/update_2?cmd=commitfilelist',
+          exp_content_type='application/xml', expfile='commit_1_lfiles.xml',
+          file='commit_1_files.xml')
+    def test_sqlite3(self):
+        """test commit (sqlite wc)"""
+        path = self.fixture_file('update_2')
+        convert_to_sqlite(path)
+        pkg = Package(path)
+        self.assertEqual(pkg.status('foo'), 'M')
+        pkg.commit()
+        self._check_md5(path, 'foo', '90aa8a29ecd8d33e7b099c0f108c026b',
+                        data=True)
+        pkg = Package(path)
+        self.assertEqual(pkg.status('foo'), ' ')
+        self.assertEqual(pkg.status('bar'), ' ')
+        self.assertEqual(pkg.status('foobar'), ' ')
+
+    def test_sqlite4(self):
+        """test init, add, delete and revert (sqlite wc)"""
+        path = self.fixture_file('sqlite_init')
+        os.mkdir(path)
+        pkg = Package.init(path, 'prj', 'pkg', 'http://localhost',
+                           sqlite=True)
+        self.assertTrue(wc_is_sqlite(path))
+        with open(os.path.join(path, 'foo'), 'w') as f:
+            f.write('foo\n')
+        pkg.add('foo')
+        self.assertEqual(Package(path).status('foo'), 'A')
+        pkg.revert('foo')
+        self.assertEqual(Package(path).status('foo'), '?')
+
     @GET('http://localhost/source/prj/update_1?rev=latest',
          file='update_1_files.xml')
     @GET(('http://localhost/source/prj/update_1/foo'
@@ -411,6 +565,100 @@ class TestPackage(OscTest):
         self.assertEqual(pkg.status('bar'), ' ')
         self.assertEqual(pkg.status('foobar'), '?')
 
+    @GET('http://localhost/source/prj/update_1?rev=latest',
+         file='update_1_files.xml')
+    @GET(('http://localhost/source/prj/update_1/foo'
+          '?rev=aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa'), file='update_1_foo')
+    def test_update1_1(self):
+        """test update (hardlinked file is merged)"""
+        path = self.fixture_file('update_1')
+        wc_filename = os.path.join(path, 'foo')
+        os.unlink(wc_filename)
+        os.link(os.path.join(path, '.osc', 'data', 'foo'), wc_filename)
+        pkg = Package(path, hardlink=True)
+        pkg.update()
+        self._check_md5(path, 'foo', '50747782d12074c2c04ba7f90bf264c9')
+        self._check_md5(path, 'foo', '50747782d12074c2c04ba7f90bf264c9',
+                        data=True)
+        self.assertEqual(os.stat(wc_filename).st_nlink, 1)
+        self.assertEqual(pkg.status('foo'), ' ')
+
+    @GET('http://localhost/source/prj/update_1?rev=latest',
+         file='update_1_files.xml')
+    @GET('http://localhost/source/prj/update_1?rev=latest',
+         file='update_1_files.xml')
+    def test_update1_2(self):
+        """test update (reuse the files of an interrupted update)"""
+        path = self.fixture_file('update_1')
+        pkg = Package(path)
+        uinfo = pkg._calculate_updateinfo(revision='latest')
+        ustate = PackageUpdateState(path, uinfo=uinfo, **pkg.statuses())
+        shutil.copy(self.fixture_file('update_1_foo'),
+                    os.path.join(ustate.location, 'foo'))
+        # the interrupted update is rolled back but foo is kept
+        pkg = Package(path)
+        self._not_exists(path, '_transaction', store=True)
+        self._exists(path, 'partial', 'foo', store=True)
+        # no download is needed
+        pkg.update()
+        self._check_md5(path, 'foo', '50747782d12074c2c04ba7f90bf264c9')
+        self._check_md5(path, 'foo', '50747782d12074c2c04ba7f90bf264c9',
+                        data=True)
+        self._not_exists(path, 'partial', store=True)
+        self.assertEqual(pkg.status('foo'), ' ')
+        self.assertEqual(pkg.status('foobar'), '?')
+
+    @GET('http://localhost/source/prj/update_1?rev=latest',
+         file='update_1_files.xml')
+    @GET('http://localhost/source/prj/update_1?rev=latest',
+         file='update_1_files.xml')
+    @GET(('http://localhost/source/prj/update_1/foo'
+          '?rev=aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa'), file='update_1_foo')
+    def test_update1_3(self):
+        """test update (an incomplete file of an interrupted update)"""
+        path = self.fixture_file('update_1')
+        pkg = Package(path)
+        uinfo = pkg._calculate_updateinfo(revision='latest')
+        ustate = PackageUpdateState(path, uinfo=uinfo, **pkg.statuses())
+        with open(os.path.join(ustate.location, 'foo'), 'w') as f:
+            f.write('incomplete')
+        pkg = Package(path, finish_pending_transaction=False)
+        pkg.update()
+        self._check_md5(path, 'foo', '50747782d12074c2c04ba7f90bf264c9')
+        self._check_md5(path, 'foo', '50747782d12074c2c04ba7f90bf264c9',
+                        data=True)
+        self._not_exists(path, 'partial', store=True)
+        self._not_exists(path, '_transaction', store=True)
+
+    @GET('http://localhost/source/prj/update_1?rev=latest',
+         file='update_1_files.xml')
+    @GET(('http://localhost/source/prj/update_1/foo'
+          '?rev=aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa'), file='update_1_foo')
+    def test_update1_4(self):
+        """test update (batched storefile writes)"""
+        path = self.fixture_file('update_1')
+        files = os.path.join(path, '.osc', '_files')
+        with open(os.path.join(path, 'new'), 'w') as f:
+            f.write('new\n')
+        with wc_batch(path):
+            pkg = Package(path)
+            pkg.add('new')
+            with open(files, 'r') as f:
+                self.assertFalse('"new"' in f.read())
+            self.assertEqual(Package(path).status('new'), 'A')
+            pkg.update()
+            # the pending writes were flushed before the transaction
+            # was removed
+            with open(files, 'r') as f:
+                data = f.read()
+            self.assertTrue('"new"' in data)
+            self.assertTrue('50747782d12074c2c04ba7f90bf264c9' in data)
+        pkg = Package(path)
+        self.assertEqual(pkg.status('foo'), ' ')
+        self.assertEqual(pkg.status('new'), 'A')
+        self._check_md5(path, 'foo', '50747782d12074c2c04ba7f90bf264c9',
+                        data=True)
+
     @GET('http://apiurl/source/prj/update_2?rev=latest',
          file='update_2_files.xml')
     @GET(('http://apiurl/source/prj/update_2/foo'
@@ -437,6 +685,56 @@ class TestPackage(OscTest):
         self.assertEqual(pkg.status('bar'), ' ')
         self.assertEqual(pkg.status('foobar'), '?')
 
+    @GET('http://apiurl/source/prj/update_2?rev=latest',
+         file='update_2_files.xml')
+    @GET(('http://apiurl/source/prj/update_2/foo'
+          '?rev=aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa'), file='update_2_foo')
+    def test_update2_1(self):
+        """test update (conflict; in-process merge)"""
+        path = self.fixture_file('update_2')
+        pkg = Package(path, merge_class=PythonMerge)
+        self.assertEqual(pkg.status('foo'), 'M')
+        pkg.update()
+        self._check_md5(path, 'foo.mine', '90aa8a29ecd8d33e7b099c0f108c026b')
+        self._check_md5(path, 'foo', 'ab188d08913498abdd01479cbfd6814c',
+                        data=True)
+        self._check_md5(path, 'foo.revaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa',
+                        'ab188d08913498abdd01479cbfd6814c')
+        wc_filename = os.path.join(path, 'foo')
+        exp = ('<<<<<<< %s.mine\nThis is still a simple\n=======\n'
+               'This is no simple\n>>>>>>> %s\ntext file. With\na\n\n'
+               'newline.\n') % (wc_filename,
+                               os.path.join(path, '.osc', '_transaction',
+                                            'data', 'foo'))
+        self.assertEqual(open(wc_filename, 'r').read(), exp)
+        self._not_exists(path, '_transaction', store=True)
+        self.assertEqual(pkg.status('foo'), 'C')
+        self.assertEqual(pkg.status('bar'), ' ')
+
+    @GET('http://apiurl/source/prj/update_17?rev=latest',
+         file='update_17_files.xml')
+    @GET(('http://apiurl/source/prj/update_17/foo'
+          '?rev=bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb'), file='update_17_foo')
+    @GET(('http://apiurl/source/prj/update_17/bar'
+          '?rev=bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb'), file='update_17_bar')
+    def test_update17(self):
+        """test update (merge files concurrently)"""
+        path = self.fixture_file('update_17')
+        pkg = Package(path, merge_class=PythonMerge, merge_jobs=2)
+        self.assertEqual(pkg.status('foo'), 'M')
+        self.assertEqual(pkg.status('bar'), ' ')
+        pkg.update()
+        self._check_md5(path, 'foo', 'ff6e887f45902334fb8b2f77fcade287')
+        self._check_md5(path, 'foo', '1ec58591879899792f487faf61e97435',
+                        data=True)
+        self._check_md5(path, 'bar', 'e13bbceccf0fd682738b2399d7fcfef6')
+        self._check_md5(path, 'bar', 'e13bbceccf0fd682738b2399d7fcfef6',
+                        data=True)
+        self._not_exists(path, 'foo.mine')
+        self._not_exists(path, '_transaction', store=True)
+        self.assertEqual(pkg.status('foo'), 'M')
+        self.assertEqual(pkg.status('bar'), ' ')
+
     @GET('http://localhost/source/prj/update_3?rev=latest',
          file='update_3_files.xml')
     @GET(('http://localhost/source/prj/update_3/foo'
@@ -819,6 +1117,106 @@ class TestPackage(OscTest):
         self.assertRaises(ValueError, pkg.resolved, 'file1')
         self.assertEqual(pkg.status('file1'), ' ')
 
+    @GET('http://localhost/source/prj/update_6?rev=latest',
+         file='update_6_files.xml')
+    @GET('http://localhost/source/prj/update_6/foo'
+         '?rev=aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa',
+         file=os.path.join('update_6', '.osc', 'data', 'foo'))
+    @GET('http://localhost/source/prj/update_6/bar'
+         '?rev=aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa',
+         file=os.path.join('update_6', '.osc', 'data', 'bar'))
+    @GET('http://localhost/source/prj/update_6/added'
+         '?rev=aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa', file='update_6_added')
+    def test_sparse1(self):
+        """test sparse checkout and materialize"""
+        path = os.path.join(self._tmp_dir, 'sparse')
+        pkg = Package.init(path, 'prj', 'update_6', 'http://localhost',
+                           sparse=['a*'])
+        self.assertEqual(pkg.sparse, ['a*'])
+        pkg.update()
+        self.assertEqual(pkg.statuses(), {'foo': ' ', 'bar': ' ',
+                                          'added': 'S', 'asdf': 'S'})
+        self._check_md5(path, 'foo', '0e04f7f7fa4ec3fbbb907ebbe4dc9bc4',
+                        data=True)
+        self._not_exists(path, 'added')
+        self._not_exists(path, 'added', data=True)
+        self._not_exists(path, 'asdf')
+        # only skipped files can be materialized
+        self.assertRaises(ValueError, pkg.materialize, 'foo')
+        pkg.materialize('added')
+        self.assertEqual(pkg.status('added'), ' ')
+        self._check_md5(path, 'added', '0e80600e984f2fdf3b341ebdea0b44ee')
+        self._check_md5(path, 'added', '0e80600e984f2fdf3b341ebdea0b44ee',
+                        data=True)
+        st = os.stat(os.path.join(path, 'added'))
+        self.assertEqual(st.st_mtime, 1311547954)
+        pkg = Package(path)
+        self.assertEqual(pkg.sparse, ['a*'])
+        self.assertEqual(pkg.status('added'), ' ')
+        self.assertEqual(pkg.status('asdf'), 'S')
+
+    @GET('http://localhost/source/prj/update_6?rev=latest',
+         file='update_6_files.xml')
+    @GET('http://localhost/source/prj/update_6/foo'
+         '?rev=aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa',
+         file=os.path.join('update_6', '.osc', 'data', 'foo'))
+    @GET('http://localhost/source/prj/update_6/bar'
+         '?rev=aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa',
+         file=os.path.join('update_6', '.osc', 'data', 'bar'))
+    @GET('http://localhost/source/prj/update_6/asdf'
+         '?rev=aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa', text='corrupt')
+    def test_sparse2(self):
+        """test materialize (existing file and md5 mismatch)"""
+        path = os.path.join(self._tmp_dir, 'sparse')
+        pkg = Package.init(path, 'prj', 'update_6', 'http://localhost',
+                           sparse=['a*'])
+        pkg.update()
+        with open(os.path.join(path, 'added'), 'w') as f:
+            f.write('local file')
+        self.assertRaises(ValueError, pkg.materialize, 'added')
+        self.assertEqual(pkg.status('added'), 'S')
+        os.unlink(os.path.join(path, 'added'))
+        self.assertRaises(ValueError, pkg.materialize, 'asdf')
+        self.assertEqual(pkg.status('asdf'), 'S')
+        self._not_exists(path, 'asdf')
+        self._not_exists(path, 'asdf', data=True)
+
+    @GET('http://localhost/source/prj/update_6?rev=latest',
+         file='update_6_files.xml')
+    @GET('http://localhost/source/prj/update_6/foo'
+         '?rev=aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa',
+         file=os.path.join('update_6', '.osc', 'data', 'foo'))
+    @GET('http://localhost/source/prj/update_6/bar'
+         '?rev=aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa',
+         file=os.path.join('update_6', '.osc', 'data', 'bar'))
+    @GET('http://localhost/source/prj/update_6?rev=latest',
+         file='update_6_files.xml')
+    @POST('http://localhost/source/prj/update_6?cmd=commitfilelist',
+          exp_content_type='application/xml', expfile='sparse_3_lfiles.xml',
+          file='sparse_3_mfiles.xml')
+    @PUT('http://localhost/source/prj/update_6/foo?rev=repository',
+         expfile='sparse_3_foo', text=UPLOAD_REV)
+    @POST('http://localhost/source/prj/update_6?cmd=commitfilelist',
+          exp_content_type='application/xml', expfile='sparse_3_lfiles.xml',
+          file='sparse_3_files.xml')
+    def test_sparse3(self):
+        """test commit (sparse checkout)"""
+        path = os.path.join(self._tmp_dir, 'sparse')
+        pkg = Package.init(path, 'prj', 'update_6', 'http://localhost',
+                           sparse=['a*'])
+        pkg.update()
+        with open(os.path.join(path, 'foo'), 'w') as f:
+            f.write('sparse foo\nmodified\n')
+        pkg.commit()
+        self.assertEqual(pkg.statuses(), {'foo': ' ', 'bar': ' ',
+                                          'added': 'S', 'asdf': 'S'})
+        self._check_md5(path, 'foo', '7d1ae94948a801fb012d8ba47356d6fe',
+                        data=True)
+        self._not_exists(path, 'added')
+        self._not_exists(path, 'added', data=True)
+        self.assertEqual(pkg._files.revision_data()['srcmd5'],
+                         'bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb')
+
     def test_revert1(self):
         """test revert"""
         path = self.fixture_file('status1_no_conflict')
@@ -905,6 +1303,21 @@ class TestPackage(OscTest):
         self.assertEqual(pkg.status('delete_mod'), 'M')
         self.assertEqual(pkg.status('delete'), ' ')
 
+    def test_revert8(self):
+        """revert files (hardlink mode)"""
+        path = self.fixture_file('status1_no_conflict')
+        pkg = Package(path, hardlink=True)
+        self.assertEqual(pkg.status('modified'), 'M')
+        self.assertEqual(pkg.status('missing'), '!')
+        pkg.revert('modified', 'missing')
+        for filename in ('modified', 'missing'):
+            self.assertEqual(pkg.status(filename), ' ')
+            st = os.stat(os.path.join(path, filename))
+            data_st = os.stat(os.path.join(path, '.osc', 'data', filename))
+            self.assertEqual(st.st_ino, data_st.st_ino)
+            # the file has to be replaced instead of modified in place
+            self.assertEqual(stat.S_IMODE(st.st_mode), 0444)
+
     def test_add1(self):
         """test add"""
         path = self.fixture_file('status1_no_conflict')
@@ -1210,6 +1623,30 @@ class TestPackage(OscTest):
         self.assertEqual(pkg.status('bar'), ' ')
         self.assertEqual(pkg.status('foobar'), ' ')
 
+    @GET('http://apiurl/source/prj/update_2?rev=latest',
+         file='commit_1_latest.xml')
+    @POST('http://apiurl/source/prj/update_2?cmd=commitfilelist',
+          exp_content_type='application/xml', expfile='commit_1_lfiles.xml',
+          file='commit_1_mfiles.xml')
+    @PUT('http://apiurl/source/prj/update_2/foo?rev=repository',
+         expfile='commit_1_foo', text='<status code="error"/>', code=503)
+    @PUT('http://apiurl/source/prj/update_2/foo?rev=repository',
+         expfile='commit_1_foo', text=UPLOAD_REV)
+    @POST('http://apiurl/source/prj/update_2?cmd=commitfilelist',
+          exp_content_type='application/xml', expfile='commit_1_lfiles.xml',
+          file='commit_1_files.xml')
+    def test_commit1_1(self):
+        """test commit (retry a failed upload)"""
+        path = self.fixture_file('update_2')
+        tl = TL()
+        pkg = Package(path, transaction_listener=[tl], transfer_retries=1)
+        self.assertEqual(pkg.status('foo'), 'M')
+        pkg.commit()
+        self._check_md5(path, 'foo', '90aa8a29ecd8d33e7b099c0f108c026b',
+                        data=True)
+        self.assertEqual(pkg.status('foo'), ' ')
+        self.assertEqual(tl._transfer, [('upload', 'foo')])
+
     @GET('http://localhost/source/prj/update_11?rev=latest',
          file='commit_2_latest.xml')
     @POST('http://localhost/source/prj/update_11?cmd=commitfilelist',
@@ -1678,6 +2115,166 @@ class TestPackage(OscTest):
         self.assertEqual(d.missing, ['missing'])
         self.assertEqual(d.skipped, ['skipped'])
 
+    def test_diff13(self):
+        """test diff (concurrently; large files are streamed)"""
+        path = self.fixture_file('status1')
+        ud = UD()
+        pkg = Package(path)
+        pkg.diff(ud)
+        ud.diff()
+        exp = ud.diff_data
+
+        class StreamingUD(UnifiedDiff):
+            def __init__(self, *args, **kwargs):
+                super(StreamingUD, self).__init__(*args, **kwargs)
+                self.calls = []
+
+            def process(self, data):
+                self.calls.append(''.join(data))
+
+        ud = StreamingUD(jobs=2)
+        pkg.diff(ud)
+        ud.diff()
+        self.assertEqual(''.join(ud.calls), exp)
+        calls = len(ud.calls)
+        # every text file is larger than 1 byte
+        ud = StreamingUD(jobs=2, max_size=1)
+        pkg.diff(ud)
+        ud.diff()
+        self.assertEqual(''.join(ud.calls), exp)
+        self.assertTrue(len(ud.calls) > calls)
+
+    def test_diff18(self):
+        """test diff (a diff is processed before the next one is computed)"""
+        path = self.fixture_file('status1')
+        pkg = Package(path)
+
+        class RecordingUD(UnifiedDiff):
+            def __init__(self, *args, **kwargs):
+                super(RecordingUD, self).__init__(*args, **kwargs)
+                self.events = []
+
+            def _diff_modified_file(self, filename):
+                self.events.append(filename)
+                return super(RecordingUD, self)._diff_modified_file(filename)
+
+            def process(self, data):
+                self.events.append(None)
+
+        ud = RecordingUD()
+        pkg.diff(ud)
+        self.assertEqual(ud.modified, ['modified', 'conflict'])
+        ud.diff()
+        events = ud.events[ud.events.index('modified'):]
+        self.assertEqual(events[:3], ['modified', None, 'conflict'])
+
+    @GET('http://localhost/source/foo/status1?rev=77',
+         file='status1_list2.xml')
+    def test_diff14(self):
+        """test diff (remote revision; same md5 is not diffed)"""
+        path = self.fixture_file('status1')
+        with open(os.path.join(path, 'added'), 'w') as f:
+            f.write(open(self.fixture_file('status1_added')).read())
+        ud = UD()
+        pkg = Package(path)
+        pkg.diff(ud, 'added', revision='77')
+        self.assertEqual(ud.modified, ['added'])
+        ud.diff()
+        # no file was downloaded
+        self.assertEqual(ud.diff_data, '')
+        ud.cleanup()
+
+    @GET('http://localhost/source/foo/status1?rev=77',
+         file='status1_list2.xml')
+    @GET(('http://localhost/source/foo/status1/added'
+          '?rev=bbbbaaaaaaaaaaaaaaaaaaaaaaaaaaaa'), file='status1_added')
+    @GET('http://localhost/source/foo/status1?rev=77',
+         file='status1_list2.xml')
+    def test_diff15(self):
+        """test diff (remote revision; downloaded files are cached)"""
+        path = self.fixture_file('status1')
+        pkg = Package(path)
+        ud = UD()
+        ud.cache_size = 1024
+        pkg.diff(ud, 'added', revision='77')
+        ud.diff()
+        diff_data = ud.diff_data
+        ud.cleanup()
+        self._exists(path, 'diff', 'bbbbaaaaaaaaaaaaaaaaaaaaaaaaaaaa',
+                     store=True)
+        # the cached file is not downloaded again
+        ud = UD()
+        pkg.diff(ud, 'added', revision='77')
+        ud.diff()
+        self.assertEqual(ud.diff_data, diff_data)
+        self.assertEqual(pkg.prune_diff_cache(),
+                         ['bbbbaaaaaaaaaaaaaaaaaaaaaaaaaaaa'])
+        self._not_exists(path, 'diff', store=True)
+
+    @GET('http://localhost/source/foo/status1?rev=78',
+         file='status1_list3.xml')
+    def test_diff16(self):
+        """test diff (remote revision; a storefile with the md5 is reused)"""
+        path = self.fixture_file('status1')
+        pkg = Package(path)
+        ud = UD()
+        pkg.diff(ud, 'delete', revision='78')
+        self.assertEqual(ud.deleted, ['delete'])
+        ud.diff()
+        self.assertEqualFile(ud.diff_data, 'diff_16')
+        ud.cleanup()
+        self._not_exists(path, 'diff', store=True)
+
+    @GET('http://localhost/source/foo/status1?rev=77',
+         file='status1_list2.xml')
+    @GET(('http://localhost/source/foo/status1/added'
+          '?rev=bbbbaaaaaaaaaaaaaaaaaaaaaaaaaaaa'), file='status1_added')
+    def test_diff17(self):
+        """test diff (remote revision; an incomplete cached file is ignored)"""
+        path = self.fixture_file('status1')
+        cache_dir = os.path.join(path, '.osc', 'diff',
+                                 'bbbbaaaaaaaaaaaaaaaaaaaaaaaaaaaa')
+        os.makedirs(cache_dir)
+        cached = os.path.join(cache_dir, 'added')
+        with open(cached, 'w') as f:
+            f.write('trunc')
+        pkg = Package(path)
+        ud = UD()
+        ud.cache_size = 1024
+        pkg.diff(ud, 'added', revision='77')
+        ud.diff()
+        ud.cleanup()
+        self.assertEqual(open(cached, 'r').read(),
+                         open(self.fixture_file('status1_added'), 'r').read())
+
+    @GET('http://localhost/source/foo/status1?rev=77',
+         file='status1_list2.xml')
+    def test_diff19(self):
+        """test diff (remote revision; a cached file is verified once)"""
+        path = self.fixture_file('status1')
+        cache_dir = os.path.join(path, '.osc', 'diff',
+                                 'bbbbaaaaaaaaaaaaaaaaaaaaaaaaaaaa')
+        os.makedirs(cache_dir)
+        cached = os.path.join(cache_dir, 'added')
+        shutil.copyfile(self.fixture_file('status1_added'), cached)
+        pkg = Package(path)
+        ud = UD()
+        ud.cache_size = 1024
+        pkg.diff(ud, 'added', revision='77')
+        calls = []
+
+        def counting_file_md5(filename):
+            calls.append(filename)
+            return file_md5(filename)
+        osc2.wc.package.file_md5 = counting_file_md5
+        try:
+            for i in range(3):
+                self.assertEqual(ud.old_filename('added'), cached)
+        finally:
+            osc2.wc.package.file_md5 = file_md5
+        self.assertEqual(calls, [cached])
+        ud.cleanup()
+
     def test_repair1(self):
         """test repair (_package missing)"""
         path = self.fixture_file('inv_foo1')
@@ -1753,5 +2350,29 @@ class TestPackage(OscTest):
         self.assertEqual(Package.wc_check(path), ([], '', []))
         self._exists(path, '.osc')
 
+    @GET(('http://localhost/source/prj/inv_foo2/file'
+          '?rev=aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa'), file='inv_foo2_file')
+    @GET(('http://localhost/source/prj/inv_foo2/file'
+          '?rev=aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa'), file='inv_foo2_file')
+    def test_repair6(self):
+        """test repair (hardlinked storefile modified in place)"""
+        path = self.fixture_file('inv_foo2')
+        Package.repair(path)
+        wc_filename = os.path.join(path, 'file')
+        data_filename = os.path.join(path, '.osc', 'data', 'file')
+        os.unlink(wc_filename)
+        os.link(data_filename, wc_filename)
+        self.assertEqual(Package.wc_check(path), ([], '', []))
+        with open(wc_filename, 'a') as f:
+            f.write('changed\n')
+        self.assertRaises(WCInconsistentError, Package, path)
+        self.assertEqual(Package.wc_check(path), ([], '', ['file']))
+        Package.repair(path)
+        self.assertEqual(Package.wc_check(path), ([], '', []))
+        # the modified wc file is kept
+        self.assertTrue(open(wc_filename, 'r').read().endswith('changed\n'))
+        self.assertNotEqual(os.stat(wc_filename).st_ino,
+                            os.stat(data_filename).st_ino)
+
 if __name__ == '__main__':
     unittest.main()
@@ -110,6 +110,21 @@ class TestProject(OscTest):
         self.assertEqual(prj.apiurl, 'http://apiurl')
         self.assertTrue(len(prj.packages()) == 2)
 
+    def test3_1(self):
+        """test package (Package objects are cached)"""
+        path = self.fixture_file('prj2')
+        prj = Project(path)
+        pkg = prj.package('foo')
+        self.assertIs(prj.package('foo'), pkg)
+        self.assertIsNot(prj.package('foo', transaction_listener=[]), pkg)
+        # the object which was created with arguments is not cached
+        pkg = prj.package('foo')
+        self.assertIs(prj.package('foo'), pkg)
+        self.assertIsNone(prj.package('xxx'))
+        # methods which modify the wc invalidate the cache
+        prj.revert('foo')
+        self.assertIsNot(prj.package('foo'), pkg)
+
     def test4(self):
         """read invalid project (missing _project)"""
         path = self.fixture_file('inv1')
@@ -343,7 +358,8 @@ class TestProject(OscTest):
         self.assertEqual(prj._status('foo'), ' ')
         self._not_exists(path, '.osc', '_transaction')
 
-    @GET('http://localhost/source/prj2', file='prj2_list3.xml')
+    @GET('http://localhost/source/prj2?view=info',
+         text='<sourceinfolist/>')
     def test_update2(self):
         """test update (delete package; local state 'D')"""
         path = self.fixture_file('prj2')
@@ -362,7 +378,8 @@ class TestProject(OscTest):
         self._not_exists(path, 'abc', '.osc')
         self._not_exists(path, '.osc', 'data', 'abc')
 
-    @GET('http://localhost/source/prj2', file='prj2_list3.xml')
+    @GET('http://localhost/source/prj2?view=info',
+         text='<sourceinfolist/>')
     def test_update3(self):
         """test update (delete package; local state '!')"""
         path = self.fixture_file('prj2')
@@ -372,7 +389,8 @@ class TestProject(OscTest):
         self.assertEqual(prj._status('xxx'), '?')
         self._not_exists(path, '.osc', 'data', 'xxx')
 
-    @GET('http://localhost/source/prj2', file='prj2_list3.xml')
+    @GET('http://localhost/source/prj2?view=info',
+         text='<sourceinfolist/>')
     def test_update4(self):
         """test update (delete package: local state ' ')"""
         path = self.fixture_file('prj2')
@@ -397,8 +415,8 @@ class TestProject(OscTest):
         self.assertEqual(tl._processed['file'], (None, ' '))
         self.assertEqual(tl._processed['foo'], (None, ' '))
 
-    @GET('http://apiurl/source/prj1', file='prj1_list.xml')
-    @GET('http://apiurl/source/prj1', file='prj1_list.xml')
+    @GET('http://apiurl/source/prj1?view=info', file='prj1_sourceinfo.xml')
+    @GET('http://apiurl/source/prj1?view=info', file='prj1_sourceinfo.xml')
     @GET('http://apiurl/source/prj1/foo?rev=latest', file='foo_list2.xml')
     @GET(('http://apiurl/source/prj1/foo/file'
           '?rev=aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaf'), file='foo_file')
@@ -457,7 +475,8 @@ class TestProject(OscTest):
         self._exists(path, 'foo', 'file')
         self._exists(path, '.osc', 'data', 'foo')
 
-    @GET('http://localhost/source/prj3', file='prj2_list3.xml')
+    @GET('http://localhost/source/prj3?view=info',
+         text='<sourceinfolist/>')
     def test_update8(self):
         """test update (package with a conflicted file)"""
         path = self.fixture_file('prj3')
@@ -471,7 +490,7 @@ class TestProject(OscTest):
         pkg = prj.package('conflict')
         self.assertEqual(pkg.status('conflict'), 'C')
 
-    @GET('http://localhost/source/prj2', file='prj2_list4.xml')
+    @GET('http://localhost/source/prj2?view=info', file='prj2_sourceinfo1.xml')
     @GET('http://localhost/source/prj2/add?rev=latest', file='add_list1.xml')
     @GET(('http://localhost/source/prj2/add/file'
           '?rev=daaaaaaaaaaaaaaaaaaaaaaaaaaaaaaf'), file='foo_file')
@@ -517,6 +536,72 @@ class TestProject(OscTest):
         self.assertEqual(tl._processed['update:modified'], (None, 'D'))
         self.assertEqual(tl._processed['prj_update:abc'], (None, 'D'))
 
+    @GET('http://localhost/source/prj2?view=info', file='prj2_sourceinfo3.xml')
+    @GET('http://localhost/source/prj2/add?rev=latest', file='add_list1.xml',
+         unordered=True)
+    @GET(('http://localhost/source/prj2/add/file'
+          '?rev=daaaaaaaaaaaaaaaaaaaaaaaaaaaaaaf'), file='foo_file',
+         unordered=True)
+    @GET('http://localhost/source/prj2/add2?rev=latest',
+         file='add2_list1.xml', unordered=True)
+    @GET(('http://localhost/source/prj2/add2/file'
+          '?rev=eaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaf'), file='foo_file',
+         unordered=True)
+    def test_update9_1(self):
+        """test update (add packages concurrently)"""
+        path = self.fixture_file('prj2')
+        tl = ProjectTL()
+        prj = Project(path, transaction_listener=[tl])
+        self.assertEqual(prj._status('add'), '?')
+        self.assertEqual(prj._status('add2'), '?')
+        prj.update('add', 'add2', jobs=2)
+        self.assertEqual(prj._status('add'), ' ')
+        self.assertEqual(prj._status('add2'), ' ')
+        self._exists(path, 'add', 'file')
+        self._exists(path, 'add2', 'file')
+        self._exists(path, '.osc', 'data', 'add2')
+        self._not_exists(path, '.osc', '_transaction')
+        # the notifications of the packages do not interleave
+        self.assertEqual(tl._begin, ['prj_update', 'update', 'update'])
+        self.assertEqual(tl._finished, ['update', 'update', 'prj_update'])
+        self.assertEqual(tl._transfer, [('download', 'file'),
+                                        ('download', 'file')])
+        self.assertEqual(tl._processed['update:file'], (' ', None))
+        self.assertEqual(tl._processed['prj_update:add'], (' ', None))
+        self.assertEqual(tl._processed['prj_update:add2'], (' ', None))
+
+    @GET('http://localhost/source/prj2?view=info', file='prj2_sourceinfo2.xml')
+    def test_update9_2(self):
+        """test _unchanged_candidates"""
+        path = self.fixture_file('prj2')
+        prj = Project(path)
+        sourceinfo = prj._remote_sourceinfo()
+        uinfo = prj._calculate_updateinfo('foo', 'foo_modified',
+                                          sourceinfo=sourceinfo)
+        self.assertEqual(uinfo.candidates, ['foo', 'foo_modified'])
+        # the lsrcmd5 of foo_modified differs
+        self.assertEqual(prj._unchanged_candidates(uinfo, sourceinfo),
+                         ['foo'])
+        self.assertEqual(prj._unchanged_candidates(uinfo, sourceinfo,
+                                                   expand=True),
+                         ['foo', 'foo_modified'])
+        # no source info if other parameters are specified
+        self.assertIsNone(prj._remote_sourceinfo(revision='3'))
+        self.assertIsNone(prj._remote_sourceinfo(foo='bar'))
+
+    @GET('http://localhost/source/prj2?view=info', file='prj2_sourceinfo2.xml')
+    def test_update9_3(self):
+        """test update (skip unchanged packages)"""
+        path = self.fixture_file('prj2')
+        tl = ProjectTL()
+        prj = Project(path, transaction_listener=[tl])
+        prj.update('foo', 'foo_modified', expand='1')
+        self.assertEqual(prj._status('foo'), ' ')
+        self.assertEqual(prj._status('foo_modified'), ' ')
+        self.assertEqual(tl._begin, ['prj_update'])
+        self.assertEqual(tl._processed, {})
+        self._not_exists(path, '.osc', '_transaction')
+
     @GET('http://localhost/source/prj2', file='prj2_list2.xml')
     @GET('http://localhost/source/prj2/foo?foo=bar&rev=latest',
          file='foo_list1.xml')
@@ -550,6 +635,56 @@ class TestProject(OscTest):
         self.assertEqual(ustate.state, UpdateStateMixin.STATE_PREPARE)
         self.assertEqual(ustate.entrystates['foo'], ' ')
 
+    def test_update_journal1(self):
+        """test that processed entries are journaled"""
+        path = self.fixture_file('prj1_update_state_prepare')
+        ustate = ProjectUpdateState.read_state(path)
+        ustate.processed('foo', ' ')
+        self._exists(path, '.osc', '_transaction', 'journal')
+        ustate = ProjectUpdateState.read_state(path)
+        self.assertEqual(ustate.state, UpdateStateMixin.STATE_PREPARE)
+        self.assertEqual(ustate.entrystates['foo'], ' ')
+        self.assertEqual(ustate.info.added, [])
+        # replaying an already processed entry is a no-op
+        ustate.state = UpdateStateMixin.STATE_UPDATING
+        ustate._write()
+        self._not_exists(path, '.osc', '_transaction', 'journal')
+        fname = self.fixture_file('prj1_update_state_prepare', '.osc',
+                                  '_transaction', 'journal')
+        with open(fname, 'w') as f:
+            f.write('["processed", "foo", " "]\n')
+        ustate = ProjectUpdateState.read_state(path)
+        self.assertEqual(ustate.state, UpdateStateMixin.STATE_UPDATING)
+        self.assertEqual(ustate.entrystates['foo'], ' ')
+
+    def test_update_journal2(self):
+        """test that an incomplete record is ignored"""
+        path = self.fixture_file('prj1_update_state_prepare')
+        ustate = ProjectUpdateState.read_state(path)
+        ustate.state = UpdateStateMixin.STATE_UPDATING
+        fname = self.fixture_file('prj1_update_state_prepare', '.osc',
+                                  '_transaction', 'journal')
+        with open(fname, 'a') as f:
+            f.write('["processed", "fo')
+        ustate = ProjectUpdateState.read_state(path)
+        self.assertEqual(ustate.state, UpdateStateMixin.STATE_UPDATING)
+        self.assertEqual(ustate.info.added, ['foo'])
+        self.assertEqual(ustate.entrystates.get('foo'), None)
+
+    def test_update_journal3(self):
+        """test the compaction of the journal"""
+        path = self.fixture_file('prj1_update_state_prepare')
+        ustate = ProjectUpdateState.read_state(path)
+        # a processed call appends two records (see ProjectUpdateState)
+        ustate.JOURNAL_COMPACT_RECORDS = 3
+        ustate.state = UpdateStateMixin.STATE_UPDATING
+        self._exists(path, '.osc', '_transaction', 'journal')
+        ustate.processed('foo', ' ')
+        self._not_exists(path, '.osc', '_transaction', 'journal')
+        ustate = ProjectUpdateState.read_state(path)
+        self.assertEqual(ustate.state, UpdateStateMixin.STATE_PREPARE)
+        self.assertEqual(ustate.entrystates['foo'], ' ')
+
     def test_commitinfo1(self):
         """test commitinfo (complete project)"""
         path = self.fixture_file('prj2')
@@ -682,6 +817,62 @@ class TestProject(OscTest):
         prj.commit('abc')
         self.assertEqual(prj._status('abc'), '?')
 
+    @GET('http://localhost/source/prj2/foo_modified?rev=latest',
+         file='commit_1_latest.xml', unordered=True)
+    @POST('http://localhost/source/prj2/foo_modified?cmd=commitfilelist',
+          expfile='commit_1_lfiles.xml', file='commit_1_mfiles.xml',
+          unordered=True)
+    @PUT('http://localhost/source/prj2/foo_modified/add?rev=repository',
+         expfile='commit_1_add', text=UPLOAD_REV, unordered=True)
+    @PUT('http://localhost/source/prj2/foo_modified/file?rev=repository',
+         expfile='commit_1_file', text=UPLOAD_REV, unordered=True)
+    @POST('http://localhost/source/prj2/foo_modified?cmd=commitfilelist',
+          expfile='commit_1_lfiles.xml', file='commit_1_files.xml',
+          unordered=True)
+    @GET('http://localhost/source/prj2/foo_modified2?rev=latest',
+         file='commit_1_latest.xml', unordered=True)
+    @POST('http://localhost/source/prj2/foo_modified2?cmd=commitfilelist',
+          expfile='commit_1_lfiles.xml', file='commit_1_mfiles.xml',
+          unordered=True)
+    @PUT('http://localhost/source/prj2/foo_modified2/add?rev=repository',
+         expfile='commit_1_add', text=UPLOAD_REV, unordered=True)
+    @PUT('http://localhost/source/prj2/foo_modified2/file?rev=repository',
+         expfile='commit_1_file', text=UPLOAD_REV, unordered=True)
+    @POST('http://localhost/source/prj2/foo_modified2?cmd=commitfilelist',
+          expfile='commit_1_lfiles.xml', file='commit_1_files.xml',
+          unordered=True)
+    def test_commit5_1(self):
+        """test commit (commit packages concurrently)"""
+        path = self.fixture_file('prj2_commit_concurrent')
+        tl = ProjectTL()
+        prj = Project(path, transaction_listener=[tl])
+        prj.commit('foo_modified', 'foo_modified2', jobs=2)
+        for package in ('foo_modified', 'foo_modified2'):
+            pkg = prj.package(package)
+            self.assertEqual(pkg.status('file'), ' ')
+            self.assertEqual(pkg.status('add'), ' ')
+        self.assertEqual(tl._begin, ['prj_commit', 'commit', 'commit'])
+        self.assertEqual(tl._finished, ['commit', 'commit', 'prj_commit'])
+        self.assertEqual(tl._processed['prj_commit:foo_modified'],
+                         (' ', ' '))
+        self.assertEqual(tl._processed['prj_commit:foo_modified2'],
+                         (' ', ' '))
+        self._not_exists(path, '.osc', '_transaction')
+
+    def test_commit5_2(self):
+        """test commit (finish an interrupted concurrent commit)"""
+        # foo was committed, the commit of foo_modified was not started
+        path = self.fixture_file('prj2_commit_resume2')
+        tl = TL()
+        prj = Project(path, finish_pending_transaction=False,
+                      transaction_listener=[tl])
+        prj.commit()
+        self.assertEqual(tl._processed, {'foo': (' ', ' ')})
+        self.assertEqual(prj._status('foo_modified'), ' ')
+        pkg = prj.package('foo_modified')
+        self.assertEqual(pkg.status('file'), 'M')
+        self._not_exists(path, '.osc', '_transaction')
+
     def test_commit6(self):
         """test commit (package with a conflicted file)"""
         path = self.fixture_file('prj3')
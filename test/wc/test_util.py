@@ -1,11 +1,20 @@
 import os
+import time
+import fcntl
+import threading
 import unittest
 
 from test.osctest import OscTest
+import osc2.wc.util
 from osc2.util.io import mkdtemp
 from osc2.wc.util import (WCFormatVersionError, wc_is_project, wc_is_package,
                           wc_read_project, wc_read_package, wc_read_apiurl,
-                          WCLock, wc_parent, wc_init)
+                          WCLock, wc_lock, wc_parent, wc_init, WCStatCache,
+                          wc_read_packages, wc_diff_mkdir, wc_diff_prune,
+                          wc_diff_revisions, wc_read_sparse, wc_write_sparse,
+                          wc_is_sqlite, wc_read_files, wc_write_files,
+                          SQLiteFileTracker, missing_storepaths, wc_batch,
+                          wc_write_project, WCDatabase)
 
 
 def suite():
@@ -17,6 +26,14 @@ class TestWCUtil(OscTest):
         kwargs['fixtures_dir'] = os.path.join('wc', 'test_util_fixtures')
         super(TestWCUtil, self).__init__(*args, **kwargs)
 
+    def setUp(self):
+        super(TestWCUtil, self).setUp()
+        self._time = osc2.wc.util.time
+
+    def tearDown(self):
+        osc2.wc.util.time = self._time
+        super(TestWCUtil, self).tearDown()
+
     def test1(self):
         """test wc_is_project"""
         path = self.fixture_file('project')
@@ -134,6 +151,162 @@ class TestWCUtil(OscTest):
         wc.unlock()
         self.assertFalse(os.path.exists(lock))
 
+    def test_lock6(self):
+        """test WCLock class (nested locks)"""
+        path = self.fixture_file('lock')
+        lock = os.path.join(path, '.osc', 'wc.lock')
+        outer = WCLock(path, shared=True)
+        outer.lock()
+        with wc_lock(path, shared=True):
+            self.assertTrue(self._child_lock(path, shared=True))
+        self.assertTrue(os.path.isfile(lock))
+        # the shared lock is converted into an exclusive lock
+        with wc_lock(path):
+            self.assertFalse(self._child_lock(path, shared=True))
+        self.assertFalse(self._child_lock(path, shared=True))
+        outer.unlock()
+        self.assertFalse(os.path.exists(lock))
+        self.assertTrue(self._child_lock(path, shared=False))
+
+    def test_batch1(self):
+        """coalesce the storefile writes"""
+        path = self.fixture_file('package')
+        project = os.path.join(path, '.osc', '_project')
+        with wc_batch(path) as batch:
+            self.assertFalse(self._child_lock(path, shared=True))
+            wc_write_project(path, 'prj1')
+            wc_write_project(path, 'prj2')
+            self.assertEqual(wc_read_project(path), 'prj2')
+            with open(project, 'r') as f:
+                self.assertEqual(f.read(), 'foobar\n')
+            # a new storefile
+            self.assertEqual(missing_storepaths(path, '_sparse'),
+                             ['_sparse'])
+            wc_write_sparse(path, ['foo'])
+            self.assertEqual(missing_storepaths(path, '_sparse'), [])
+            self._not_exists(path, '_sparse', store=True)
+            batch.flush()
+            self._exists(path, '_sparse', store=True)
+            wc_write_project(path, 'prj3')
+        with open(project, 'r') as f:
+            self.assertEqual(f.read(), 'prj3\n')
+        self.assertEqual(wc_read_project(path), 'prj3')
+        self.assertEqual(wc_read_sparse(path), ['foo'])
+        self._not_exists(path, 'wc.lock', store=True)
+
+    def test_batch2(self):
+        """flush the storefile writes (fsync and exception)"""
+        path = self.fixture_file('package')
+        with wc_batch(path, fsync=True):
+            wc_write_project(path, 'prj')
+        self.assertEqual(wc_read_project(path), 'prj')
+        try:
+            with wc_batch(path):
+                wc_write_project(path, 'other')
+                raise ValueError()
+        except ValueError:
+            pass
+        # the change was already performed
+        self.assertEqual(wc_read_project(path), 'other')
+        # the storefiles of other wcs are not covered
+        other = self.fixture_file('prj1')
+        with wc_batch(path):
+            wc_write_project(other, 'prj')
+            self.assertEqual(wc_read_project(other), 'prj')
+            with open(os.path.join(other, '.osc', '_project'), 'r') as f:
+                self.assertEqual(f.read(), 'prj\n')
+
+    def _child_lock(self, path, shared):
+        """Return True if a child process could acquire the lock."""
+        pid = os.fork()
+        if not pid:
+            status = 1
+            try:
+                with open(os.path.join(path, '.osc', 'wc.lock'), 'a+') as f:
+                    mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+                    fcntl.lockf(f, mode | fcntl.LOCK_NB)
+                    status = 0
+            finally:
+                os._exit(status)
+        return os.waitpid(pid, 0)[1] == 0
+
+    def test_lock4(self):
+        """test WCLock class (shared lock)"""
+        path = self.fixture_file('lock')
+        lock = os.path.join(path, '.osc', 'wc.lock')
+        wc = WCLock(path, shared=True)
+        wc.lock()
+        self.assertEqual(wc.wait_time, 0.0)
+        self.assertTrue(self._child_lock(path, shared=True))
+        self.assertFalse(self._child_lock(path, shared=False))
+        wc.unlock()
+        self.assertFalse(os.path.exists(lock))
+        wc = WCLock(path)
+        wc.lock()
+        self.assertFalse(self._child_lock(path, shared=True))
+        wc.unlock()
+
+    def test_lock5(self):
+        """test WCLock class (wait for an exclusive lock)"""
+        path = self.fixture_file('lock')
+        lock = os.path.join(path, '.osc', 'wc.lock')
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+        if not pid:
+            try:
+                os.close(rfd)
+                wc = WCLock(path, shared=True)
+                wc.lock()
+                os.write(wfd, 'x')
+                time.sleep(0.2)
+                wc.unlock()
+            finally:
+                os._exit(0)
+        os.close(wfd)
+        os.read(rfd, 1)
+        os.close(rfd)
+        with wc_lock(path) as wc:
+            self.assertTrue(wc.wait_time > 0.0)
+            self.assertTrue(os.path.isfile(lock))
+        os.waitpid(pid, 0)
+        self.assertFalse(os.path.exists(lock))
+
+    def test_lock7(self):
+        """test WCLock class (a waiting thread does not block other wcs)"""
+        path = self.fixture_file('lock')
+        other = self.fixture_file('package')
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+        if not pid:
+            try:
+                os.close(rfd)
+                wc = WCLock(path)
+                wc.lock()
+                os.write(wfd, 'x')
+                time.sleep(0.5)
+                wc.unlock()
+            finally:
+                os._exit(0)
+        os.close(wfd)
+        os.read(rfd, 1)
+        os.close(rfd)
+        other_wc = WCLock(other)
+        other_wc.lock()
+        wc = WCLock(path)
+        thread = threading.Thread(target=wc.lock)
+        thread.start()
+        time.sleep(0.1)
+        other_wc.unlock()
+        with wc_lock(other, shared=True):
+            pass
+        # the thread still waits for the lock
+        self.assertTrue(thread.is_alive())
+        thread.join()
+        os.waitpid(pid, 0)
+        self.assertTrue(wc.wait_time > 0.0)
+        wc.unlock()
+        self.assertTrue(self._child_lock(other, shared=False))
+
     def test22(self):
         """test wc_parent (package)"""
         path = self.fixture_file('prj1', 'added')
@@ -310,5 +483,239 @@ class TestWCUtil(OscTest):
                           ext_storedir=storedir)
         self.assertFalse(os.path.exists(path))
 
+    def _pretend_later(self):
+        """Pretend that digests are computed a few seconds later."""
+        class Time(object):
+            @staticmethod
+            def time():
+                return time.time() + 5
+        osc2.wc.util.time = Time
+
+    def _stat_cache(self, path):
+        digests = []
+
+        def digest_func(filename):
+            digests.append(filename)
+            return open(filename, 'r').read().strip()
+        return WCStatCache(path, digest_func), digests
+
+    def test_stat_cache1(self):
+        """digest is only computed if the stat data changes"""
+        path = self.fixture_file('package')
+        fname = os.path.join(path, 'foo')
+        with open(fname, 'w') as f:
+            f.write('abc\n')
+        os.utime(fname, (-1, 1000))
+        self._pretend_later()
+        cache, digests = self._stat_cache(path)
+        self.assertEqual(cache.digest('foo'), 'abc')
+        self.assertEqual(cache.digest('foo'), 'abc')
+        self.assertEqual(digests, [fname])
+        # the entry is persisted
+        cache, digests = self._stat_cache(path)
+        self.assertEqual(cache.digest('foo'), 'abc')
+        self.assertEqual(digests, [])
+        with open(fname, 'w') as f:
+            f.write('xyz\n')
+        os.utime(fname, (-1, 1000))
+        self.assertEqual(cache.digest('foo'), 'xyz')
+        self.assertEqual(digests, [fname])
+
+    def test_stat_cache2(self):
+        """racy entries are not trusted"""
+        path = self.fixture_file('package')
+        fname = os.path.join(path, 'foo')
+        with open(fname, 'w') as f:
+            f.write('abc\n')
+        cache, digests = self._stat_cache(path)
+        self.assertEqual(cache.digest('foo'), 'abc')
+        self.assertEqual(cache.digest('foo'), 'abc')
+        self.assertEqual(digests, [fname, fname])
+
+    def test_stat_cache3(self):
+        """corrupt cache file and compaction"""
+        path = self.fixture_file('package')
+        fname = os.path.join(path, 'foo')
+        with open(fname, 'w') as f:
+            f.write('abc\n')
+        os.utime(fname, (-1, 1000))
+        cache_file = os.path.join(path, '.osc', '_md5cache')
+        with open(cache_file, 'w') as f:
+            f.write('garbage\n1 2 3 4 a b foo\nabc 1 2')
+        self._pretend_later()
+        cache, digests = self._stat_cache(path)
+        self.assertEqual(cache.digest('foo'), 'abc')
+        for i in range(100):
+            cache._entries['foo'] = (None, 0, 'abc')
+            cache.digest('foo')
+        self.assertEqual(len(digests), 101)
+        cache, digests = self._stat_cache(path)
+        self.assertEqual(cache.digest('foo'), 'abc')
+        self.assertEqual(digests, [])
+        self.assertEqual(len(open(cache_file, 'r').readlines()), 1)
+
+    def test_stat_cache4(self):
+        """compute multiple digests concurrently"""
+        path = self.fixture_file('package')
+        filenames = ['file%d' % i for i in range(10)]
+        for filename in filenames:
+            with open(os.path.join(path, filename), 'w') as f:
+                f.write(filename)
+        cache, digests = self._stat_cache(path)
+        result = cache.digests(filenames, jobs=4)
+        self.assertEqual(result, dict([(f, f) for f in filenames]))
+        self.assertEqual(sorted(digests),
+                         sorted([os.path.join(path, f) for f in filenames]))
+        # the entries are racy (the files were just written)
+        self.assertEqual(cache.digests(filenames[:2], jobs=4),
+                         {'file0': 'file0', 'file1': 'file1'})
+        self.assertEqual(len(digests), 12)
+        self.assertRaises(OSError, cache.digests, ['nonexistent'])
+
+    def test_tracker1(self):
+        """test the entry tracker's index"""
+        path = self.fixture_file('prj1')
+        packages = wc_read_packages(path)
+        self.assertEqual(packages.find('added').get('state'), 'A')
+        self.assertIsNone(packages.find('foo'))
+        packages.add('foo', 'A')
+        self.assertEqual(packages.find('foo').get('state'), 'A')
+        self.assertRaises(ValueError, packages.add, 'foo', ' ')
+        packages.set('foo', ' ')
+        self.assertEqual(packages.find('foo').get('state'), ' ')
+        packages.remove('missing')
+        self.assertIsNone(packages.find('missing'))
+        self.assertRaises(ValueError, packages.remove, 'missing')
+        self.assertEqual([p.get('name') for p in packages],
+                         ['added', 'non-standard', 'foo'])
+
+    def test_tracker2(self):
+        """test the entry tracker's merge"""
+        path = self.fixture_file('prj1')
+        packages = wc_read_packages(path)
+        packages.merge({'added': ' ', 'bar': 'A'})
+        self.assertEqual(packages.find('added').get('state'), ' ')
+        self.assertEqual(packages.find('bar').get('state'), 'A')
+        self.assertIsNone(packages.find('missing'))
+        self.assertIsNone(packages.find('non-standard'))
+        packages = wc_read_packages(path)
+        self.assertEqual(sorted([p.get('name') for p in packages]),
+                         ['added', 'bar'])
+
+    def test_diff_prune1(self):
+        """remove the least recently used diff dirs"""
+        path = self.fixture_file('package')
+        for mtime, revision in enumerate(['rev2', 'rev1', 'rev3']):
+            diff_path = wc_diff_mkdir(path, revision)
+            with open(os.path.join(diff_path, 'file'), 'w') as f:
+                f.write('x' * 10)
+            os.utime(diff_path, (mtime, mtime))
+        self.assertEqual(wc_diff_revisions(path), ['rev2', 'rev1', 'rev3'])
+        # reusing a diff dir marks it as recently used
+        wc_diff_mkdir(path, 'rev2')
+        self.assertEqual(wc_diff_revisions(path), ['rev1', 'rev3', 'rev2'])
+        self.assertEqual(wc_diff_prune(path, 25), ['rev1'])
+        self.assertEqual(wc_diff_prune(path, 20), [])
+        self.assertEqual(wc_diff_revisions(path), ['rev3', 'rev2'])
+        # remove everything
+        self.assertEqual(wc_diff_prune(path), ['rev3', 'rev2'])
+        self.assertFalse(os.path.exists(os.path.join(path, '.osc', 'diff')))
+        self.assertEqual(wc_diff_revisions(path), [])
+        self.assertEqual(wc_diff_prune(path), [])
+
+    def test_sparse1(self):
+        """read and write the sparse checkout patterns"""
+        path = self.fixture_file('package')
+        self.assertEqual(wc_read_sparse(path), [])
+        wc_write_sparse(path, ['*.tar.*', 'foo'])
+        self.assertEqual(wc_read_sparse(path), ['*.tar.*', 'foo'])
+        self.assertRaises(ValueError, wc_write_sparse, path, ['a\nb'])
+        wc_write_sparse(path, [])
+        self.assertEqual(wc_read_sparse(path), [])
+
+    def test_sqlite1(self):
+        """init a sqlite wc"""
+        path = self.fixture_file('init')
+        wc_init(path, sqlite=True)
+        self.assertTrue(wc_is_sqlite(path))
+        storedir = self.fixture_file('init', '.osc')
+        self.assertEqual(sorted(os.listdir(storedir)),
+                         ['_version', '_wc.db', 'data'])
+        self.assertEqual(missing_storepaths(path, '_files'), ['_files'])
+        wc_write_files(path, '<directory rev="1"/>')
+        self.assertEqual(missing_storepaths(path, '_files'), [])
+        self.assertFalse(wc_is_sqlite(self.fixture_file('package')))
+
+    def test_sqlite2(self):
+        """read and write a sqlite tracker"""
+        path = self.fixture_file('init')
+        wc_init(path, sqlite=True)
+        wc_write_files(path, ('<directory rev="1" srcmd5="abc">'
+                              '<entry name="foo" state=" " md5="x"/>'
+                              '<entry name="bar" state="A"/></directory>'))
+        files = wc_read_files(path)
+        self.assertEqual(files.revision_data(),
+                         {'rev': '1', 'srcmd5': 'abc'})
+        self.assertEqual(files.find('foo').get('md5'), 'x')
+        self.assertIsNone(files.find('missing'))
+        files.add('baz', '?')
+        files.set('foo', 'M')
+        files.remove('bar')
+        self.assertRaises(ValueError, files.add, 'foo', 'A')
+        self.assertRaises(ValueError, files.remove, 'bar')
+        files.write()
+        files = wc_read_files(path)
+        self.assertEqual([(e.get('name'), e.get('state')) for e in files],
+                         [('foo', 'M'), ('baz', '?')])
+        self.assertEqual(files.find('foo').getparent().get('rev'), '1')
+        # the raw data is a complete xml document
+        data = wc_read_files(path, raw=True)
+        self.assertTrue('<entry name="baz" state="?"/>' in data)
+        tracker = SQLiteFileTracker(path, data)
+        tracker.write()
+        self.assertEqual([e.get('name') for e in wc_read_files(path)],
+                         ['foo', 'baz'])
+
+    def test_sqlite3(self):
+        """stat cache of a sqlite wc"""
+        path = self.fixture_file('init')
+        wc_init(path, sqlite=True)
+        with open(os.path.join(path, 'file'), 'w') as f:
+            f.write('foo\n')
+        cache = WCStatCache(path, lambda filename: 'digest')
+        self.assertEqual(cache.digest('file'), 'digest')
+        cache.write()
+        # the entry is stored in the database
+        cache = WCStatCache(path, None)
+        self.assertEqual([e[0] for e in cache.items()], ['file'])
+        self.assertEqual(cache._entry('file')[2], 'digest')
+        self.assertIsNone(cache._entry('missing'))
+        self._not_exists(path, '_md5cache', store=True)
+
+    def test_sqlite4(self):
+        """the database connections are shared and bounded"""
+        paths = [self.fixture_file('init', 'wc1'),
+                 self.fixture_file('init', 'wc2')]
+        for path in paths:
+            os.mkdir(path)
+            wc_init(path, sqlite=True)
+        limit = osc2.wc.util.WC_DB_CONNECTIONS
+        osc2.wc.util.WC_DB_CONNECTIONS = 1
+        try:
+            dbs = [WCDatabase(path) for path in paths + paths]
+            for db in dbs:
+                db.execute(('INSERT INTO journal (record) VALUES (?)',
+                            ('x', )))
+                self.assertEqual(len(osc2.wc.util._db_connections), 1)
+            # both objects of a wc use the same connection
+            for db in dbs[:2]:
+                self.assertEqual(db.query('SELECT COUNT(*) FROM journal'),
+                                 [(2, )])
+            dbs[1].close()
+            self.assertEqual(osc2.wc.util._db_connections, {})
+            dbs[1].close()
+        finally:
+            osc2.wc.util.WC_DB_CONNECTIONS = limit
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,177 @@
+import os
+import time
+import threading
+import unittest
+
+import osc2.wc.package
+import osc2.wc.project
+from test.osctest import OscTest
+from osc2.wc.project import Project
+from osc2.wc.package import Package
+from osc2.wc.util import _storefile
+from osc2.wc.watch import WCWatcher, DirtySet, dirty_set, _now
+
+
+def suite():
+    return unittest.makeSuite(TestWatch)
+
+
+class TestWatch(OscTest):
+    def __init__(self, *args, **kwargs):
+        kwargs['fixtures_dir'] = os.path.join('wc', 'test_package_fixtures')
+        super(TestWatch, self).__init__(*args, **kwargs)
+
+    def setUp(self):
+        super(TestWatch, self).setUp()
+        self._stop = None
+        self._thread = None
+
+    def tearDown(self):
+        self._stop_watcher()
+        super(TestWatch, self).tearDown()
+
+    def _start_watcher(self, path):
+        """Watch path in a separate thread."""
+        try:
+            watcher = WCWatcher(path)
+        except OSError:
+            self.skipTest('inotify is not available')
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=watcher.run,
+                                        args=(self._stop, 0.05))
+        self._thread.start()
+        journal = _storefile(path, '_dirty')
+        deadline = time.time() + 5
+        while not os.path.exists(journal):
+            self.assertTrue(time.time() < deadline)
+            time.sleep(0.01)
+        return journal
+
+    def _stop_watcher(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def test_dirty_set1(self):
+        """test DirtySet"""
+        dirty = DirtySet(10, {'foo': 20, 'bar': 30})
+        self.assertTrue(dirty.is_dirty('foo', 5))
+        self.assertTrue(dirty.is_dirty('foo', 20))
+        self.assertFalse(dirty.is_dirty('foo', 21))
+        self.assertTrue(dirty.is_dirty('bar', 21))
+        self.assertFalse(dirty.is_dirty('baz', 11))
+        # a change of the prefix dir affects all files
+        dirty = DirtySet(10, {'pkg': 20, 'pkg/foo': 30}, 'pkg')
+        self.assertTrue(dirty.is_dirty('bar', 15))
+        self.assertFalse(dirty.is_dirty('bar', 25))
+        self.assertTrue(dirty.is_dirty('foo', 25))
+
+    def test_dirty_set2(self):
+        """test dirty_set (unwatched wc)"""
+        path = self.fixture_file('status1_no_conflict')
+        self.assertIsNone(dirty_set(path))
+
+    def test_watch1(self):
+        """test watch a package wc"""
+        path = self.fixture_file('status1_no_conflict')
+        journal = self._start_watcher(path)
+        pkg = Package(path)
+        self.assertEqual(pkg.status('file1'), ' ')
+        self.assertEqual(pkg.status('modified'), 'M')
+        dirty = dirty_set(path)
+        self.assertIsNotNone(dirty)
+        # all files are dirty because no digest was computed afterwards
+        self.assertTrue(dirty.is_dirty('file1', dirty.started - 1))
+        self.assertFalse(dirty.is_dirty('file1', dirty.started))
+        # compute the digests and modify a file afterwards
+        self.assertEqual(pkg.statuses('file1', 'modified'),
+                         {'file1': ' ', 'modified': 'M'})
+        time.sleep(0.01)
+        with open(os.path.join(path, 'file1'), 'w') as f:
+            f.write('changed\n')
+        self.assertEqual(pkg.statuses('file1', 'modified'),
+                         {'file1': 'M', 'modified': 'M'})
+        # an unchanged file is trusted without a stat call
+        pkg._stat_cache.dirty = dirty_set(path)
+        try:
+            self.assertIsNotNone(pkg._stat_cache.unchanged_digest('file1'))
+            self.assertIsNotNone(
+                pkg._stat_cache.unchanged_digest('modified'))
+            os.unlink(os.path.join(path, 'modified'))
+            pkg._stat_cache.dirty = dirty_set(path)
+            self.assertIsNone(pkg._stat_cache.unchanged_digest('modified'))
+        finally:
+            pkg._stat_cache.dirty = None
+        self.assertEqual(pkg.status('modified'), '!')
+        self._stop_watcher()
+        self.assertFalse(os.path.exists(journal))
+        self.assertIsNone(dirty_set(path))
+
+    def test_watch2(self):
+        """test watch a project wc (the package is not watched itself)"""
+        prj_path = self.fixture_file('watch_prj')
+        os.makedirs(os.path.join(prj_path, 'pkg'))
+        with open(os.path.join(prj_path, 'pkg', 'foo'), 'w') as f:
+            f.write('foo\n')
+        prj = Project.init(prj_path, 'prj', 'http://localhost')
+        prj.add('pkg')
+        path = os.path.join(prj_path, 'pkg')
+        self._start_watcher(prj_path)
+        dirty = dirty_set(path)
+        self.assertIsNotNone(dirty)
+        self.assertFalse(dirty.is_dirty('foo', dirty.started))
+        since = _now()
+        time.sleep(0.01)
+        with open(os.path.join(path, 'foo'), 'a') as f:
+            f.write('more\n')
+        dirty = dirty_set(path)
+        self.assertTrue(dirty.is_dirty('foo', since))
+        self.assertFalse(dirty.is_dirty('bar', since))
+        # a new package dir is watched as well
+        os.mkdir(os.path.join(prj_path, 'new'))
+        dirty = dirty_set(prj_path)
+        self.assertTrue(dirty.is_dirty('new', since))
+        since = _now()
+        time.sleep(0.01)
+        with open(os.path.join(prj_path, 'new', 'file'), 'w') as f:
+            f.write('new\n')
+        dirty = dirty_set(prj_path)
+        self.assertTrue(dirty.is_dirty(os.path.join('new', 'file'), since))
+        self.assertFalse(dirty.is_dirty(os.path.join('pkg', 'foo'), since))
+
+    def test_watch3(self):
+        """test watch a project wc (the packages share the DirtySet)"""
+        prj_path = self.fixture_file('watch_prj')
+        for package in ('pkg1', 'pkg2'):
+            os.makedirs(os.path.join(prj_path, package))
+        prj = Project.init(prj_path, 'prj', 'http://localhost')
+        prj.add('pkg1')
+        prj.add('pkg2')
+        self._start_watcher(prj_path)
+        calls = []
+
+        def counting_dirty_set(path, *args, **kwargs):
+            calls.append(path)
+            return dirty_set(path, *args, **kwargs)
+        osc2.wc.package.dirty_set = counting_dirty_set
+        osc2.wc.project.dirty_set = counting_dirty_set
+        try:
+            sourceinfo = {'pkg1': None, 'pkg2': None}
+            uinfo = prj._calculate_updateinfo(sourceinfo=sourceinfo)
+            # the packages were added (but is_updateable was called)
+            self.assertEqual(uinfo.conflicted, ['pkg1', 'pkg2'])
+            self.assertEqual(calls, [prj_path])
+            self.assertIsNone(prj.package('pkg1')._stat_cache.dirty)
+            # a package which is used on its own consults the watcher
+            self.assertEqual(prj.package('pkg2').has_conflicts(), [])
+            self.assertEqual(calls, [prj_path, os.path.join(prj_path,
+                                                            'pkg2')])
+        finally:
+            osc2.wc.package.dirty_set = dirty_set
+            osc2.wc.project.dirty_set = dirty_set
+        self.assertEqual(DirtySet(10, {}, 'prj').subset('pkg')._prefix,
+                         os.path.join('prj', 'pkg'))
+
+if __name__ == '__main__':
+    unittest.main()